@@ -14,8 +14,11 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 
 from src.database import engine, SessionLocal, Base
-from src.routers import auth, public, services
+from src.routers import access, auth, metrics, public, reports, services
+from src.attendance import AttendanceRollup
 from src.config import settings
+from src.mqtt_async import start_async_listener
+from src.loggers import configure_logging, stop_logging
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -24,10 +27,18 @@ Base.metadata.create_all(bind=engine)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager for startup and shutdown events"""
-    # Startup
+    configure_logging()
+    # Startup: card readers can be served by this process instead of a separate worker
+    mqtt_worker = await start_async_listener() if settings.MQTT_IN_PROCESS else None
+    rollup = AttendanceRollup(SessionLocal, settings.ATTENDANCE_ROLLUP_SECONDS,
+                              settings.ATTENDANCE_ROLLUP_DAYS).start() if settings.ATTENDANCE_ROLLUP_ENABLED else None
     yield
-    # Shutdown
-    pass
+    if rollup is not None:
+        rollup.stop()
+    # Shutdown: stop taking swipes, finish the ones in flight, flush their rows
+    if mqtt_worker is not None:
+        await mqtt_worker.stop()
+    stop_logging()
 
 
 app = FastAPI(
@@ -54,6 +65,9 @@ templates = Jinja2Templates(directory="src/templates")
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(public.router, tags=["public"])
 app.include_router(services.router, prefix="/services", tags=["services"])
+app.include_router(metrics.router, tags=["metrics"])
+app.include_router(access.router, prefix="/access", tags=["access"])
+app.include_router(reports.router, prefix="/reports", tags=["reports"])
 
 
 # Exception handlers
@@ -0,0 +1,80 @@
+"""integer chip id with a unique index
+
+Revision ID: 3b7d2c9e4a61
+Revises: 80486f3d713c
+Create Date: 2026-10-16 09:12:40.118203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b7d2c9e4a61'
+down_revision = '80486f3d713c'
+
+import logging
+import string
+
+from alembic import op
+import sqlalchemy as sa
+
+log = logging.getLogger('alembic.runtime.migration')
+
+BATCH_SIZE = 1000
+
+users = sa.table('users',
+                 sa.column('id', sa.Integer),
+                 sa.column('chip_number', sa.String),
+                 sa.column('chip_id', sa.BigInteger))
+
+
+def chip_id(chip_number):
+    # Frozen copy of src.data.util.normalize_chip as of this revision
+    text = (chip_number or '').strip()
+    if text[:2] in ('0x', '0X'):
+        text, base = text[2:], 16
+    else:
+        base = 10 if text.isdigit() else 16
+    if not text or not text.isascii() or not set(string.hexdigits).issuperset(text):
+        return None
+    chip = int(text, base)
+    return chip if chip <= 10 ** 10 - 1 else None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('chip_id', sa.BigInteger(), nullable=True))
+
+    # Backfill in id order, one batch per round trip; when several users
+    # share a chip the oldest one keeps it, as find_by_chip did
+    connection = op.get_bind()
+    update = users.update().where(users.c.id == sa.bindparam('user_id'))\
+        .values(chip_id=sa.bindparam('new_chip_id'))
+    seen = set()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(users.c.id, users.c.chip_number)
+            .where(users.c.id > last_id).order_by(users.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        values = []
+        for user_id, chip_number in rows:
+            chip = chip_id(chip_number)
+            if chip is None:
+                log.warning("users.id %s: chip number %r is not a chip, chip_id left empty", user_id, chip_number)
+            elif chip in seen:
+                log.warning("users.id %s: chip %s already belongs to another user, chip_id left empty",
+                            user_id, chip)
+            else:
+                seen.add(chip)
+                values.append({'user_id': user_id, 'new_chip_id': chip})
+        if values:
+            connection.execute(update, values)
+
+    op.create_index('ix_users_chip_id', 'users', ['chip_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_index('ix_users_chip_id')
+        batch_op.drop_column('chip_id')
@@ -0,0 +1,22 @@
+"""carddata index for duplicate checks of uploaded swipes
+
+Revision ID: 5f8b2e7a9c13
+Revises: c51e8d3f0a27
+Create Date: 2026-10-16 23:58:12.402915
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5f8b2e7a9c13'
+down_revision = 'c51e8d3f0a27'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_carddata_card_number_time', 'carddata', ['card_number', 'time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_carddata_card_number_time', table_name='carddata')
@@ -0,0 +1,22 @@
+"""carddata index on time for month and day ranges
+
+Revision ID: 7a1c9d3e5b20
+Revises: 5f8b2e7a9c13
+Create Date: 2026-10-17 00:21:47.019385
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7a1c9d3e5b20'
+down_revision = '5f8b2e7a9c13'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_carddata_time', 'carddata', ['time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_carddata_time', table_name='carddata')
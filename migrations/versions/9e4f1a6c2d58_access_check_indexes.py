@@ -0,0 +1,25 @@
+"""indexes for the single-statement access check
+
+Revision ID: 9e4f1a6c2d58
+Revises: 3b7d2c9e4a61
+Create Date: 2026-10-16 11:40:02.531977
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9e4f1a6c2d58'
+down_revision = '3b7d2c9e4a61'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_user_has_group_user_id_group_id', 'user_has_group', ['user_id', 'group_id'], unique=False)
+    op.create_index('ix_group_has_timecard_group_id_timecard_id', 'group_has_timecard',
+                    ['group_id', 'timecard_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_group_has_timecard_group_id_timecard_id', table_name='group_has_timecard')
+    op.drop_index('ix_user_has_group_user_id_group_id', table_name='user_has_group')
@@ -0,0 +1,75 @@
+"""daily attendance rollup of carddata
+
+Revision ID: b83e6f1d2a94
+Revises: 7a1c9d3e5b20
+Create Date: 2026-10-17 09:12:40.318552
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b83e6f1d2a94'
+down_revision = '7a1c9d3e5b20'
+
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+# Frozen copy of src.data.models.carddata.MEAL_VOUCHER_HOURS as of this revision
+MEAL_VOUCHER_MINUTES = 3 * 60
+
+carddata = sa.table('carddata', sa.column('id_user', sa.Integer), sa.column('time', sa.DateTime))
+
+
+def next_month(moment):
+    return datetime(moment.year + 1, 1, 1) if moment.month == 12 else datetime(moment.year, moment.month + 1, 1)
+
+
+def upgrade():
+    daily_attendance = op.create_table('daily_attendance',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('first_in', sa.DateTime(), nullable=False),
+    sa.Column('last_out', sa.DateTime(), nullable=False),
+    sa.Column('swipes', sa.Integer(), nullable=False),
+    sa.Column('worked_minutes', sa.Integer(), nullable=False),
+    sa.Column('meal_voucher', sa.Boolean(name='meal_voucher'), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='fk_daily_attendance_user_id_users'),
+    sa.PrimaryKeyConstraint('id', name='pk_daily_attendance')
+    )
+    op.create_index('ix_daily_attendance_user_id_day', 'daily_attendance', ['user_id', 'day'], unique=True)
+    op.create_index('ix_daily_attendance_day', 'daily_attendance', ['day'], unique=False)
+
+    # Existing swipes, one month of carddata (a range on ix_carddata_time) at a time
+    connection = op.get_bind()
+    first, last = connection.execute(sa.select(sa.func.min(carddata.c.time), sa.func.max(carddata.c.time))).one()
+    if first is None:
+        return
+    month = datetime(first.year, first.month, 1)
+    while month <= last:
+        end = next_month(month)
+        days = {}
+        rows = connection.execute(sa.select(carddata.c.id_user, carddata.c.time).where(
+            carddata.c.time >= month, carddata.c.time < end, carddata.c.id_user.isnot(None)))
+        for user_id, moment in rows:
+            entry = days.get((user_id, moment.date()))
+            if entry is None:
+                days[(user_id, moment.date())] = [moment, moment, 1]
+            else:
+                entry[0], entry[1], entry[2] = min(entry[0], moment), max(entry[1], moment), entry[2] + 1
+        values = []
+        for (user_id, day), (first_in, last_out, swipes) in days.items():
+            minutes = int((last_out - first_in).total_seconds()) // 60
+            values.append({'user_id': user_id, 'day': day, 'first_in': first_in, 'last_out': last_out,
+                           'swipes': swipes, 'worked_minutes': minutes,
+                           'meal_voucher': minutes >= MEAL_VOUCHER_MINUTES})
+        if values:
+            op.bulk_insert(daily_attendance, values)
+        month = end
+
+
+def downgrade():
+    op.drop_index('ix_daily_attendance_day', table_name='daily_attendance')
+    op.drop_index('ix_daily_attendance_user_id_day', table_name='daily_attendance')
+    op.drop_table('daily_attendance')
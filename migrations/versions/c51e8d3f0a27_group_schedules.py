@@ -0,0 +1,81 @@
+"""weekly group schedules as second-of-week intervals
+
+Revision ID: c51e8d3f0a27
+Revises: 9e4f1a6c2d58
+Create Date: 2026-10-16 14:05:31.774120
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c51e8d3f0a27'
+down_revision = '9e4f1a6c2d58'
+
+from alembic import op
+import sqlalchemy as sa
+
+BATCH_SIZE = 1000
+DAY_SECONDS = 24 * 60 * 60
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+groups = sa.table('groups', sa.column('id', sa.Integer), sa.column('access_time_from', sa.Time),
+                  sa.column('access_time_to', sa.Time), *(sa.column(day, sa.Integer) for day in DAYS))
+
+
+def intervals(row):
+    # Frozen copy of src.schedule.Schedule.from_legacy as of this revision;
+    # a window ending before it starts runs past midnight
+    if row.access_time_from is None or row.access_time_to is None:
+        return []
+    start = row.access_time_from.hour * 3600 + row.access_time_from.minute * 60 + row.access_time_from.second
+    end = row.access_time_to.hour * 3600 + row.access_time_to.minute * 60 + row.access_time_to.second + 1
+    result = []
+    for day, name in enumerate(DAYS):
+        if getattr(row, name) != 1:
+            continue
+        offset = day * DAY_SECONDS
+        if start < end:
+            result.append((offset + start, offset + end))
+        else:
+            following = (day + 1) % 7 * DAY_SECONDS
+            result.extend([(offset + start, offset + DAY_SECONDS), (following, following + end)])
+    merged = []
+    for first, last in sorted(result):
+        if merged and first <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+def upgrade():
+    schedules = op.create_table('group_schedules',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('second_from', sa.Integer(), nullable=False),
+    sa.Column('second_to', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['groups.id'], name='fk_group_schedules_group_id_groups'),
+    sa.PrimaryKeyConstraint('id', name='pk_group_schedules')
+    )
+
+    # Every group gets the schedule of its day flags and time window
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(groups).where(groups.c.id > last_id).order_by(groups.c.id).limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        values = [{'group_id': row.id, 'second_from': first, 'second_to': last}
+                  for row in rows for first, last in intervals(row)]
+        if values:
+            op.bulk_insert(schedules, values)
+
+    op.create_index('ix_group_schedules_group_id_second_from', 'group_schedules',
+                    ['group_id', 'second_from'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_group_schedules_group_id_second_from', table_name='group_schedules')
+    op.drop_table('group_schedules')
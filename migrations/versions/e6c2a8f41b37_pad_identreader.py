@@ -0,0 +1,37 @@
+"""zero pad timecard.identreader to the form readers are looked up by
+
+Revision ID: e6c2a8f41b37
+Revises: b83e6f1d2a94
+Create Date: 2026-10-17 15:40:12.904417
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e6c2a8f41b37'
+down_revision = 'b83e6f1d2a94'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Frozen copy of src.data.util.normalize_reader as of this revision
+READER_WIDTH = 10
+
+timecard = sa.table('timecard', sa.column('id', sa.Integer), sa.column('identreader', sa.String))
+
+
+def upgrade():
+    # Readers registered with a short topic were never found by the topic
+    # lookups, which always padded it
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(timecard.c.id, timecard.c.identreader)
+        .where(sa.func.length(timecard.c.identreader) < READER_WIDTH)
+    ).all()
+    for row_id, identreader in rows:
+        connection.execute(timecard.update().where(timecard.c.id == row_id)
+                           .values(identreader=identreader.zfill(READER_WIDTH)))
+
+
+def downgrade():
+    # The original length of a padded topic is not known
+    pass
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Swipe journal benchmark
+Measures what journaling adds to the door response path: door_test is run
+on in-memory rules without a journal, with the group-commit journal and
+with an fsync per swipe, and the latency percentiles are compared
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('APP_KEY', 'bench-journal')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+# pylint: disable=wrong-import-position
+from src.access_index import AccessIndex, ChipHolder, IndexState
+from src.mqtt_handler import MQTTHandler
+from src.reader_registry import ReaderInfo, ReaderRegistry
+from src.schedule import WEEK_SECONDS, Schedule
+from src.swipe_journal import SwipeJournal
+from src.write_behind import WriteBehindQueue
+
+READERS = 20
+CHIPS = 1000
+
+
+class NullClient:
+    """MQTT client that discards publishes"""
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class Message:
+    """Minimal stand-in for paho's MQTTMessage"""
+
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+
+def build_handler(journal=None) -> MQTTHandler:
+    """Handler deciding from memory only; rows pile up in an unstarted write-behind queue"""
+    topics = [str(100 + i).zfill(10) for i in range(READERS)]
+    readers = ReaderRegistry(session_factory=None)
+    readers.load({topic: ReaderInfo(i + 1, f"door/{i + 1}/open", f"reader {i + 1}")
+                  for i, topic in enumerate(topics)})
+    always = Schedule([(0, WEEK_SECONDS)])
+    holders = {chip: ChipHolder(chip, f"K{chip}") for chip in range(1, CHIPS + 1)}
+    schedules = {chip: {topic: always for topic in topics} for chip in holders}
+    index = AccessIndex(session_factory=None)
+    index.load(IndexState(holders, schedules))
+
+    handler = MQTTHandler(None, index, WriteBehindQueue(session_factory=None), readers=readers,
+                          journal=journal)
+    handler.client = NullClient()
+    return handler
+
+
+def run(handler: MQTTHandler, swipes: int):
+    """Latencies of `swipes` door_test calls in microseconds"""
+    messages = [Message(str(100 + i % READERS).zfill(10), str(1 + i % (CHIPS + 100)).encode())
+                for i in range(swipes)]
+    latencies = []
+    for message in messages:
+        started = time.perf_counter()
+        handler.door_test(message)
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return latencies
+
+
+def report(name: str, latencies, baseline=None):
+    """Print percentiles of one run"""
+    ordered = sorted(latencies)
+    p50 = statistics.median(ordered)
+    p99 = ordered[int(len(ordered) * 0.99) - 1]
+    extra = f"  (+{p50 - baseline:.1f} us p50)" if baseline is not None else ""
+    print(f"{name:<22} p50 {p50:8.1f} us  p99 {p99:8.1f} us  max {ordered[-1]:9.1f} us{extra}")
+    return p50
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description="Swipe journal latency benchmark")
+    parser.add_argument('--swipes', type=int, default=5000, help="door_test calls per run")
+    parser.add_argument('--sync-interval', type=float, default=0.05, help="group-commit interval")
+    args = parser.parse_args()
+
+    # door_test prints every decision; keep that out of the measurement
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w', encoding='utf-8')
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = run(build_handler(), args.swipes)
+
+            grouped = SwipeJournal(os.path.join(directory, 'grouped.journal'),
+                                   sync_interval=args.sync_interval).start()
+            with_journal = run(build_handler(grouped), args.swipes)
+            grouped.stop()
+
+            synced = SwipeJournal(os.path.join(directory, 'synced.journal'))
+            with_fsync = run(build_handler(synced), args.swipes)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print(f"{args.swipes} swipes per run")
+    base = report("no journal", baseline)
+    report("group-commit journal", with_journal, base)
+    report("fsync per swipe", with_fsync, base)
+    print(f"group commit: {grouped.appended} entries in {grouped.syncs} fsyncs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+MQTT door pipeline load generator
+Seeds a database with users, groups and readers, then drives
+MQTTHandler.door_test with swipes at a configurable rate and distribution,
+either in-process through a fake client or through a local broker, and
+reports throughput, decision latency percentiles and database query counts
+
+The database comes from DATABASE_URL (a temporary SQLite file by default);
+it must not contain users yet.
+
+Examples:
+    python scripts/bench_mqtt.py --users 5000 --swipes 20000
+    python scripts/bench_mqtt.py --query-mode db --workers 4 --rate 500
+    python scripts/bench_mqtt.py --transport broker --write-behind
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import time as clock
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('APP_KEY', 'bench-mqtt')
+TEMPORARY_DATABASE = os.path.join(tempfile.gettempdir(), f'karty-bench-{os.getpid()}.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{TEMPORARY_DATABASE}')
+
+# pylint: disable=wrong-import-position
+import paho.mqtt.client as mqtt
+from sqlalchemy import event, func, insert, select
+
+from src.access_index import AccessIndex
+from src.coalesce import CoalescingWindow
+from src.data.database import db
+from src.data.models import Group, Group_has_timecard, GroupSchedule, Timecard, User, User_has_group
+from src.dispatcher import MessageDispatcher
+from src.metrics import DoorMetrics, MetricsRegistry
+from src.mqtt_broker_stub import BrokerStub
+from src.mqtt_handler import MQTTHandler
+from src.reader_registry import ReaderRegistry
+from src.schedule import Schedule
+from src.write_behind import WriteBehindQueue
+
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+STAGES = ('queue', 'reader_lookup', 'parse', 'access_check', 'user_lookup', 'decision', 'publish', 'persist')
+
+
+class NullClient:
+    """MQTT client that discards publishes"""
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class Message:
+    """Minimal stand-in for paho's MQTTMessage"""
+
+    def __init__(self, topic: str, payload: bytes, timestamp: float):
+        self.topic = topic
+        self.payload = payload
+        self.timestamp = timestamp
+
+
+class RecordingMetrics(DoorMetrics):
+    """DoorMetrics that also keeps the raw timings of every decision"""
+
+    def __init__(self):
+        super().__init__(MetricsRegistry())
+        self.decisions = []
+
+    def record(self, outcome, started, marks, reader=None):
+        self.decisions.append((outcome, started, marks))
+        super().record(outcome, started, marks, reader)
+
+
+class QueryCounter:
+    """Counts statements sent to the database"""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._executed)
+
+    def _executed(self, *args):  # pylint: disable=unused-argument
+        with self._lock:
+            self.count += 1
+
+    def take(self) -> int:
+        """Statements since the previous call"""
+        with self._lock:
+            count, self.count = self.count, 0
+        return count
+
+
+def seed(rng: random.Random, users: int, groups: int, readers: int):
+    """
+    Insert `users` users in 1-3 of `groups` groups, each group allowed on a
+    few of `readers` readers on random days and hours
+
+    Returns:
+        (reader topics, pushopen topic of each reader topic)
+    """
+    topics = [str(100 + i).zfill(10) for i in range(readers)]
+    pushopen = {topic: f"door/{i + 1}/open" for i, topic in enumerate(topics)}
+    group_rows, reader_rows, membership_rows = [], [], []
+    for number in range(1, groups + 1):
+        start = rng.randint(0, 12)
+        group_rows.append({
+            'id': number, 'group_name': f"Skupina {number}",
+            **{day: int(rng.random() < 0.7) for day in DAYS},
+            'access_time_from': clock(start), 'access_time_to': clock(rng.randint(start + 4, 23), 59),
+        })
+        for reader in rng.sample(range(1, readers + 1), min(readers, rng.randint(1, 5))):
+            reader_rows.append({'group_id': number, 'timecard_id': reader})
+    for number in range(1, users + 1):
+        for group in rng.sample(range(1, groups + 1), min(groups, rng.randint(1, 3))):
+            membership_rows.append({'id': len(membership_rows) + 1, 'user_id': number, 'group_id': group})
+
+    with db.transient_session() as session:
+        session.execute(insert(Timecard), [
+            {'id': i + 1, 'timecard_name': f"Ctecka {i + 1}", 'timecard_head': "B",
+             'identreader': topic, 'pushopen': pushopen[topic]}
+            for i, topic in enumerate(topics)])
+        session.execute(insert(Group), group_rows)
+        session.execute(insert(GroupSchedule), [
+            {'group_id': row['id'], 'second_from': start, 'second_to': end}
+            for row in group_rows
+            for start, end in Schedule.from_legacy([row[day] for day in DAYS], row['access_time_from'],
+                                                   row['access_time_to']).intervals])
+        session.execute(insert(User), [
+            {'id': number, 'chip_number': str(number).zfill(10), 'chip_id': number, 'card_number': f"K{number}",
+             'username': f"user{number}", 'email': f"user{number}@example.com", 'verified': True}
+            for number in range(1, users + 1)])
+        session.execute(insert(User_has_group), membership_rows)
+        session.execute(insert(Group_has_timecard), [
+            {'id': i + 1, **row} for i, row in enumerate(reader_rows)])
+    return topics, pushopen
+
+
+def swipes(rng: random.Random, count: int, users: int, topics, distribution: str,
+           skew: float, unknown: float):
+    """
+    `count` (reader topic, chip) pairs
+
+    "zipf" picks chips and readers with weight 1/rank^skew (a few busy doors
+    and regulars), "uniform" picks them evenly. A share of `unknown` swipes
+    uses chips that are not registered.
+    """
+    chips = range(1, users + 1)
+    if distribution == 'zipf':
+        chip_weights = [1 / rank ** skew for rank in range(1, users + 1)]
+        reader_weights = [1 / rank ** skew for rank in range(1, len(topics) + 1)]
+    else:
+        chip_weights, reader_weights = None, None
+    picked_chips = rng.choices(chips, chip_weights, k=count)
+    picked_readers = rng.choices(topics, reader_weights, k=count)
+    return [(topic, users + 1 + rng.randrange(users) if rng.random() < unknown else chip)
+            for topic, chip in zip(picked_readers, picked_chips)]
+
+
+def build_handler(args, metrics: RecordingMetrics) -> MQTTHandler:
+    """Handler wired with the components selected on the command line"""
+    access_index, readers = None, None
+    if args.query_mode == 'index':
+        access_index, readers = AccessIndex(db.session_factory), ReaderRegistry(db.session_factory)
+        access_index.refresh()
+        readers.refresh()
+    writer = None
+    if args.write_behind:
+        writer = WriteBehindQueue(db.session_factory, batch_size=args.batch_size).start()
+    handler = MQTTHandler(db.session, access_index, writer, readers=readers, metrics=metrics)
+    if args.coalesce > 0:
+        handler.coalescer = CoalescingWindow(args.coalesce)
+    if args.workers > 0:
+        handler.dispatcher = MessageDispatcher(handler.door_test, workers=args.workers,
+                                               queue_size=args.queue_size,
+                                               on_overflow=handler.on_overflow).start()
+    return handler
+
+
+def paced(items, rate: float):
+    """
+    Yield (scheduled monotonic time, item) at `rate` items per second
+
+    Latency is counted from the scheduled time, so a generator that falls
+    behind does not hide the delay (no coordinated omission). A rate of 0
+    sends as fast as possible.
+    """
+    started = time.monotonic()
+    for number, item in enumerate(items):
+        if rate > 0:
+            scheduled = started + number / rate
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            yield scheduled, item
+        else:
+            yield time.monotonic(), item
+
+
+def run_direct(handler: MQTTHandler, load, rate: float):
+    """Hand the swipes to on_message in this process; returns the seconds until all were decided"""
+    handler.client = NullClient()
+    started = time.monotonic()
+    for scheduled, (topic, chip) in paced(load, rate):
+        handler.on_message(None, None, Message(topic, str(chip).encode(), scheduled))
+    if handler.dispatcher is not None:
+        handler.dispatcher.stop()
+    return time.monotonic() - started, None
+
+
+def run_broker(handler: MQTTHandler, load, rate: float, broker: str, topics, pushopen, users: int):
+    """
+    Publish the swipes to a broker the handler is subscribed to
+
+    Returns:
+        (seconds until all were decided, end-to-end latencies of the answered swipes)
+    """
+    stub = None
+    if broker:
+        host, _, port = broker.partition(':')
+        port = int(port or 1883)
+    else:
+        stub = BrokerStub().start()
+        host, port = stub.host, stub.port
+
+    sent = defaultdict(deque)
+    round_trips = []
+
+    def answered(client, userdata, msg):  # pylint: disable=unused-argument
+        queued = sent[msg.topic]
+        if queued:
+            round_trips.append(time.monotonic() - queued.popleft())
+
+    door = mqtt.Client()
+    door.on_message = answered
+    door.connect(host, port)
+    door.subscribe("door/+/open")
+    door.loop_start()
+    handler.track_reader_topics().sync(topics)
+    handler.connect(host, port)
+    handler.client.loop_start()
+    try:
+        time.sleep(0.5)
+        metrics = handler.metrics
+        started = time.monotonic()
+        for _, (topic, chip) in paced(load, rate):
+            if chip <= users:
+                # Registered chips are answered, in order per reader
+                sent[pushopen[topic]].append(time.monotonic())
+            door.publish(topic, payload=str(chip))
+        deadline = time.monotonic() + 60
+        while len(metrics.decisions) < len(load) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if handler.dispatcher is not None:
+            handler.dispatcher.stop()
+        elapsed = time.monotonic() - started
+        time.sleep(0.2)
+    finally:
+        door.loop_stop()
+        door.disconnect()
+        handler.client.loop_stop()
+        if stub is not None:
+            stub.stop()
+    return elapsed, round_trips
+
+
+def percentiles(seconds):
+    """p50/p95/p99/max of latencies in seconds, formatted in microseconds"""
+    ordered = sorted(seconds)
+    if not ordered:
+        return "no samples"
+    rank = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))]  # noqa: E731
+    return (f"p50 {statistics.median(ordered) * 1e6:9.1f} us  p95 {rank(0.95) * 1e6:9.1f} us  "
+            f"p99 {rank(0.99) * 1e6:9.1f} us  max {ordered[-1] * 1e6:10.1f} us")
+
+
+def report(args, metrics: RecordingMetrics, elapsed: float, round_trips, queries):
+    """Print throughput, latencies, outcomes and query counts"""
+    decisions = metrics.decisions
+    print(f"{len(decisions)} of {args.swipes} swipes decided in {elapsed:.2f} s "
+          f"({len(decisions) / elapsed:.0f} swipes/s, target {args.rate or 'max'})")
+    print(f"decision        {percentiles([marks[-1][1] - started for _, started, marks in decisions if marks])}")
+    answered = [dict(marks)['publish'] - started for _, started, marks in decisions
+                if any(stage == 'publish' for stage, _ in marks)]
+    print(f"door answer     {percentiles(answered)}")
+    if round_trips is not None:
+        print(f"end to end      {percentiles(round_trips)}  ({len(round_trips)} answers)")
+
+    stage_times = defaultdict(list)
+    for _, started, marks in decisions:
+        last = started
+        for stage, ended in marks:
+            stage_times[stage].append(ended - last)
+            last = ended
+    print("mean stage time " + "  ".join(f"{stage} {statistics.fmean(stage_times[stage]) * 1e6:.1f} us"
+                                         for stage in STAGES if stage_times[stage]))
+    outcomes = defaultdict(int)
+    for outcome, _, _ in decisions:
+        outcomes[outcome] += 1
+    print("outcomes        " + "  ".join(f"{outcome} {count}" for outcome, count in sorted(outcomes.items())))
+    setup, during, flush = queries
+    print(f"queries         setup {setup}  during run {during} ({during / max(1, len(decisions)):.2f} per swipe)  "
+          f"final flush {flush}")
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description="MQTT door pipeline load generator")
+    parser.add_argument('--users', type=int, default=1000, help="registered chips")
+    parser.add_argument('--groups', type=int, default=20, help="access groups")
+    parser.add_argument('--readers', type=int, default=20, help="card readers")
+    parser.add_argument('--swipes', type=int, default=10000, help="swipes to send")
+    parser.add_argument('--rate', type=float, default=0, help="swipes per second (0 = as fast as possible)")
+    parser.add_argument('--distribution', choices=('uniform', 'zipf'), default='uniform',
+                        help="how chips and readers are picked")
+    parser.add_argument('--skew', type=float, default=1.1, help="exponent of the zipf distribution")
+    parser.add_argument('--unknown', type=float, default=0.05, help="share of swipes with unregistered chips")
+    parser.add_argument('--query-mode', choices=('index', 'db'), default='index',
+                        help="decide from the in-memory access index or query per swipe")
+    parser.add_argument('--workers', type=int, default=0, help="dispatcher threads (0 = inline)")
+    parser.add_argument('--queue-size', type=int, default=100000, help="dispatcher queue size")
+    parser.add_argument('--write-behind', action='store_true', help="batch rows instead of committing per swipe")
+    parser.add_argument('--batch-size', type=int, default=200, help="write-behind batch size")
+    parser.add_argument('--coalesce', type=float, default=0, help="coalescing window in seconds")
+    parser.add_argument('--transport', choices=('direct', 'broker'), default='direct',
+                        help="call on_message in-process or go through an MQTT broker")
+    parser.add_argument('--broker', default='', help="host:port of a broker (default: in-process stand-in)")
+    parser.add_argument('--seed', type=int, default=1, help="random seed")
+    args = parser.parse_args()
+
+    db.create_all()
+    with db.transient_session() as session:
+        if session.scalar(select(func.count()).select_from(User)):
+            parser.error("the database already contains users, point DATABASE_URL at an empty one")
+
+    rng = random.Random(args.seed)
+    topics, pushopen = seed(rng, args.users, args.groups, args.readers)
+    load = swipes(rng, args.swipes, args.users, topics, args.distribution, args.skew, args.unknown)
+
+    counter = QueryCounter(db.engine)
+    metrics = RecordingMetrics()
+    handler = build_handler(args, metrics)
+    setup_queries = counter.take()
+    try:
+        if args.transport == 'broker':
+            elapsed, round_trips = run_broker(handler, load, args.rate, args.broker, topics, pushopen,
+                                              args.users)
+        else:
+            elapsed, round_trips = run_direct(handler, load, args.rate)
+        run_queries = counter.take()
+        handler.stop()
+        flush_queries = counter.take()
+    finally:
+        db.session.remove()
+        if os.environ['DATABASE_URL'] == f'sqlite:///{TEMPORARY_DATABASE}':
+            db.engine.dispose()
+            os.remove(TEMPORARY_DATABASE)
+
+    print(f"{args.users} users, {args.groups} groups, {args.readers} readers; {args.query_mode} decisions, "
+          f"{args.workers or 'no'} workers, {'write-behind' if args.write_behind else 'inline commits'}, "
+          f"{args.transport} transport")
+    report(args, metrics, elapsed, round_trips, (setup_queries, run_queries, flush_queries))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Report benchmark
+Fills an in-memory database with a month of swipes (two to four per working
+day) for every user and times the all-employee hours matrix: the query,
+the JSON body and the HTML table
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('APP_KEY', 'bench-reports')
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+# pylint: disable=wrong-import-position
+from fastapi.templating import Jinja2Templates
+from sqlalchemy import insert
+
+from src.data.database import db
+from src.data.models import Card, User
+from src.reports import hours_matrix
+
+TEMPLATES = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src', 'templates'))
+
+
+def seed(users: int, year: int, month: int) -> int:
+    """Users and their swipes, inserted through the Session so the rollup is filled too"""
+    db.create_all()
+    session = db.session
+    session.execute(insert(User), [
+        {'id': user, 'chip_number': str(user).zfill(10), 'card_number': f"K{user}", 'username': f"user{user}",
+         'email': f"user{user}@example.com", 'name': f"Name{user}", 'second_name': f"Surname{user}"}
+        for user in range(1, users + 1)])
+    rows = []
+    day = date(year, month, 1)
+    while day.month == month:
+        if day.weekday() < 5:
+            for user in range(1, users + 1):
+                arrival = datetime(day.year, day.month, day.day, 6) + timedelta(minutes=random.randint(0, 180))
+                for swipe in range(random.randint(2, 4)):
+                    rows.append({'card_number': f"K{user}", 'time': arrival + timedelta(hours=3 * swipe),
+                                 'id_card_reader': 1, 'id_user': user, 'access': "1"})
+        day += timedelta(days=1)
+    session.execute(insert(Card), rows)
+    session.commit()
+    return len(rows)
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description="Hours matrix benchmark")
+    parser.add_argument('--users', type=int, default=1000, help="users with swipes")
+    parser.add_argument('--month', default='2024-03', help="month as YYYY-MM")
+    args = parser.parse_args()
+    year, month = (int(part) for part in args.month.split('-'))
+
+    swipes = seed(args.users, year, month)
+    template = Jinja2Templates(directory=TEMPLATES).get_template("reports/hours_matrix.html")
+
+    started = time.perf_counter()
+    matrix = hours_matrix(db.session, year, month)
+    queried = time.perf_counter()
+    body = json.dumps(dict(matrix._asdict(), days=[day._asdict() for day in matrix.days],
+                           rows=[row._asdict() for row in matrix.rows]))
+    encoded = time.perf_counter()
+    page = template.render(matrix=matrix)
+    rendered = time.perf_counter()
+
+    print(f"{args.users} users, {swipes} swipes in {args.month}")
+    print(f"query + matrix {(queried - started) * 1000:8.1f} ms")
+    print(f"JSON           {(encoded - queried) * 1000:8.1f} ms  {len(body) // 1024} KiB")
+    print(f"HTML           {(rendered - encoded) * 1000:8.1f} ms  {len(page) // 1024} KiB")
+    print(f"total          {(rendered - started) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
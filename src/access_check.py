@@ -0,0 +1,156 @@
+"""
+Access decision in a single statement for deployments without in-memory caches
+Resolves the reader, the chip holder and the group permission of a swipe in
+one round trip instead of the reader query, User.find_by_chip and
+User.access_by_group; check_access_batch decides many swipes with a few
+set-based queries
+"""
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, exists, select
+from sqlalchemy.orm import Session
+
+from src.data.models import Group_has_timecard, GroupSchedule, Timecard, User, User_has_group
+from src.data.util import normalize_reader
+from src.schedule import Schedule, week_second
+
+# user_id and card_number are None for an unknown chip
+AccessCheck = namedtuple('AccessCheck', ['reader_id', 'pushopen', 'user_id', 'card_number', 'allowed'])
+
+# One swipe of a batch: normalized chip (None if unparsable), identreader topic, time
+AccessRequest = namedtuple('AccessRequest', ['chip', 'reader', 'when'])
+
+# Values per IN (...) list; a query has at most two of them, which stays
+# below SQLite's limit of 999 bind parameters on older builds
+IN_CHUNK_SIZE = 450
+
+
+def build_statement():
+    """
+    Access check statement
+
+    The reader is looked up by identreader, the holder by the unique
+    users.chip_id; the correlated EXISTS walks user_has_group(user_id) ->
+    group_has_timecard(group_id, timecard_id) ->
+    group_schedules(group_id, second_from), all indexed.
+    Bind parameters: reader, chip, second (of the week, see src.schedule).
+    """
+    timecard, users, schedules = Timecard.__table__, User.__table__, GroupSchedule.__table__
+    memberships, bindings = User_has_group.__table__, Group_has_timecard.__table__
+    allowed = exists().where(
+        memberships.c.user_id == users.c.id,
+        bindings.c.group_id == memberships.c.group_id,
+        bindings.c.timecard_id == timecard.c.id,
+        schedules.c.group_id == memberships.c.group_id,
+        schedules.c.second_from <= bindparam('second'),
+        schedules.c.second_to > bindparam('second'),
+    )
+    return select(timecard.c.id, timecard.c.pushopen, users.c.id, users.c.card_number, allowed)\
+        .select_from(timecard.outerjoin(users, users.c.chip_id == bindparam('chip')))\
+        .where(timecard.c.identreader == bindparam('reader'))\
+        .order_by(timecard.c.id).limit(1)
+
+
+# SQLAlchemy caches its compiled form
+STATEMENT = build_statement()
+
+
+def check_access(session: Session, chip: int, reader: str,
+                 when: Optional[datetime] = None) -> Optional[AccessCheck]:
+    """
+    Decide a swipe with one query
+
+    Args:
+        session: Database session
+        chip: Normalized chip number (User.chip_id)
+        reader: MQTT topic of the reader (Timecard.identreader)
+        when: Time of the swipe, defaults to now
+
+    Returns:
+        AccessCheck, or None if no reader is registered for `reader`
+    """
+    when = when or datetime.now()
+    row = session.execute(STATEMENT, {
+        'reader': normalize_reader(reader), 'chip': chip, 'second': week_second(when),
+    }).first()
+    if row is None:
+        return None
+    reader_id, pushopen, user_id, card_number, allowed = row
+    return AccessCheck(reader_id, pushopen, user_id, card_number, user_id is not None and bool(allowed))
+
+
+def _chunks(values: Sequence) -> List[Sequence]:
+    return [values[start:start + IN_CHUNK_SIZE] for start in range(0, len(values), IN_CHUNK_SIZE)]
+
+
+def check_access_batch(session: Session, requests: Sequence[AccessRequest]) -> List[Optional[AccessCheck]]:
+    """
+    Decide many swipes like check_access
+
+    Three set-based queries serve the whole batch (split into chunks of
+    IN_CHUNK_SIZE values): the readers by identreader, the holders by
+    chip_id and the schedules binding those holders to those readers.
+
+    Args:
+        session: Database session
+        requests: Swipes to decide
+
+    Returns:
+        One AccessCheck per request, None where no reader is registered
+    """
+    timecard, users, schedules = Timecard.__table__, User.__table__, GroupSchedule.__table__
+    memberships, bindings = User_has_group.__table__, Group_has_timecard.__table__
+
+    readers: Dict[str, Tuple[int, str]] = {}
+    for chunk in _chunks(sorted({normalize_reader(request.reader) for request in requests})):
+        rows = session.execute(
+            select(timecard.c.identreader, timecard.c.id, timecard.c.pushopen)
+            .where(timecard.c.identreader.in_(chunk)).order_by(timecard.c.id))
+        for identreader, reader_id, pushopen in rows:
+            # The first reader wins, as in check_access
+            readers.setdefault(identreader, (reader_id, pushopen))
+
+    holders: Dict[int, Tuple[int, str]] = {}
+    for chunk in _chunks(sorted({request.chip for request in requests if request.chip is not None})):
+        rows = session.execute(select(users.c.chip_id, users.c.id, users.c.card_number)
+                               .where(users.c.chip_id.in_(chunk)))
+        holders.update((chip_id, (user_id, card_number)) for chip_id, user_id, card_number in rows)
+
+    intervals: Dict[Tuple[int, int], list] = {}
+    reader_ids = sorted({reader_id for reader_id, _ in readers.values()})
+    if reader_ids:
+        for chunk in _chunks(sorted({user_id for user_id, _ in holders.values()})):
+            for reader_chunk in _chunks(reader_ids):
+                rows = session.execute(
+                    select(memberships.c.user_id, bindings.c.timecard_id,
+                           schedules.c.second_from, schedules.c.second_to)
+                    .select_from(memberships)
+                    .join(bindings, bindings.c.group_id == memberships.c.group_id)
+                    .join(schedules, schedules.c.group_id == memberships.c.group_id)
+                    .where(memberships.c.user_id.in_(chunk), bindings.c.timecard_id.in_(reader_chunk)))
+                for user_id, reader_id, second_from, second_to in rows:
+                    intervals.setdefault((user_id, reader_id), []).append((second_from, second_to))
+    # Most holders share a few group schedules, compile each once
+    compiled: Dict[Tuple[int, int], Schedule] = {}
+    schedules_by_intervals: Dict[Tuple, Schedule] = {}
+    for key, items in intervals.items():
+        items = tuple(sorted(items))
+        schedule = schedules_by_intervals.get(items)
+        if schedule is None:
+            schedule = schedules_by_intervals[items] = Schedule(items)
+        compiled[key] = schedule
+
+    checks: List[Optional[AccessCheck]] = []
+    for request in requests:
+        reader = readers.get(normalize_reader(request.reader))
+        if reader is None:
+            checks.append(None)
+            continue
+        reader_id, pushopen = reader
+        user_id, card_number = holders.get(request.chip, (None, None))
+        schedule = compiled.get((user_id, reader_id))
+        allowed = schedule is not None and schedule.allows(request.when or datetime.now())
+        checks.append(AccessCheck(reader_id, pushopen, user_id, card_number, allowed))
+    return checks
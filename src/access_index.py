@@ -0,0 +1,182 @@
+"""
+In-memory access-control index for MQTT door decisions
+Compiled from users, groups, readers and their bindings so that a swipe
+can be decided without any database round trip
+"""
+import threading
+from collections import namedtuple
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from src.data.events import on_models_changed
+from src.data.models import User, Group, GroupSchedule, User_has_group, Group_has_timecard, Timecard
+from src.data.util import normalize_chip, normalize_reader
+from src.periodic import PeriodicTask
+from src.schedule import Schedule
+
+# Holder of a chip as returned by User.find_by_chip
+ChipHolder = namedtuple('ChipHolder', ['id', 'card_number'])
+
+# Immutable snapshot swapped in on every rebuild; schedules maps
+# chip -> reader -> union of the schedules of the chip holder's groups
+IndexState = namedtuple('IndexState', ['holders', 'schedules'])
+
+WATCHED_MODELS = (User, Group, GroupSchedule, User_has_group, Group_has_timecard, Timecard)
+
+
+def chip_key(chip) -> Optional[int]:
+    """Normalize a chip number the same way User.find_by_chip does"""
+    return normalize_chip(chip)
+
+
+def build_index_state(session: Session) -> IndexState:
+    """
+    Compile the access rules stored in the database
+
+    Args:
+        session: Database session
+
+    Returns:
+        IndexState with chip -> holder and chip -> reader -> windows maps
+    """
+    holders: Dict[int, ChipHolder] = {}
+    for user_id, chip_id, card_number in session.query(
+            User.id, User.chip_id, User.card_number).filter(User.chip_id.isnot(None)):
+        holders[chip_id] = ChipHolder(user_id, card_number)
+
+    rows = session.query(
+        User.chip_id, Timecard.identreader, GroupSchedule.second_from, GroupSchedule.second_to
+    ).select_from(GroupSchedule)\
+        .join(User_has_group, User_has_group.group_id == GroupSchedule.group_id).join(User)\
+        .join(Group_has_timecard, Group_has_timecard.group_id == GroupSchedule.group_id).join(Timecard)\
+        .filter(User.chip_id.isnot(None)).all()
+
+    intervals: Dict[int, Dict[str, list]] = {}
+    for chip_id, identreader, second_from, second_to in rows:
+        intervals.setdefault(chip_id, {}).setdefault(normalize_reader(identreader), []).append((second_from, second_to))
+
+    compiled = {
+        chip: {reader: Schedule(items) for reader, items in readers.items()}
+        for chip, readers in intervals.items()
+    }
+    return IndexState(holders, compiled)
+
+
+class AccessIndex:
+    """
+    Chip -> allowed readers -> weekday/time-window table
+
+    Decisions are pure dictionary lookups; the database is only read when
+    the index is (re)built, which happens on a background thread.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        """
+        Initialize access index
+
+        Args:
+            session_factory: Factory for short-lived sessions used by rebuilds
+        """
+        self._session_factory = session_factory
+        self._state = IndexState({}, {})
+        self._refresh_lock = threading.Lock()
+        self._refresher: Optional[PeriodicTask] = None
+        self._unwatch: Optional[Callable[[], None]] = None
+        self._listeners: List[Callable[['AccessIndex'], None]] = []
+        self.version = 0
+        self.built_at: Optional[datetime] = None
+
+    def __len__(self) -> int:
+        return len(self._state.holders)
+
+    @property
+    def state(self) -> IndexState:
+        """Current compiled rules"""
+        return self._state
+
+    def add_listener(self, callback: Callable[['AccessIndex'], None]) -> None:
+        """Call `callback(index)` whenever new rules were swapped in"""
+        self._listeners.append(callback)
+
+    def load(self, state: IndexState) -> None:
+        """Swap in compiled rules, e.g. read from an offline snapshot"""
+        self._state = state
+        self.version += 1
+        self.built_at = datetime.now()
+        for callback in self._listeners:
+            callback(self)
+
+    def refresh(self) -> bool:
+        """
+        Rebuild the index from the database and swap it in atomically
+
+        Returns:
+            True if the rules changed
+        """
+        with self._refresh_lock:
+            session = self._session_factory()
+            try:
+                state = build_index_state(session)
+            finally:
+                session.close()
+            if self.version and state == self._state:
+                return False
+            self.load(state)
+            return True
+
+    def invalidate(self) -> None:
+        """Schedule a rebuild on the background thread (or rebuild now if none runs)"""
+        if self._refresher is not None:
+            self._refresher.trigger()
+        else:
+            self.refresh()
+
+    def start(self, interval: float) -> 'AccessIndex':
+        """
+        Build the index and keep it current
+
+        The index is rebuilt every `interval` seconds to pick up changes made by
+        other processes, and immediately after commits in this process that
+        touch any of the watched tables. When rules were already loaded (from
+        a snapshot) the first build runs in the background instead.
+        """
+        preloaded = bool(self.version)
+        if not preloaded:
+            self.refresh()
+        self._unwatch = on_models_changed(WATCHED_MODELS, self.invalidate)
+        self._refresher = PeriodicTask(interval, self.refresh, name='access-index').start()
+        if preloaded:
+            self._refresher.trigger()
+        return self
+
+    def stop(self) -> None:
+        """Stop background refreshing"""
+        if self._unwatch is not None:
+            self._unwatch()
+            self._unwatch = None
+        if self._refresher is not None:
+            self._refresher.stop()
+            self._refresher = None
+
+    def lookup(self, chip) -> Optional[ChipHolder]:
+        """Return the holder of `chip`, equivalent to User.find_by_chip"""
+        return self._state.holders.get(chip_key(chip))
+
+    def is_allowed(self, chip, reader: str, when: Optional[datetime] = None) -> bool:
+        """
+        Decide whether `chip` may open `reader`, equivalent to User.access_by_group
+
+        Args:
+            chip: Chip number
+            reader: MQTT topic of the reader (Timecard.identreader)
+            when: Time of the swipe, defaults to now
+        """
+        schedules = self._state.schedules.get(chip_key(chip))
+        if not schedules:
+            return False
+        schedule = schedules.get(normalize_reader(reader))
+        if schedule is None:
+            return False
+        return schedule.allows(when or datetime.now())
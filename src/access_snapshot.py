@@ -0,0 +1,141 @@
+"""
+Offline snapshot of the effective access rules
+Lets the MQTT worker decide swipes while the database is unreachable and
+serve its first decisions on a cold start before any query has run
+"""
+import json
+import logging
+import mmap
+import os
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from src.access_index import AccessIndex, ChipHolder, IndexState
+from src.reader_registry import ReaderInfo, ReaderRegistry
+from src.schedule import Schedule
+
+logger = logging.getLogger(__name__)
+
+# 2: chips are integer keys (User.chip_id)
+# 3: second-of-week schedule intervals instead of day/time windows
+SNAPSHOT_FORMAT = 3
+
+
+def dump_snapshot(state: IndexState, readers: Dict[str, ReaderInfo]) -> bytes:
+    """Serialize access rules and readers to compact JSON"""
+    data = {
+        'format': SNAPSHOT_FORMAT,
+        'created': datetime.now().isoformat(),
+        'readers': {topic: list(reader) for topic, reader in readers.items()},
+        'holders': {chip: list(holder) for chip, holder in state.holders.items()},
+        'schedules': {
+            chip: {reader: schedule.intervals for reader, schedule in by_reader.items()}
+            for chip, by_reader in state.schedules.items()
+        },
+    }
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def parse_snapshot(raw: bytes) -> Tuple[IndexState, Dict[str, ReaderInfo]]:
+    """Inverse of dump_snapshot"""
+    data = json.loads(raw)
+    if data.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format {data.get('format')}")
+    readers = {topic: ReaderInfo(*reader) for topic, reader in data['readers'].items()}
+    holders = {int(chip): ChipHolder(*holder) for chip, holder in data['holders'].items()}
+    schedules = {
+        int(chip): {reader: Schedule(map(tuple, intervals)) for reader, intervals in by_reader.items()}
+        for chip, by_reader in data['schedules'].items()
+    }
+    return IndexState(holders, schedules), readers
+
+
+def read_snapshot(path: str) -> Optional[Tuple[IndexState, Dict[str, ReaderInfo]]]:
+    """
+    Memory-map and parse a snapshot file
+
+    Returns:
+        (IndexState, readers) or None if there is no usable snapshot
+    """
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return parse_snapshot(mapped[:])
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning("Ignoring unreadable access snapshot %s: %s", path, e)
+        return None
+
+
+def write_snapshot(path: str, state: IndexState, readers: Dict[str, ReaderInfo]) -> None:
+    """Atomically replace the snapshot file"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(dump_snapshot(state, readers))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class AccessSnapshot:
+    """Keeps the snapshot file in step with an access index and reader registry"""
+
+    def __init__(self, path: str, index: AccessIndex, readers: ReaderRegistry):
+        """
+        Initialize snapshot
+
+        Args:
+            path: Snapshot file
+            index: Access index to persist and restore
+            readers: Reader registry to persist and restore
+        """
+        self.path = path
+        self.index = index
+        self.readers = readers
+        self._saved: Optional[Tuple[int, int]] = None
+
+    def restore(self) -> bool:
+        """
+        Load the snapshot into the index and registry
+
+        Whichever of the two is loaded already (e.g. a registry shared
+        with the web app) keeps its current data.
+
+        Returns:
+            True if a snapshot was loaded
+        """
+        snapshot = read_snapshot(self.path)
+        if snapshot is None:
+            return False
+        state, readers = snapshot
+        if not self.readers.version:
+            self.readers.load(readers)
+        if not self.index.version:
+            self.index.load(state)
+        self._saved = (self.index.version, self.readers.version)
+        return True
+
+    def save(self, *_args) -> None:
+        """Write the current rules if they changed since the last save"""
+        current = (self.index.version, self.readers.version)
+        if current == self._saved or not all(current):
+            # Unchanged, or index and registry not both loaded yet
+            return
+        try:
+            write_snapshot(self.path, self.index.state, dict(self.readers.items()))
+        except OSError as e:
+            logger.error("Error writing access snapshot %s: %s", self.path, e)
+            return
+        self._saved = current
+
+    def watch(self) -> 'AccessSnapshot':
+        """Save after every rebuild of the index or change of the readers"""
+        self.index.add_listener(self.save)
+        self.readers.add_listener(self.save)
+        return self
@@ -0,0 +1,325 @@
+"""
+Per-reader allowlists published to the readers as retained MQTT messages
+Capable readers decide swipes locally from their allowlist and report them
+afterwards, so a door does not wait for a round trip to the server
+
+Topics, next to the reader's pushopen topic (server -> reader) and its
+identreader topic (reader -> server):
+    <pushopen>/allowlist        retained full list
+    <pushopen>/allowlist/delta  retained changes since that full list
+    <identreader>/report        swipes decided by the reader
+
+A full list is {"v": version, "s": schedules, "c": [[chip, schedule], ...]};
+each schedule is a flat [start, end, start, end, ...] list of half-open
+second-of-week intervals (see src.schedule) and chips refer to it by its
+position, since most chips of a reader share a handful of schedules. A delta
+is {"v": version, "base": version of the full list, "s": ..., "c": [...],
+"d": [removed chips]} and always covers every change since its base, so a
+reader that (re)subscribes gets the current list from the two retained
+messages. Readers ignore a delta whose base is not the full list they hold.
+"""
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from src.access_index import AccessIndex, IndexState
+from src.data.util import normalize_chip
+from src.periodic import PeriodicTask
+from src.ratelimit import TokenBucket
+from src.reader_registry import ReaderInfo, ReaderRegistry
+from src.schedule import Schedule
+
+logger = logging.getLogger(__name__)
+
+ALLOWLIST_SUFFIX = '/allowlist'
+DELTA_SUFFIX = '/allowlist/delta'
+REPORT_SUFFIX = '/report'
+
+# chip -> schedule of one allowlist topic
+Allowlist = Dict[int, Schedule]
+
+# What a reader holds after the retained messages: the full list it got and
+# the list including the published delta
+PublishedList = namedtuple('PublishedList', ['base', 'full', 'current'])
+
+# A swipe decided by a reader; `when` is the reader's time of the swipe
+SwipeReport = namedtuple('SwipeReport', ['chip', 'allowed', 'when'])
+
+
+def allowlist_topic(pushopen: str) -> str:
+    """Retained full allowlist of the reader answered on `pushopen`"""
+    return f"{pushopen}{ALLOWLIST_SUFFIX}"
+
+
+def delta_topic(pushopen: str) -> str:
+    """Retained allowlist changes of the reader answered on `pushopen`"""
+    return f"{pushopen}{DELTA_SUFFIX}"
+
+
+def report_topic(identreader: str) -> str:
+    """Topic a reader publishing on `identreader` reports its own decisions on"""
+    return f"{identreader}{REPORT_SUFFIX}"
+
+
+def is_report(topic: str) -> bool:
+    """Whether `topic` carries swipe reports"""
+    return str(topic).endswith(REPORT_SUFFIX)
+
+
+def reader_topic(topic: str) -> str:
+    """identreader topic of a report topic, other topics unchanged"""
+    topic = str(topic)
+    return topic[:-len(REPORT_SUFFIX)] if topic.endswith(REPORT_SUFFIX) else topic
+
+
+def build_allowlists(state: IndexState, readers: Iterable[Tuple[str, ReaderInfo]],
+                     owns: Callable[[str], bool] = lambda topic: True) -> Dict[str, Allowlist]:
+    """
+    Effective allowlist of every reader
+
+    Args:
+        state: Compiled rules of the access index (chip -> identreader -> schedule)
+        readers: (identreader, ReaderInfo) pairs of the registered readers
+        owns: Whether allowlists of an identreader are published by this worker
+
+    Returns:
+        pushopen topic -> chip -> schedule; readers sharing a pushopen topic
+        get the union of their lists
+    """
+    pushopen_of = {identreader: reader.pushopen for identreader, reader in readers
+                   if reader.pushopen and owns(identreader)}
+    allowlists: Dict[str, Allowlist] = {pushopen: {} for pushopen in pushopen_of.values()}
+    for chip, by_reader in state.schedules.items():
+        for identreader, schedule in by_reader.items():
+            pushopen = pushopen_of.get(identreader)
+            if pushopen is None or not schedule:
+                continue
+            chips = allowlists[pushopen]
+            chips[chip] = chips[chip] | schedule if chip in chips else schedule
+    return allowlists
+
+
+def _encode_chips(chips: Allowlist) -> Tuple[List[List[int]], List[List[int]]]:
+    schedules: Dict[Schedule, int] = {}
+    pairs = []
+    for chip in sorted(chips):
+        position = schedules.setdefault(chips[chip], len(schedules))
+        pairs.append([chip, position])
+    flat = [[second for interval in schedule.intervals for second in interval] for schedule in schedules]
+    return flat, pairs
+
+
+def _dumps(data: Dict) -> bytes:
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def encode_full(version: int, chips: Allowlist) -> bytes:
+    """Compact JSON of a full allowlist"""
+    schedules, pairs = _encode_chips(chips)
+    return _dumps({'v': version, 's': schedules, 'c': pairs})
+
+
+def encode_delta(version: int, base: int, full: Allowlist, current: Allowlist) -> bytes:
+    """Compact JSON of the changes from the full list `full` to `current`"""
+    changed = {chip: schedule for chip, schedule in current.items() if full.get(chip) != schedule}
+    schedules, pairs = _encode_chips(changed)
+    removed = sorted(chip for chip in full if chip not in current)
+    return _dumps({'v': version, 'base': base, 's': schedules, 'c': pairs, 'd': removed})
+
+
+def decode_allowlist(full: bytes, delta: Optional[bytes] = None) -> Tuple[int, Allowlist]:
+    """
+    Allowlist a reader holds after receiving the retained messages
+
+    Args:
+        full: Payload of the full list
+        delta: Payload of the delta topic, if any
+
+    Returns:
+        (version, chip -> schedule)
+    """
+    def chips_of(data):
+        schedules = [Schedule(zip(flat[::2], flat[1::2])) for flat in data['s']]
+        return {chip: schedules[position] for chip, position in data['c']}
+
+    data = json.loads(full)
+    version, chips = data['v'], chips_of(data)
+    if delta:
+        changes = json.loads(delta)
+        if changes['base'] == version:
+            chips.update(chips_of(changes))
+            for chip in changes['d']:
+                chips.pop(chip, None)
+            version = changes['v']
+    return version, chips
+
+
+def parse_report(payload) -> Optional[SwipeReport]:
+    """
+    Parse a swipe report: {"chip": ..., "allowed": 0|1, "time": unix seconds}
+
+    The chip is given like in swipe requests (decimal or hex), the time
+    defaults to now. Returns None for a malformed report.
+    """
+    try:
+        data = json.loads(payload)
+        chip = normalize_chip(str(data['chip']))
+        when = datetime.fromtimestamp(data['time']) if data.get('time') is not None else datetime.now()
+        allowed = data['allowed']
+    except (ValueError, TypeError, KeyError, OverflowError, OSError):
+        return None
+    if chip is None or allowed not in (0, 1):
+        return None
+    return SwipeReport(chip, bool(allowed), when)
+
+
+def in_report_window(when: datetime, now: datetime, max_age: float, max_skew: float) -> bool:
+    """
+    Whether a reported swipe time is plausible
+
+    Args:
+        when: Time given by the reader
+        now: Server time
+        max_age: Seconds a report may be late (readers buffering longer use the bulk upload)
+        max_skew: Seconds a reader clock may run ahead
+    """
+    return now - timedelta(seconds=max_age) <= when <= now + timedelta(seconds=max_skew)
+
+
+class AllowlistPublisher:
+    """
+    Keeps the retained allowlist of every reader equal to the access index
+
+    Changes of the index or the reader registry only mark the lists dirty;
+    every `interval` seconds the changed lists are published in one batch,
+    at most `rate` reader updates per second (the rest follow in the next
+    batches). An update is a delta against the reader's last full list,
+    unless that delta has grown beyond `delta_ratio` of a full list; then a
+    new full list is published and the delta topic cleared.
+    """
+
+    def __init__(self, client, access_index: AccessIndex, readers: ReaderRegistry,
+                 interval: float = 5.0, rate: float = 20.0, burst: int = 100,
+                 delta_ratio: float = 0.5, owns: Callable[[str], bool] = lambda topic: True):
+        """
+        Initialize publisher
+
+        Args:
+            client: paho MQTT client
+            access_index: Source of the effective rules
+            readers: Registered readers and their pushopen topics
+            interval: Seconds between two batches
+            rate: Reader updates per second (0 = unlimited)
+            burst: Reader updates at once
+            delta_ratio: Largest delta, relative to the full list, sent as a delta
+            owns: Whether this worker publishes the allowlist of an identreader
+        """
+        self.client = client
+        self.access_index = access_index
+        self.readers = readers
+        self.interval = interval
+        self.delta_ratio = delta_ratio
+        self.owns = owns
+        self._bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self._published: Dict[str, PublishedList] = {}
+        self._versions = itertools.count(int(time.time() * 1000))
+        self._dirty = True
+        self._lock = threading.Lock()
+        self._publisher: Optional[PeriodicTask] = None
+
+        # Counters
+        self.full_lists = 0
+        self.deltas = 0
+        self.deferred = 0
+
+    def mark_dirty(self, *args) -> None:  # pylint: disable=unused-argument
+        """Compare the allowlists with the published ones in the next batch"""
+        self._dirty = True
+
+    def republish(self) -> None:
+        """Publish every list in full in the next batch, e.g. after a reconnect"""
+        with self._lock:
+            self._published.clear()
+            self._dirty = True
+        if self._publisher is not None:
+            self._publisher.trigger()
+
+    def publish(self, now: Optional[float] = None) -> int:
+        """
+        Publish the allowlists that changed since the previous batch
+
+        Returns:
+            Number of readers updated
+        """
+        if not self._dirty:
+            return 0
+        with self._lock:
+            self._dirty = False
+            wanted = build_allowlists(self.access_index.state, self.readers.items(), self.owns)
+            updates = sorted(topic for topic, chips in wanted.items()
+                             if topic not in self._published or self._published[topic].current != chips)
+            removed = sorted(set(self._published) - set(wanted))
+            updated = 0
+            for topic in removed + updates:
+                if self._bucket is not None and not self._bucket.allow(now):
+                    # The rest is compared again in the next batch
+                    self.deferred += 1
+                    self._dirty = True
+                    break
+                if topic in wanted:
+                    self._update(topic, wanted[topic])
+                else:
+                    self._clear(topic)
+                updated += 1
+        if updated:
+            logger.info("Published allowlists of %d readers", updated)
+        return updated
+
+    def _update(self, topic: str, chips: Allowlist) -> None:
+        version = next(self._versions)
+        published = self._published.get(topic)
+        if published is not None:
+            delta = encode_delta(version, published.base, published.full, chips)
+            if len(delta) <= self.delta_ratio * len(encode_full(version, chips)):
+                self.client.publish(delta_topic(topic), payload=delta, qos=1, retain=True)
+                self._published[topic] = published._replace(current=chips)
+                self.deltas += 1
+                return
+        self.client.publish(allowlist_topic(topic), payload=encode_full(version, chips), qos=1, retain=True)
+        # An empty retained payload removes the retained delta
+        self.client.publish(delta_topic(topic), payload=b'', qos=1, retain=True)
+        self._published[topic] = PublishedList(version, chips, chips)
+        self.full_lists += 1
+
+    def _clear(self, topic: str) -> None:
+        self.client.publish(allowlist_topic(topic), payload=b'', qos=1, retain=True)
+        self.client.publish(delta_topic(topic), payload=b'', qos=1, retain=True)
+        del self._published[topic]
+
+    def start(self) -> 'AllowlistPublisher':
+        """Follow the access index and the readers and publish every `interval` seconds"""
+        self.access_index.add_listener(self.mark_dirty)
+        self.readers.add_listener(self.mark_dirty)
+        self._publisher = PeriodicTask(self.interval, self.publish, name='allowlists').start()
+        self._publisher.trigger()
+        return self
+
+    def stop(self) -> None:
+        """Stop publishing"""
+        if self._publisher is not None:
+            self._publisher.stop()
+            self._publisher = None
+
+    def stats(self) -> Dict[str, float]:
+        """Counters for monitoring"""
+        return {
+            'allowlist_readers': len(self._published),
+            'allowlist_full_lists': self.full_lists,
+            'allowlist_deltas': self.deltas,
+            'allowlist_deferred': self.deferred,
+        }
@@ -0,0 +1,192 @@
+"""
+Maintenance of the daily_attendance rollup
+The rollup is derived from carddata off the swipe path: a periodic job
+refreshes the last days, batches of older swipes (bulk uploads, journal
+replays) refresh their own days, and a rebuild repairs any date range
+"""
+import argparse
+import logging
+import signal
+import threading
+from datetime import date, datetime, timedelta
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from src.config import settings
+from src.data.models.dailyattendance import DailyAttendance
+from src.loggers import configure_logging, stop_logging
+from src.periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+
+def _next_month(day: date) -> date:
+    return date(day.year + 1, 1, 1) if day.month == 12 else date(day.year, day.month + 1, 1)
+
+
+def rebuild_daily_attendance(session_factory: Callable[[], Session], start: date, end: date) -> int:
+    """
+    Bring the rollup of the days start <= day < end up to date
+
+    Works one calendar month per transaction, so a long range neither holds
+    locks on the whole rollup nor has to be redone from the start when it
+    is interrupted.
+
+    Args:
+        session_factory: Creates database sessions
+        start: First day
+        end: Day after the last one
+
+    Returns:
+        Number of user days changed
+    """
+    changed = 0
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(_next_month(chunk_start), end)
+        session = session_factory()
+        try:
+            changed += DailyAttendance.refresh(session, chunk_start, chunk_end)
+            session.commit()
+        finally:
+            session.close()
+        logger.info("Rebuilt daily attendance %s - %s", chunk_start, chunk_end - timedelta(days=1))
+        chunk_start = chunk_end
+    return changed
+
+
+def refresh_days(session: Session, moments: Iterable[datetime]) -> int:
+    """
+    Refresh the rollup of the days of `moments` after those swipes were committed
+
+    Used by writers of batches that may contain older swipes. Every day
+    written is refreshed, recent ones too, as the periodic job may run in
+    another process or not at all. A failure is logged and does not undo
+    the swipes, the days can be repaired with a rebuild.
+
+    Args:
+        session: Session the swipes were committed with
+        moments: Times of the stored swipes
+
+    Returns:
+        Number of user days changed
+    """
+    days = {moment.date() for moment in moments}
+    if not days:
+        return 0
+    start, end = min(days), max(days) + timedelta(days=1)
+    try:
+        changed = DailyAttendance.refresh(session, start, end)
+        session.commit()
+    except SQLAlchemyError as e:
+        session.rollback()
+        logger.warning("Daily attendance of %s - %s not refreshed, rebuild it: %s", start, end, e)
+        return 0
+    return changed
+
+
+class AttendanceRollup:
+    """Refreshes the rollup of the last `days` days every `interval` seconds"""
+
+    def __init__(self, session_factory: Callable[[], Session], interval: float = 60.0, days: int = 2):
+        """
+        Initialize rollup job
+
+        Args:
+            session_factory: Creates the sessions of the refreshes
+            interval: Seconds between two refreshes
+            days: Days up to today that are refreshed, yesterday included by default
+                so swipes flushed after midnight are counted
+        """
+        self._session_factory = session_factory
+        self.interval = interval
+        self.days = days
+        self._task: Optional[PeriodicTask] = None
+
+        # Counters
+        self.refreshes = 0
+        self.changed = 0
+
+    def refresh(self, today: Optional[date] = None) -> int:
+        """
+        Refresh the last days now
+
+        Returns:
+            Number of user days changed
+        """
+        today = today or date.today()
+        session = self._session_factory()
+        try:
+            changed = DailyAttendance.refresh(session, today - timedelta(days=self.days - 1),
+                                              today + timedelta(days=1))
+            session.commit()
+        finally:
+            session.close()
+        self.refreshes += 1
+        self.changed += changed
+        return changed
+
+    def start(self) -> 'AttendanceRollup':
+        """Refresh now and then every `interval` seconds"""
+        self._task = PeriodicTask(self.interval, self.refresh, name='attendance-rollup').start()
+        self._task.trigger()
+        return self
+
+    def stop(self) -> None:
+        """Stop the background task"""
+        if self._task is not None:
+            self._task.stop()
+            self._task = None
+
+
+def run_rollup(session_factory: Callable[[], Session]) -> None:
+    """
+    Run the periodic rollup in the foreground until SIGTERM or Ctrl+C
+
+    Meant for the single `rollup` process of the deployment, see Procfile.
+    """
+    rollup = AttendanceRollup(session_factory, settings.ATTENDANCE_ROLLUP_SECONDS,
+                              settings.ATTENDANCE_ROLLUP_DAYS).start()
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    logger.info("Starting daily attendance rollup every %ss", settings.ATTENDANCE_ROLLUP_SECONDS)
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        rollup.stop()
+
+
+def main(argv=None):
+    """Rebuild the daily attendance rollup of a date range or run the periodic rollup"""
+    # Imported here so that importing the module does not create an engine
+    from src.database import SessionLocal  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description="Daily attendance rollup maintenance")
+    parser.add_argument('command', choices=['rebuild', 'run'])
+    parser.add_argument('--from', dest='start', type=date.fromisoformat,
+                        help="first day, YYYY-MM-DD (rebuild)")
+    parser.add_argument('--to', dest='end', type=date.fromisoformat,
+                        help="last day (included), YYYY-MM-DD (rebuild)")
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        configure_logging()
+        try:
+            run_rollup(SessionLocal)
+        finally:
+            stop_logging()
+        return
+    if args.start is None or args.end is None:
+        parser.error("rebuild needs --from and --to")
+    if args.end < args.start:
+        parser.error("--to is before --from")
+
+    changed = rebuild_daily_attendance(SessionLocal, args.start, args.end + timedelta(days=1))
+    print(f"Rebuilt daily attendance {args.start} - {args.end}: {changed} user days changed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Coalescing of repeated card reads
+Readers repeat a chip several times while a card is held against them; the
+repeats reuse the first decision instead of being processed again
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class CoalescingWindow:
+    """
+    Remembers recent decisions per key for `window` seconds
+
+    The window starts with the first read and is not extended by repeats,
+    so a card held against a reader is decided again every `window`
+    seconds. At most `max_entries` keys are kept; the oldest go first.
+    """
+
+    def __init__(self, window: float = 1.0, max_entries: int = 10000):
+        """
+        Initialize coalescing window
+
+        Args:
+            window: Seconds a decision is reused for
+            max_entries: Upper bound of remembered keys
+        """
+        self.window = window
+        self.max_entries = max_entries
+        # key -> (decided at, decision), oldest first
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.suppressed = 0
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def recent(self, key: Hashable, now: Optional[float] = None) -> Tuple[bool, Any]:
+        """
+        Look up a decision taken for `key` inside the window
+
+        A hit counts as a suppressed event.
+
+        Returns:
+            (True, decision) on a hit, (False, None) otherwise
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            self.suppressed += 1
+            return True, entry[1]
+
+    def remember(self, key: Hashable, decision: Any, now: Optional[float] = None) -> None:
+        """Start a window for `key` with `decision`"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now, decision)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def stats(self) -> Dict[str, float]:
+        """Counters for monitoring"""
+        return {
+            'coalesce_entries': len(self._entries),
+            'coalesce_suppressed': self.suppressed,
+            'coalesce_evicted': self.evicted,
+        }
+
+    def _expire(self, now: float) -> None:
+        deadline = now - self.window
+        while self._entries:
+            decided_at = next(iter(self._entries.values()))[0]
+            if decided_at > deadline:
+                return
+            self._entries.popitem(last=False)
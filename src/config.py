@@ -1,7 +1,7 @@
 """
 Configuration settings for FastAPI application
 """
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from pydantic_settings import BaseSettings
 from pydantic import Field, ConfigDict
 
@@ -48,6 +48,98 @@ class Settings(BaseSettings):
     MQTT_BROKER: str = Field(default="192.168.1.110", validation_alias='MQTT_BROKER')
     MQTT_PORT: int = Field(default=1883, validation_alias='MQTT_PORT')
     MQTT_KEEPALIVE: int = 60
+    # Run the MQTT listener on the web app's event loop (asyncio) instead of a
+    # separate worker process
+    MQTT_IN_PROCESS: bool = False
+    # Port of the /metrics endpoint of a separate listener process (0 = none);
+    # listener process N uses MQTT_METRICS_PORT + N
+    MQTT_METRICS_PORT: int = 9108
+    # Address it listens on; set 0.0.0.0 to let a remote Prometheus scrape it
+    MQTT_METRICS_HOST: str = "127.0.0.1"
+    # Subscribe to '#' instead of the identreader topics registered in timecard
+    MQTT_SUBSCRIBE_ALL: bool = False
+    READER_REFRESH_SECONDS: float = 30.0
+
+    # In-memory access index used by the MQTT worker
+    ACCESS_INDEX_ENABLED: bool = True
+    ACCESS_INDEX_REFRESH_SECONDS: float = 30.0
+
+    # Write-behind persistence of Card/Log rows in the MQTT worker
+    WRITE_BEHIND_ENABLED: bool = True
+    WRITE_BEHIND_BATCH_SIZE: int = 200
+    WRITE_BEHIND_FLUSH_SECONDS: float = 0.5
+    # A batch that fails because the database is unreachable is retried,
+    # waiting RETRY_SECONDS at first and doubling up to MAX_RETRY_SECONDS;
+    # beyond MAX_ROWS waiting rows the oldest ones are dropped
+    WRITE_BEHIND_RETRY_SECONDS: float = 1.0
+    WRITE_BEHIND_MAX_RETRY_SECONDS: float = 30.0
+    WRITE_BEHIND_MAX_ROWS: int = 100_000
+
+    # Offline operation of the MQTT worker (empty path disables the file)
+    ACCESS_SNAPSHOT_PATH: str = "var/access_snapshot.json"
+    SWIPE_JOURNAL_PATH: str = "var/swipes.journal"
+    # Group-commit interval of the journal, how often journaled rows are
+    # replayed, how old they must be first, and when to drop replayed entries
+    SWIPE_JOURNAL_SYNC_SECONDS: float = 0.05
+    SWIPE_JOURNAL_REPLAY_SECONDS: float = 60.0
+    SWIPE_JOURNAL_SETTLE_SECONDS: float = 30.0
+    SWIPE_JOURNAL_COMPACT_BYTES: int = 1_000_000
+
+    # Worker threads processing MQTT messages (0 = process on paho's network thread)
+    MQTT_WORKER_THREADS: int = 4
+    MQTT_QUEUE_SIZE: int = 1000
+    # What to do with a message when the queue is full: "drop" or "deny"
+    MQTT_OVERFLOW_POLICY: str = "drop"
+    # Repeated reads of a chip on one reader within this many seconds reuse the
+    # first decision and store no row (0 disables)
+    MQTT_COALESCE_SECONDS: float = 1.0
+    MQTT_COALESCE_MAX_ENTRIES: int = 10000
+    # Flood protection: messages per second and burst for each reader topic and
+    # for the whole worker (0 = unlimited)
+    MQTT_READER_RATE: float = 10.0
+    MQTT_READER_BURST: int = 20
+    MQTT_GLOBAL_RATE: float = 1000.0
+    MQTT_GLOBAL_BURST: int = 2000
+    # Unknown cards are stored as one summary Log row per chip and interval
+    # (0 = one row per read)
+    UNKNOWN_CARD_SUMMARY_SECONDS: float = 60.0
+
+    # Retained per-reader allowlists for readers deciding locally: changes are
+    # published in batches every ALLOWLIST_PUBLISH_SECONDS, at most
+    # ALLOWLIST_RATE reader updates per second; a delta larger than
+    # ALLOWLIST_DELTA_RATIO of the full list is sent as a new full list
+    ALLOWLIST_ENABLED: bool = False
+    ALLOWLIST_PUBLISH_SECONDS: float = 5.0
+    ALLOWLIST_RATE: float = 20.0
+    ALLOWLIST_BURST: int = 100
+    ALLOWLIST_DELTA_RATIO: float = 0.5
+    # Reported swipes older than ALLOWLIST_REPORT_MAX_AGE_SECONDS or ahead of
+    # the server clock by more than ALLOWLIST_REPORT_MAX_SKEW_SECONDS are rejected
+    ALLOWLIST_REPORT_MAX_AGE_SECONDS: float = 86400.0
+    ALLOWLIST_REPORT_MAX_SKEW_SECONDS: float = 300.0
+
+    # With ATTENDANCE_ROLLUP_ENABLED the web app refreshes the daily_attendance
+    # rollup of the last ATTENDANCE_ROLLUP_DAYS days every ATTENDANCE_ROLLUP_SECONDS.
+    # Off by default so scaled web processes do not all refresh the same days;
+    # the Procfile runs it in its own `rollup` process instead
+    ATTENDANCE_ROLLUP_ENABLED: bool = False
+    ATTENDANCE_ROLLUP_SECONDS: float = 60.0
+    ATTENDANCE_ROLLUP_DAYS: int = 2
+
+    # Listener processes; with more than one they split the readers either via
+    # an MQTT shared subscription ("shared") or a consistent-hash partition ("hash")
+    MQTT_WORKER_PROCESSES: int = 1
+    MQTT_SCALE_MODE: str = "shared"
+    MQTT_SHARED_GROUP: str = "karty-workers"
+
+    # Logging: records are written to stderr by a background thread;
+    # LOG_FORMAT is "json" or "text", LOG_SWIPES logs every door decision
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"
+    STDERR_LOG_FORMAT: Tuple[str, str] = ('%(asctime)s %(levelname)s %(name)s: %(message)s',
+                                          '%m/%d/%Y %I:%M:%S %p')
+    LOG_SWIPES: bool = True
+    SQLALCHEMY_LOG_LEVEL: str = "WARNING"
 
     # File uploads
     UPLOAD_FOLDER: str = "uploads/"
@@ -0,0 +1,110 @@
+"""
+Portable date bucketing for queries over timestamp columns
+Filters are half-open ranges on the bare column, so an index on it can be
+used; truncation to a day or month is only used in SELECT and GROUP BY and
+is compiled per dialect (SQLite, MySQL, PostgreSQL)
+"""
+from datetime import date, datetime, timedelta
+from typing import Tuple, Union
+
+from sqlalchemy import and_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.types import Date, DateTime, TypeDecorator
+
+
+class WholeSeconds(TypeDecorator):  # pylint: disable=too-many-ancestors,abstract-method
+    """
+    DATETIME stored without microseconds
+
+    Bound values are truncated to the second before they reach the database:
+    MySQL DATETIME would round them (12:00:00.6 -> 12:00:01) while SQLite and
+    PostgreSQL keep them, so a key computed in Python (see
+    src.swipe_journal.row_key) would not match the stored value everywhere.
+    Comparisons against the column are truncated the same way.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return value.replace(microsecond=0) if isinstance(value, datetime) else value
+
+
+def month_range(year: int, month: int) -> Tuple[datetime, datetime]:
+    """Half-open [first day, first day of the next month) range"""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+
+def parse_month(month: str) -> Tuple[int, int]:
+    """(year, month) of a 'YYYY-MM' string"""
+    year, number = month.split('-')
+    year, number = int(year), int(number)
+    if not 1 <= number <= 12:
+        raise ValueError(f"Invalid month {month!r}")
+    return year, number
+
+
+def day_range(day: Union[date, datetime]) -> Tuple[datetime, datetime]:
+    """Half-open [midnight, next midnight) range of `day`"""
+    start = datetime(day.year, day.month, day.day)
+    return start, start + timedelta(days=1)
+
+
+def in_range(column, start: datetime, end: datetime):
+    """start <= column < end"""
+    return and_(column >= start, column < end)
+
+
+def in_month(column, year: int, month: int):
+    """`column` falls into the month, as an index-friendly range"""
+    return in_range(column, *month_range(year, month))
+
+
+def on_day(column, day: Union[date, datetime]):
+    """`column` falls on `day`, as an index-friendly range"""
+    return in_range(column, *day_range(day))
+
+
+class day_of(FunctionElement):  # pylint: disable=invalid-name,too-many-ancestors
+    """Date of a timestamp, returned as a date on every backend"""
+    type = Date()
+    name = 'day_of'
+    inherit_cache = True
+
+
+class month_of(FunctionElement):  # pylint: disable=invalid-name,too-many-ancestors
+    """First day of the month of a timestamp, returned as a date on every backend"""
+    type = Date()
+    name = 'month_of'
+    inherit_cache = True
+
+
+@compiles(day_of)
+def _day_of(element, compiler, **kw):
+    return f"CAST({compiler.process(element.clauses, **kw)} AS DATE)"
+
+
+@compiles(day_of, 'sqlite')
+@compiles(day_of, 'mysql')
+@compiles(day_of, 'mariadb')
+def _day_of_date(element, compiler, **kw):
+    return f"DATE({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(month_of)
+def _month_of(element, compiler, **kw):
+    return f"CAST(DATE_TRUNC('month', {compiler.process(element.clauses, **kw)}) AS DATE)"
+
+
+@compiles(month_of, 'sqlite')
+def _month_of_sqlite(element, compiler, **kw):
+    return f"DATE({compiler.process(element.clauses, **kw)}, 'start of month')"
+
+
+@compiles(month_of, 'mysql')
+@compiles(month_of, 'mariadb')
+def _month_of_mysql(element, compiler, **kw):
+    value = compiler.process(element.clauses, **kw)
+    return f"DATE_SUB(DATE({value}), INTERVAL DAYOFMONTH({value}) - 1 DAY)"
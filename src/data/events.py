@@ -0,0 +1,57 @@
+"""
+Session event hooks used to invalidate in-process caches built from the models
+"""
+from itertools import chain
+from typing import Callable, Iterable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+def on_models_changed(models: Iterable[type], callback: Callable[[], None]) -> Callable[[], None]:
+    """
+    Call `callback` after every commit that inserted, updated or deleted rows of `models`
+
+    Covers both unit-of-work changes and bulk ``query(...).update()/.delete()`` statements.
+
+    Args:
+        models: Mapped classes to watch
+        callback: Called without arguments after the commit
+
+    Returns:
+        Function that removes the hooks again
+    """
+    models = tuple(models)
+    key = ('models_changed', id(callback))
+
+    def after_flush(session, flush_context):  # pylint: disable=unused-argument
+        if any(isinstance(obj, models) for obj in chain(session.new, session.dirty, session.deleted)):
+            session.info[key] = True
+
+    def do_orm_execute(orm_execute_state):
+        if orm_execute_state.is_update or orm_execute_state.is_delete:
+            mapper = orm_execute_state.bind_mapper
+            if mapper is not None and issubclass(mapper.class_, models):
+                orm_execute_state.session.info[key] = True
+
+    def after_commit(session):
+        if session.info.pop(key, False):
+            callback()
+
+    def after_rollback(session):
+        session.info.pop(key, None)
+
+    hooks = (
+        ('after_flush', after_flush),
+        ('do_orm_execute', do_orm_execute),
+        ('after_commit', after_commit),
+        ('after_rollback', after_rollback),
+    )
+    for name, fn in hooks:
+        event.listen(Session, name, fn)
+
+    def remove():
+        for name, fn in hooks:
+            event.remove(Session, name, fn)
+
+    return remove
@@ -9,7 +9,9 @@ from .group import Group
 from .vazby import User_has_group
 from .timecard import Timecard
 from .grouphastimecard import Group_has_timecard
+from .groupschedule import GroupSchedule
 from .logdata import Log
+from .dailyattendance import DailyAttendance
 
 # For backward compatibility
 try:
@@ -27,5 +29,7 @@ __all__ = [
     'User_has_group',
     'Timecard',
     'Group_has_timecard',
-    'Log'
+    'GroupSchedule',
+    'Log',
+    'DailyAttendance'
 ]
\ No newline at end of file
@@ -1,23 +1,42 @@
 """Card access log model with type hints"""
 from typing import List, Optional, Tuple
-from sqlalchemy import func, ForeignKey
+from sqlalchemy import func, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import Column
-from sqlalchemy.types import Integer, String, DateTime
+from sqlalchemy.types import Integer, String
 from datetime import datetime
 
 from ..database import db
+from ..dates import WholeSeconds, day_of, in_month, parse_month
 from ..mixins import CRUDModel
 
+# Hours between the first and the last swipe of a day that earn a meal voucher
+MEAL_VOUCHER_HOURS = 3
+
+
+def worked_minutes(first_in: datetime, last_out: datetime) -> int:
+    """Whole minutes between the first and the last swipe of a day"""
+    return int((last_out - first_in).total_seconds()) // 60
+
+
+def earns_meal_voucher(minutes: int, min_hours: float = MEAL_VOUCHER_HOURS) -> bool:
+    """Whether a day of `minutes` worked minutes earns a meal voucher"""
+    return minutes >= round(min_hours * 60)
+
 
 class Card(CRUDModel):
     """Model for card access logs"""
     __tablename__ = 'carddata'
     __public__ = ['id', 'card_number', 'time']
+    # Reports filter on time ranges (see src.data.dates), per card or for everyone;
+    # duplicate checks of uploaded swipes look up a card in a time range
+    __table_args__ = (Index('ix_carddata_card_number_time', 'card_number', 'time'),
+                      Index('ix_carddata_time', 'time'),
+                      {'extend_existing': True})
 
     id = Column(Integer, primary_key=True)
     card_number = Column(String(32), index=True, doc="Card access number")
-    time = Column(DateTime)
+    time = Column(WholeSeconds)
     access = Column(String(20), doc="Access")
     id_card_reader = Column(Integer, ForeignKey('timecard.id'))
     id_user = Column(Integer, ForeignKey('users.id'))
@@ -54,19 +73,19 @@ class Card(CRUDModel):
             Number of days eligible for meal vouchers
         """
         narok = 0
+        day = day_of(cls.time)
         form = db.session.query(
-            func.strftime('%Y-%m-%d', cls.time).label("date"),
-            func.max(func.strftime('%H:%M', cls.time)).label("Max"),
-            func.min(func.strftime('%H:%M', cls.time)).label("Min"),
-            (func.max(cls.time) - func.min(cls.time)).label("Rozdil")
+            day.label("date"),
+            func.min(cls.time).label("first_in"),
+            func.max(cls.time).label("last_out")
         ).filter(
-            func.strftime('%Y-%m', cls.time) == month
+            in_month(cls.time, *parse_month(month))
         ).filter(
             cls.card_number == card_number
-        ).group_by(func.strftime('%Y-%m-%d', cls.time)).all()
+        ).group_by(day).all()
         
         for n in form:
-            if n.rozdil >= 3:
+            if earns_meal_voucher(worked_minutes(n.first_in, n.last_out)):
                 narok = narok + 1
         return narok
 
@@ -0,0 +1,97 @@
+"""Daily attendance rollup of carddata"""
+from datetime import date, datetime
+from typing import Dict, Tuple
+
+from sqlalchemy import Boolean, Date, DateTime, ForeignKey, Index, bindparam, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import Column
+from sqlalchemy.types import Integer
+
+from ..dates import day_of, in_range
+from ..mixins import CRUDModel
+from .carddata import Card, earns_meal_voucher, worked_minutes
+
+# Columns compared and written by refresh, after user_id and day
+VALUE_COLUMNS = ('first_in', 'last_out', 'swipes', 'worked_minutes', 'meal_voucher')
+
+
+class DailyAttendance(CRUDModel):
+    """
+    One row per user and day: first and last swipe, number of swipes,
+    minutes between the first and the last swipe and whether they earn a
+    meal voucher
+
+    Derived from carddata by `refresh`, which src.attendance runs
+    periodically for the last days and after batches of older swipes.
+    """
+    __tablename__ = 'daily_attendance'
+    __table_args__ = (Index('ix_daily_attendance_user_id_day', 'user_id', 'day', unique=True),
+                      Index('ix_daily_attendance_day', 'day'),
+                      {'extend_existing': True})
+
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    day = Column(Date, nullable=False)
+    first_in = Column(DateTime, nullable=False)
+    last_out = Column(DateTime, nullable=False)
+    swipes = Column(Integer, nullable=False, default=0)
+    worked_minutes = Column(Integer, nullable=False, default=0)
+    meal_voucher = Column(Boolean(name="meal_voucher"), nullable=False, default=False)
+    mysql_engine = 'InnoDB'
+    mysql_charset = 'utf8-czech'
+    mysql_key_block_size = "1024"
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
+
+    @classmethod
+    def refresh(cls, session: Session, start: date, end: date) -> int:
+        """
+        Bring the rollup of the days start <= day < end up to date with carddata
+
+        The swipes of the range are grouped by user and day in one query
+        (a range on carddata.time) and compared with the stored rows; only
+        the differences are written, with plain INSERT, UPDATE and DELETE
+        statements that work on every backend. Running it again for the
+        same range changes nothing.
+
+        Args:
+            session: Database session; the caller commits
+
+        Returns:
+            Number of user days inserted, updated or deleted
+        """
+        day = day_of(Card.time)
+        aggregated = session.execute(
+            select(Card.id_user, day, func.min(Card.time), func.max(Card.time), func.count())
+            .where(in_range(Card.time, datetime(start.year, start.month, start.day),
+                            datetime(end.year, end.month, end.day)),
+                   Card.id_user.isnot(None))
+            .group_by(Card.id_user, day))
+        wanted: Dict[Tuple[int, date], tuple] = {}
+        for user_id, swipe_day, first_in, last_out, swipes in aggregated:
+            minutes = worked_minutes(first_in, last_out)
+            wanted[(user_id, swipe_day)] = (first_in, last_out, swipes, minutes, earns_meal_voucher(minutes))
+
+        table = cls.__table__
+        stored = session.execute(
+            select(table.c.id, table.c.user_id, table.c.day, *(table.c[name] for name in VALUE_COLUMNS))
+            .where(table.c.day >= start, table.c.day < end))
+        updates, deleted = [], []
+        for row_id, user_id, stored_day, *values in stored:
+            current = wanted.pop((user_id, stored_day), None)
+            if current is None:
+                deleted.append(row_id)
+            elif current != tuple(values):
+                updates.append(dict(zip((f'new_{name}' for name in VALUE_COLUMNS), current), row_id=row_id))
+        inserts = [dict(zip(VALUE_COLUMNS, values), user_id=user_id, day=swipe_day)
+                   for (user_id, swipe_day), values in wanted.items()]
+
+        if inserts:
+            session.execute(insert(table), inserts)
+        if updates:
+            session.execute(update(table).where(table.c.id == bindparam('row_id'))
+                            .values({name: bindparam(f'new_{name}') for name in VALUE_COLUMNS}), updates)
+        if deleted:
+            session.execute(delete(table).where(table.c.id.in_(deleted)))
+        return len(inserts) + len(updates) + len(deleted)
@@ -1,16 +1,24 @@
 """Group model with type hints"""
 from typing import List, Optional, Tuple
-from sqlalchemy import Time, ForeignKey, Table
-from sqlalchemy.orm import relationship
+from sqlalchemy import Time, ForeignKey, Table, event
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import Session, relationship, validates
 from sqlalchemy.schema import Column
 from sqlalchemy.types import Integer, String, Boolean
 from datetime import time
 
+from src.schedule import Schedule, ScheduleWindow
 from ..mixins import CRUDModel
 from .grouphastimecard import Group_has_timecard
+from .groupschedule import GroupSchedule
 from ..database import db
 
 
+DAY_COLUMNS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+# Legacy columns the schedule is rebuilt from when they are set
+LEGACY_SCHEDULE_COLUMNS = (*DAY_COLUMNS, 'access_time_from', 'access_time_to')
+
+
 class Group(CRUDModel):
     """Model for user groups with access control"""
     __tablename__ = 'groups'
@@ -27,16 +35,68 @@ class Group(CRUDModel):
     access_time_from = Column("access_time_from", Time, nullable=True, index=True)
     access_time_to = Column("access_time_to", Time, nullable=True, index=True)
     timecard = relationship(Group_has_timecard, backref='group')
+    # The schedule access checks use; rebuilt from the legacy day and time
+    # columns whenever those are set, or replaced by set_schedule
+    schedule_intervals = relationship(GroupSchedule, order_by=GroupSchedule.second_from,
+                                      cascade='all, delete-orphan')
     
     mysql_engine = 'InnoDB'
     mysql_charset = 'utf8-czech'
     mysql_key_block_size = "1024"
 
+    # True while set_schedule writes the legacy columns, which must not
+    # rebuild the schedule then
+    _setting_schedule = False
+
     def __init__(self, **kwargs):
         """Initialize group"""
         for k, v in kwargs.items():
             setattr(self, k, v)
 
+    @property
+    def schedule(self) -> Schedule:
+        """Weekly schedule of the group"""
+        return Schedule((row.second_from, row.second_to) for row in self.schedule_intervals)
+
+    @property
+    def schedule_windows(self) -> List[ScheduleWindow]:
+        """The schedule as windows, for display and the API"""
+        return self.schedule.windows()
+
+    def set_schedule(self, windows: List[ScheduleWindow]) -> None:
+        """
+        Replace the schedule with `windows`, which may cross midnight and
+        give one day several windows
+
+        The legacy columns are set to a summary for old readers: the days
+        with any window and the span of the first window.
+        """
+        schedule = Schedule.from_windows(windows)
+        self._setting_schedule = True
+        try:
+            days = {day for window in windows for day in window.days}
+            for day, name in enumerate(DAY_COLUMNS):
+                setattr(self, name, 1 if day in days else 0)
+            self.access_time_from = windows[0].time_from if windows else None
+            self.access_time_to = windows[0].time_to if windows else None
+        finally:
+            self._setting_schedule = False
+        self._store_schedule(schedule)
+
+    @validates(*LEGACY_SCHEDULE_COLUMNS)
+    def _legacy_schedule_changed(self, key, value):
+        """Setting a legacy column rebuilds the schedule from all of them"""
+        if not self._setting_schedule:
+            values = {name: getattr(self, name) for name in LEGACY_SCHEDULE_COLUMNS}
+            values[key] = value
+            self._store_schedule(Schedule.from_legacy(
+                [values[name] for name in DAY_COLUMNS], values['access_time_from'], values['access_time_to']))
+        return value
+
+    def _store_schedule(self, schedule: Schedule) -> None:
+        self.schedule_intervals = [GroupSchedule(second_from=start, second_to=end)
+                                   for start, end in schedule.intervals]
+
     @staticmethod
     def getGroupList() -> List[Tuple[int, str, Optional[time], Optional[time]]]:
         """Get list of all groups with their details"""
@@ -68,4 +128,27 @@ class Group(CRUDModel):
         return db.session.query(Group.access_time_to).filter_by(id=id).scalar()
 
 
+@event.listens_for(Session, 'do_orm_execute')
+def _forbid_bulk_schedule_update(orm_execute_state):
+    """
+    Reject bulk UPDATEs of the legacy schedule columns
 
+    query(Group).update() and update(Group) skip the validators, so
+    group_schedules would keep the old schedule. Load the groups and set
+    the columns, or call set_schedule, instead.
+    """
+    if not orm_execute_state.is_update:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or not issubclass(mapper.class_, Group):
+        return
+    # Values of the statement, and of the rows of an UPDATE by primary key
+    names = set(orm_execute_state.statement.compile().params)
+    parameters = orm_execute_state.parameters
+    for row in parameters if isinstance(parameters, list) else [parameters or {}]:
+        names.update(row)
+    changed = sorted(names.intersection(LEGACY_SCHEDULE_COLUMNS))
+    if changed:
+        raise InvalidRequestError(
+            f"Bulk UPDATE of groups.{', groups.'.join(changed)} would leave group_schedules out of date; "
+            "set the columns on loaded Group objects or use Group.set_schedule")
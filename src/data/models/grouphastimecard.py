@@ -1,4 +1,4 @@
-from sqlalchemy import Time, ForeignKey, Table
+from sqlalchemy import Time, ForeignKey, Index, Table
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import Column
 from sqlalchemy.types import Integer, String
@@ -8,6 +8,9 @@ from .timecard import Timecard
 
 class Group_has_timecard(CRUDModel):
     __tablename__ = 'group_has_timecard'
+    # Leading columns of the access check joins (the primary key starts with id
+    # in migrated databases)
+    __table_args__ = (Index('ix_group_has_timecard_group_id_timecard_id', 'group_id', 'timecard_id'), {'extend_existing': True})
 
     group_id = Column(Integer, ForeignKey('groups.id'), primary_key=True)
     timecard_id = Column(Integer, ForeignKey('timecard.id'), primary_key=True)
@@ -0,0 +1,27 @@
+"""Group schedule intervals"""
+from sqlalchemy import ForeignKey, Index
+from sqlalchemy.schema import Column
+from sqlalchemy.types import Integer
+
+from ..mixins import CRUDModel
+
+
+class GroupSchedule(CRUDModel):
+    """
+    One half-open [second_from, second_to) interval of a group's weekly
+    schedule, in seconds since Monday 00:00 (see src.schedule)
+    """
+    __tablename__ = 'group_schedules'
+    __table_args__ = (Index('ix_group_schedules_group_id_second_from', 'group_id', 'second_from'),
+                      {'extend_existing': True})
+
+    group_id = Column(Integer, ForeignKey('groups.id'), nullable=False)
+    second_from = Column(Integer, nullable=False)
+    second_to = Column(Integer, nullable=False)
+    mysql_engine = 'InnoDB'
+    mysql_charset = 'utf8-czech'
+    mysql_key_block_size = "1024"
+
+    def __init__(self, **kwargs):
+        for k, v in kwargs.items():
+            setattr(self, k, v)
@@ -1,7 +1,8 @@
 from sqlalchemy import func, ForeignKey
 from sqlalchemy.schema import Column
-from sqlalchemy.types import Integer, String, DateTime
+from sqlalchemy.types import Integer, String
 from ..database import db
+from ..dates import WholeSeconds
 from ..mixins import CRUDModel
 #from sqlalchemy.orm import sessionmaker
 #from sqlalchemy.orm.attributes import InstrumentedAttribute
@@ -12,7 +13,7 @@ class Log(CRUDModel):
     __public__ = ['time', 'text']
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    time = Column(DateTime)
+    time = Column(WholeSeconds)
     text = Column(String(80))
     mysql_engine = 'InnoDB'
     mysql_charset = 'utf8-czech'
@@ -1,9 +1,10 @@
 from sqlalchemy import Time, ForeignKey, Table
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from sqlalchemy.schema import Column
 from sqlalchemy.types import Integer, String
 from ..mixins import CRUDModel
 from ..database import db
+from ..util import normalize_reader
 from .carddata import Card
 
 
@@ -23,6 +24,10 @@ class Timecard(CRUDModel):
         for k, v in kwargs.items():
             setattr(self, k, v)
 
+    @validates('identreader')
+    def _normalize_identreader(self, key, value):  # pylint: disable=unused-argument
+        """Store the topic in the form readers are looked up by"""
+        return normalize_reader(value) if value is not None else None
 
     @staticmethod
     def getTimecardList():
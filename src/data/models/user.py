@@ -1,19 +1,21 @@
 from typing import Optional, List, Tuple, Any
 from sqlalchemy.schema import Column
-from sqlalchemy.types import Boolean, Integer, String
-from sqlalchemy.orm import relationship, backref, Session
+from sqlalchemy.types import BigInteger, Boolean, Integer, String
+from sqlalchemy.orm import relationship, backref, Session, validates
 
 from sqlalchemy import cast, Numeric
 
+from ..database import db
 from ..mixins import CRUDModel
-from ..util import generate_random_token
+from ..util import generate_random_token, normalize_chip, normalize_reader
+from src.schedule import week_second
 from .vazby import User_has_group
 from .carddata import Card
 from .group import Group
 from .grouphastimecard import Group_has_timecard
+from .groupschedule import GroupSchedule
 from .timecard import Timecard
 from datetime import datetime
-import calendar
 
 class User(CRUDModel):
     __tablename__ = 'users'
@@ -29,6 +31,8 @@ class User(CRUDModel):
     second_name = Column(String(60), unique=False, index=True, doc="Second name")
     access = Column(String(1), index=True, doc="Access")
     chip_number = Column(String(10), unique=False, index= True, doc= "Chip number", nullable=False)
+    chip_id = Column(BigInteger, unique=True, index=True, nullable=True,
+                     doc="Chip number as integer (normalize_chip), kept in sync with chip_number")
     mazej = Column(Boolean(name="mazej"),unique=False,doc="pro mazani")
     mysql_engine = 'InnoDB'
     mysql_charset = 'utf8-czech'
@@ -44,6 +48,13 @@ class User(CRUDModel):
         for k, v in kwargs.items():
             setattr(self, k, v)
 
+    @validates('chip_number')
+    def _sync_chip_id(self, key, value):  # pylint: disable=unused-argument
+        """Store the canonical decimal form and its integer for exact lookups"""
+        chip = normalize_chip(value) if value is not None else None
+        self.chip_id = chip
+        return str(chip).zfill(10) if chip is not None else value
+
     @staticmethod
     def find_by_email(email: str) -> Optional['User']:
         """Find user by email address"""
@@ -100,16 +111,16 @@ class User(CRUDModel):
         Returns:
             True if access granted, False otherwise
         """
-        acctualtime = datetime.now()
-        dayofweek = acctualtime.weekday()
-        timenow = acctualtime.time()
-
-        chip_str = str(chip).zfill(10)
-        user_groups = db.session.query(Group)\
-            .filter(getattr(Group, calendar.day_name[dayofweek]) == True).filter(Group.access_time_from <= timenow)\
-            .filter(Group.access_time_to >= timenow)\
-            .join(User_has_group).join(User).filter(User.chip_number.like(chip_str)).join(Group_has_timecard)\
-            .join(Timecard).filter(Timecard.identreader == fromcte).all()
+        second = week_second(datetime.now())
+        chip_id = normalize_chip(chip)
+        if chip_id is None:
+            return False
+        user_groups = db.session.query(GroupSchedule.group_id)\
+            .filter(GroupSchedule.second_from <= second).filter(GroupSchedule.second_to > second)\
+            .join(User_has_group, User_has_group.group_id == GroupSchedule.group_id)\
+            .join(User).filter(User.chip_id == chip_id)\
+            .join(Group_has_timecard, Group_has_timecard.group_id == GroupSchedule.group_id)\
+            .join(Timecard).filter(Timecard.identreader == normalize_reader(fromcte)).limit(1).all()
         if len(user_groups) > 0:
             return True
         return False
@@ -120,13 +131,15 @@ class User(CRUDModel):
         Find user by chip number
         
         Args:
-            chip_number: Chip number to search for
+            chip_number: Chip number to search for, decimal or hex (see normalize_chip)
             
         Returns:
             User if found, None otherwise
         """
-        testchip = str(chip_number).zfill(10)
-        return db.session.query(User).filter(User.chip_number.like(testchip)).first()
+        chip_id = normalize_chip(chip_number)
+        if chip_id is None:
+            return None
+        return db.session.query(User).filter(User.chip_id == chip_id).first()
 
     @staticmethod
     def all_users() -> List[Tuple[int, str, str]]:
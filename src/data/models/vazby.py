@@ -1,4 +1,4 @@
-from sqlalchemy import Time, ForeignKey, Table
+from sqlalchemy import Time, ForeignKey, Index, Table
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import Column
 from sqlalchemy.types import Integer, String
@@ -8,6 +8,9 @@ from ..database import db
 
 class User_has_group(CRUDModel):
     __tablename__ = 'user_has_group'
+    # Leading columns of the access check joins (the primary key starts with id
+    # in migrated databases)
+    __table_args__ = (Index('ix_user_has_group_user_id_group_id', 'user_id', 'group_id'), {'extend_existing': True})
 
     user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
     group_id = Column(Integer, ForeignKey('groups.id'), primary_key=True)
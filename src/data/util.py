@@ -1,6 +1,62 @@
 import base64
 import os
+import string
+from typing import Optional, Tuple
+
+# Chips are stored as 10 decimal digits in users.chip_number (String(10))
+MAX_CHIP = 10 ** 10 - 1
+
+_HEX_DIGITS = frozenset(string.hexdigits)
+
 
 def generate_random_token():
     "Generates a random 24 byte string"
     return base64.b64encode(os.urandom(24))
+
+def normalize_chip(value) -> Optional[int]:
+    """
+    Canonical integer of a chip number as sent by a reader or typed in
+
+    Decimal digits (zero padded or not) are read as decimal, values with a
+    0x prefix or hex letters as hexadecimal, e.g. "0000012345", 12345 and
+    "0x3039" are all 12345. Returns None for anything else, including
+    chips beyond 10 decimal digits.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        chip = value
+    else:
+        if isinstance(value, (bytes, bytearray)):
+            value = value.decode('ascii', 'replace')
+        text = str(value).strip()
+        if text[:2] in ('0x', '0X'):
+            text, base = text[2:], 16
+        else:
+            base = 10 if text.isdigit() else 16
+        if not text or not text.isascii() or not _HEX_DIGITS.issuperset(text):
+            return None
+        chip = int(text, base)
+    return chip if 0 <= chip <= MAX_CHIP else None
+
+def normalize_reader(topic) -> str:
+    """
+    Canonical identreader of the MQTT topic a reader publishes on
+
+    Readers are registered with their topic zero padded to 10 characters,
+    e.g. "101" and "0000000101" are the same reader. Every lookup by topic
+    (the access index, the reader registry and the SQL checks) goes
+    through this function.
+    """
+    return str(topic).zfill(10)
+
+
+def reader_topic_forms(identreader: str) -> Tuple[str, ...]:
+    """
+    Topics a reader registered as `identreader` may publish on
+
+    The padded form and the form without the leading zeros, e.g.
+    "0000000101" and "101"; both normalize to `identreader`.
+    """
+    short = identreader.lstrip('0')
+    return (identreader, short) if short and short != identreader else (identreader,)
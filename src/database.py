@@ -7,7 +7,8 @@ from sqlalchemy.orm import declarative_base, sessionmaker, Session
 from src.config import settings
 
 
-def _build_engine():
+def build_engine():
+    """Create an engine for DATABASE_URL with its own connection pool"""
     db_url = str(settings.DATABASE_URL)
     sqlite_connect_args = {"check_same_thread": False} if db_url.startswith("sqlite") else {}
     return create_engine(
@@ -18,7 +19,7 @@ def _build_engine():
     )
 
 
-engine = _build_engine()
+engine = build_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
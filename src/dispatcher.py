@@ -0,0 +1,115 @@
+"""
+Dispatcher moving MQTT message processing off paho's network thread
+Messages are spread over a pool of worker threads by reader topic
+"""
+import logging
+import queue
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MessageDispatcher:
+    """
+    Bounded queue in front of a pool of worker threads
+
+    Every topic is pinned to one worker, so messages from the same reader are
+    processed in arrival order while different readers run in parallel. When
+    the worker's queue is full the message is dropped, counted and handed to
+    `on_overflow` (for example to deny the door explicitly).
+    """
+
+    def __init__(self, process: Callable, workers: int = 4, queue_size: int = 1000,
+                 on_overflow: Optional[Callable] = None):
+        """
+        Initialize dispatcher
+
+        Args:
+            process: Called with each message on a worker thread
+            workers: Number of worker threads
+            queue_size: Total number of messages waiting across all workers
+            on_overflow: Called with a message that did not fit into the queue
+        """
+        self.process = process
+        self.on_overflow = on_overflow
+        per_worker = max(1, queue_size // max(1, workers))
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=per_worker) for _ in range(workers)]
+        self._processed = [0] * workers
+        self._errors = [0] * workers
+        self._threads = [
+            threading.Thread(target=self._run, args=(slot,), name=f'mqtt-worker-{slot}', daemon=True)
+            for slot in range(workers)
+        ]
+        self.dispatched = 0
+        self.dropped = 0
+
+    @property
+    def depth(self) -> int:
+        """Messages waiting for a worker"""
+        return sum(q.qsize() for q in self._queues)
+
+    def start(self) -> 'MessageDispatcher':
+        """Start the worker threads"""
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def submit(self, msg) -> bool:
+        """
+        Queue a message for processing, never blocks
+
+        Args:
+            msg: MQTT message
+
+        Returns:
+            True if queued, False if dropped because the queue was full
+        """
+        try:
+            self._queues[self._slot(msg.topic)].put_nowait(msg)
+        except queue.Full:
+            self.dropped += 1
+            if self.on_overflow is not None:
+                self.on_overflow(msg)
+            return False
+        self.dispatched += 1
+        return True
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Process every queued message and stop the workers"""
+        for q, thread in zip(self._queues, self._threads):
+            if thread.is_alive():
+                q.put(_STOP)
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring"""
+        return {
+            'dispatcher_depth': self.depth,
+            'dispatcher_dispatched': self.dispatched,
+            'dispatcher_dropped': self.dropped,
+            'dispatcher_processed': sum(self._processed),
+            'dispatcher_errors': sum(self._errors),
+        }
+
+    def _slot(self, topic: str) -> int:
+        return zlib.crc32(str(topic).encode()) % len(self._queues)
+
+    def _run(self, slot: int) -> None:
+        q = self._queues[slot]
+        while True:
+            msg = q.get()
+            if msg is _STOP:
+                return
+            try:
+                self.process(msg)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                self._errors[slot] += 1
+                logger.exception("Error processing message on %s: %s", msg.topic, e)
+            finally:
+                self._processed[slot] += 1
@@ -1,10 +1,53 @@
 """
 Helper functions for configuring loggers.
+
+Records are put on a queue by a QueueHandler and written to stderr by a
+QueueListener thread, so logging never blocks the thread that logs (the
+MQTT door path in particular). Per-swipe records go to the `karty.swipes`
+logger and can be switched off with LOG_SWIPES.
 """
 
+import hashlib
+import json
 import logging
+import logging.handlers
+import queue
+from datetime import datetime, timezone
+from typing import Optional
+
+from .config import settings
+
+SWIPE_LOGGER = 'karty.swipes'
+
+# Attributes every LogRecord has; anything else was passed via `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    "Formats records as one JSON object per line, including `extra` fields"
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+def chip_hash(chip) -> str:
+    "Keyed hash of a chip number, lets log records be correlated without exposing the chip"
+    digest = hashlib.blake2b(str(chip).encode(), digest_size=8, key=settings.SECRET_KEY.encode()[:64])
+    return digest.hexdigest()
 
-from .settings import app_config
 
 def configure_sqlalchemy_logger(format_string, level):
     logger = logging.getLogger('sqlalchemy.engine')
@@ -15,17 +58,62 @@ def get_stderr_handler(format_string, level):
     "Returns a standard error handler with provided format and level"
     handler = logging.StreamHandler()
     handler.setLevel(level)
-    handler.setFormatter(logging.Formatter(*format_string))
+    if format_string == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(*format_string))
     return handler
 
 def get_app_stderr_handler():
     "Returns a configured stderr_handler"
-    return get_stderr_handler(app_config.STDERR_LOG_FORMAT, app_config.APP_LOG_LEVEL)
+    format_string = 'json' if settings.LOG_FORMAT == 'json' else settings.STDERR_LOG_FORMAT
+    return get_stderr_handler(format_string, settings.LOG_LEVEL)
 
 def get_stderr_logger():
     "Returns a Logger object with a configured stderr_handler"
     logger = logging.getLogger()
     logger.handlers = []
-    logger.setLevel(app_config.APP_LOG_LEVEL)
+    logger.setLevel(settings.LOG_LEVEL)
     logger.addHandler(get_app_stderr_handler())
     return logger
+
+def configure_logging(max_queue: int = 10000) -> logging.Logger:
+    """
+    Route all logging through a queue to a background stderr writer
+
+    Safe to call more than once. When the queue is full, records are
+    dropped instead of blocking the caller.
+
+    Returns:
+        The root logger
+    """
+    global _listener  # pylint: disable=global-statement
+    stop_logging()
+    records: queue.Queue = queue.Queue(max_queue)
+    _listener = logging.handlers.QueueListener(records, get_app_stderr_handler(),
+                                               respect_handler_level=True)
+    _listener.start()
+
+    logger = logging.getLogger()
+    logger.handlers = [_NonBlockingQueueHandler(records)]
+    logger.setLevel(settings.LOG_LEVEL)
+    logging.getLogger(SWIPE_LOGGER).setLevel(logging.INFO if settings.LOG_SWIPES else logging.CRITICAL + 1)
+    logging.getLogger('sqlalchemy.engine').setLevel(settings.SQLALCHEMY_LOG_LEVEL)
+    return logger
+
+def stop_logging():
+    "Write out queued records and stop the background writer"
+    global _listener  # pylint: disable=global-statement
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    "QueueHandler that drops records while the queue is full"
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
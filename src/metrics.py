@@ -0,0 +1,385 @@
+"""
+In-process metrics with Prometheus text exposition
+Histograms and counters are plain Python objects updated under a lock;
+rendering happens only when /metrics is scraped
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from src.periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 50 us .. ~20 s, each bucket 1.5x the previous one
+LATENCY_BUCKETS: Tuple[float, ...] = tuple(round(0.00005 * 1.5 ** i, 7) for i in range(33))
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """Add `amount` to the series of `labels`"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        """Current value of one series"""
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        """Exposition lines"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with optional labels
+
+    Quantiles are estimated from the buckets by linear interpolation,
+    accurate to the bucket width (50% steps).
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *labels: str) -> None:
+        """Record one observation"""
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def observe_many(self, observations: Iterable[Tuple[Tuple[str, ...], float]]) -> None:
+        """Record several (labels, seconds) observations under one lock"""
+        buckets = self.buckets
+        with self._lock:
+            for labels, seconds in observations:
+                series = self._series.get(labels)
+                if series is None:
+                    series = self._series[labels] = [[0] * (len(buckets) + 1), 0.0]
+                series[0][bisect_left(buckets, seconds)] += 1
+                series[1] += seconds
+
+    def count(self, *labels: str) -> int:
+        """Observations of one series"""
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def quantile(self, q: float, *labels: str) -> Optional[float]:
+        """Estimated `q` quantile of one series, None without observations"""
+        with self._lock:
+            series = self._series.get(labels)
+            counts = list(series[0]) if series else []
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def label_values(self) -> List[Tuple[str, ...]]:
+        """Label values of all series"""
+        with self._lock:
+            return sorted(self._series)
+
+    def render(self) -> List[str]:
+        """Exposition lines"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total:.9g}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class QuantileGauge:
+    """Estimated quantiles of every series of a histogram, rendered as a gauge"""
+
+    def __init__(self, name: str, documentation: str, histogram: Histogram,
+                 quantiles: Sequence[float] = QUANTILES):
+        self.name = name
+        self.documentation = documentation
+        self.histogram = histogram
+        self.quantiles = tuple(quantiles)
+
+    def render(self) -> List[str]:
+        """Exposition lines"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels in self.histogram.label_values():
+            for q in self.quantiles:
+                value = self.histogram.quantile(q, *labels)
+                quantile = f'quantile="{q:g}"'
+                lines.append(f"{self.name}{_labels(self.histogram.labelnames, labels, quantile)} {value:.9g}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics of this process plus collectors of runtime counters"""
+
+    def __init__(self, prefix: str = 'karty'):
+        self.prefix = prefix
+        self._metrics: List = []
+        self._collectors: List[Tuple[str, Callable[[], Dict[str, float]]]] = []
+        self._before_render: List[Callable[[], None]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """Create and register a counter"""
+        metric = Counter(f"{self.prefix}_{name}", documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """Create and register a histogram"""
+        metric = Histogram(f"{self.prefix}_{name}", documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def quantiles(self, name: str, documentation: str, histogram: Histogram) -> QuantileGauge:
+        """Register a gauge with the p50/p95/p99 of `histogram`"""
+        metric = QuantileGauge(f"{self.prefix}_{name}", documentation, histogram)
+        self._metrics.append(metric)
+        return metric
+
+    def before_render(self, callback: Callable[[], None]) -> None:
+        """Call `callback()` before every render, e.g. to fold buffered observations"""
+        self._before_render.append(callback)
+
+    def add_collector(self, name: str, collect: Callable[[], Dict[str, float]]) -> Callable[[], None]:
+        """
+        Expose the values returned by `collect()` as gauges `<prefix>_<key>`
+
+        Returns:
+            Function removing the collector again
+        """
+        entry = (name, collect)
+        self._collectors.append(entry)
+        return lambda: self._collectors.remove(entry) if entry in self._collectors else None
+
+    def render(self) -> str:
+        """Whole registry in Prometheus text format"""
+        for callback in self._before_render:
+            callback()
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, collect in list(self._collectors):
+            try:
+                values = collect()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.error("Error collecting %s metrics: %s", name, e)
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {self.prefix}_{key} gauge")
+                    lines.append(f"{self.prefix}_{key} {float(value):g}")
+        return '\n'.join(lines) + '\n'
+
+
+class DoorMetrics:
+    """
+    Stage timings, outcomes and per-reader latency of door_test
+
+    The registered series carry no reader topics, /metrics is public;
+    the latency by reader is only kept for reader_quantiles, which the
+    API serves to authenticated users.
+
+    The hot path only appends the raw timings of a finished decision to a
+    bounded deque; they are folded into the histograms when metrics are
+    read and, once `start` was called, every `interval` seconds on a
+    background thread.
+    """
+
+    def __init__(self, registry: MetricsRegistry, max_pending: int = 100000):
+        self.stages = registry.histogram(
+            'door_stage_seconds', 'Time spent in each stage of the door decision', ('stage',))
+        self.latency = registry.histogram(
+            'door_latency_seconds', 'Time from receiving a swipe to answering it')
+        self.reader_latency = Histogram(
+            f'{registry.prefix}_door_latency_seconds', 'Time from receiving a swipe to answering it, by reader',
+            ('reader',))
+        self.outcomes = registry.counter('door_decisions_total', 'Door decisions by outcome', ('outcome',))
+        self.throttled = registry.counter('door_throttled_total', 'Messages dropped by flood protection')
+        # For dashboards without histogram_quantile
+        registry.quantiles('door_latency_quantile_seconds', 'Estimated door latency quantiles', self.latency)
+        registry.before_render(self.fold)
+        # The oldest decisions are dropped if nothing folds them
+        self._pending: deque = deque(maxlen=max_pending)
+        self._fold_lock = threading.Lock()
+        self._folder: Optional[PeriodicTask] = None
+
+    def start(self, interval: float = 1.0) -> 'DoorMetrics':
+        """Fold queued decisions in the background (once per process)"""
+        with self._fold_lock:
+            if self._folder is None:
+                self._folder = PeriodicTask(interval, self.fold, name='door-metrics').start()
+        return self
+
+    def timer(self, started: Optional[float] = None) -> 'StageTimer':
+        """Timer for the stages of one decision, starting now or at monotonic `started`"""
+        return StageTimer(self, time.monotonic() if started is None else started)
+
+    def record(self, outcome: str, started: float, marks: List[Tuple[str, float]],
+               reader: Optional[str] = None) -> None:
+        """
+        Queue a finished decision
+
+        Args:
+            outcome: allowed, denied, unknown_card, ...
+            started: Monotonic time the message was received
+            marks: (stage, monotonic time the stage ended) in order
+            reader: Reader topic, when the reader was answered
+        """
+        self._pending.append((outcome, started, marks, reader))
+
+    def fold(self) -> None:
+        """Move queued decisions into the histograms and counters"""
+        with self._fold_lock:
+            decisions = []
+            pending = self._pending
+            while pending:
+                decisions.append(pending.popleft())
+        if not decisions:
+            return
+        stages, latencies, outcomes = [], [], {}
+        for outcome, started, marks, reader in decisions:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            last = started
+            for stage, ended in marks:
+                stages.append(((stage,), ended - last))
+                last = ended
+                if stage == 'publish' and reader is not None:
+                    latencies.append(((reader,), ended - started))
+        self.stages.observe_many(stages)
+        self.latency.observe_many(((), seconds) for _, seconds in latencies)
+        self.reader_latency.observe_many(latencies)
+        for outcome, count in outcomes.items():
+            self.outcomes.inc(outcome, amount=count)
+
+    def reader_quantiles(self, quantiles: Iterable[float] = QUANTILES) -> Dict[str, Dict[str, float]]:
+        """reader -> {"p50": seconds, ...} estimated from the latency histogram"""
+        self.fold()
+        result = {}
+        for (reader,) in self.reader_latency.label_values():
+            result[reader] = {f"p{round(q * 100)}": self.reader_latency.quantile(q, reader) for q in quantiles}
+            result[reader]['count'] = self.reader_latency.count(reader)
+        return result
+
+
+class StageTimer:
+    """Marks the end of consecutive stages of one door decision"""
+
+    __slots__ = ('metrics', 'started', 'marks', 'reader')
+
+    def __init__(self, metrics: DoorMetrics, started: float):
+        self.metrics = metrics
+        self.started = started
+        self.marks: List[Tuple[str, float]] = []
+        self.reader: Optional[str] = None
+
+    def mark(self, stage: str) -> None:
+        """`stage` ends now; it began with the previous mark"""
+        self.marks.append((stage, time.monotonic()))
+
+    def door(self, reader: str) -> None:
+        """Count the time until the 'publish' mark as response time of `reader`"""
+        self.reader = reader
+
+    def elapsed(self) -> float:
+        """Seconds from the start to the latest mark"""
+        return self.marks[-1][1] - self.started if self.marks else 0.0
+
+    def finish(self, outcome: str) -> None:
+        """Record the decision"""
+        self.metrics.record(outcome, self.started, self.marks, self.reader)
+
+
+REGISTRY = MetricsRegistry()
+DOOR_METRICS = DoorMetrics(REGISTRY)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve /metrics"""
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+def serve_metrics(port: int, host: str = '127.0.0.1', registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """
+    Serve /metrics on a background thread, for processes without the web app
+
+    Returns:
+        The server; call shutdown() to stop it
+    """
+    handler = type('MetricsRequestHandler', (_MetricsRequestHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,281 @@
+"""
+Asyncio MQTT worker for running the card reader listener inside the web app
+paho's network I/O is driven by socket callbacks on the event loop instead
+of loop_forever(), and door decisions run as coroutines
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Set
+
+import paho.mqtt.client as mqtt
+from sqlalchemy.orm import scoped_session
+
+from src.config import settings
+from src.database import SessionLocal
+from src.mqtt_handler import MQTTHandler, build_handler
+from src.reader_registry import get_reader_registry
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reconnect attempts, doubled up to the maximum
+RECONNECT_MIN_SECONDS = 1.0
+RECONNECT_MAX_SECONDS = 30.0
+
+
+class AsyncDispatcher:
+    """
+    Runs door_test for every message as a task on the event loop
+
+    Decisions that neither query nor commit (access index and reader
+    registry loaded, rows go to the write-behind queue, unknown cards are
+    summarized) run directly on the loop; otherwise door_test is sent to
+    `executor`.
+    Same interface as MessageDispatcher, so MQTTHandler.on_message can hand
+    messages to either.
+    """
+
+    def __init__(self, handler: MQTTHandler, loop: asyncio.AbstractEventLoop,
+                 executor: ThreadPoolExecutor, max_pending: int = 1000):
+        """
+        Initialize dispatcher
+
+        Args:
+            handler: Handler whose door_test processes the messages
+            loop: Event loop running the tasks
+            executor: Threads for decisions that query the database
+            max_pending: Messages in flight before new ones go to handler.on_overflow
+        """
+        self.handler = handler
+        self.loop = loop
+        self.executor = executor
+        self.max_pending = max_pending
+        self._tasks: Set[asyncio.Task] = set()
+
+        # Counters
+        self.dispatched = 0
+        self.dropped = 0
+        self.processed = 0
+        self.errors = 0
+
+    @property
+    def in_memory(self) -> bool:
+        """Whether door_test can decide and store its rows without touching the database"""
+        handler = self.handler
+        return (handler.access_index is not None and handler.readers is not None
+                and handler.writer is not None and handler.unknown_cards is not None)
+
+    def submit(self, msg) -> bool:
+        """
+        Start processing `msg`; must be called on the event loop
+
+        Returns:
+            False if too many messages are in flight and `msg` was dropped
+        """
+        if len(self._tasks) >= self.max_pending:
+            self.dropped += 1
+            self.handler.on_overflow(msg)
+            return False
+        task = self.loop.create_task(self.process(msg))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.dispatched += 1
+        return True
+
+    async def process(self, msg) -> None:
+        """Decide one swipe"""
+        try:
+            if self.in_memory:
+                self.handler.door_test(msg)
+            else:
+                await self.loop.run_in_executor(self.executor, self._door_test, msg)
+            self.processed += 1
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self.errors += 1
+            logger.exception("Error processing message from %s: %s", msg.topic, e)
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        """Wait for the messages in flight"""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+    def stop(self) -> None:
+        """Interface of MessageDispatcher; tasks are drained by `drain`"""
+
+    def stats(self) -> Dict[str, float]:
+        """Counters for monitoring"""
+        return {
+            'dispatcher_depth': len(self._tasks),
+            'dispatcher_dispatched': self.dispatched,
+            'dispatcher_dropped': self.dropped,
+            'dispatcher_processed': self.processed,
+            'dispatcher_errors': self.errors,
+        }
+
+    def _door_test(self, msg) -> None:
+        try:
+            self.handler.door_test(msg)
+        finally:
+            # Executor threads keep no session between messages
+            remove = getattr(self.handler.db, 'remove', None)
+            if remove is not None:
+                remove()
+
+
+class AsyncMQTTWorker:
+    """
+    MQTT listener driven by an asyncio event loop
+
+    paho is attached to the loop through its socket callbacks (add_reader /
+    add_writer for the socket, a task for keepalives); it never gets a
+    thread of its own.
+    """
+
+    def __init__(self, handler: MQTTHandler, loop: Optional[asyncio.AbstractEventLoop] = None,
+                 executor: Optional[ThreadPoolExecutor] = None, max_pending: int = 1000):
+        """
+        Initialize worker, on the thread running the event loop
+
+        Args:
+            handler: Handler deciding the swipes; its dispatcher is replaced
+            loop: Event loop, the running one by default
+            executor: Threads for database work
+            max_pending: Messages in flight before the overflow policy applies
+        """
+        self.handler = handler
+        self.loop = loop or asyncio.get_running_loop()
+        self.executor = executor or ThreadPoolExecutor(max(1, settings.MQTT_WORKER_THREADS),
+                                                       thread_name_prefix='mqtt-db')
+        self.dispatcher = AsyncDispatcher(handler, self.loop, self.executor, max_pending)
+        handler.dispatcher = self.dispatcher
+        self._loop_thread = threading.get_ident()
+        self._misc_task: Optional[asyncio.Task] = None
+        self._connect_task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._connected = asyncio.Event()
+
+        client = handler.client
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        client.on_disconnect = self._on_disconnect
+        on_connect = client.on_connect
+
+        def connected(*args):
+            on_connect(*args)
+            self._connected.set()
+
+        client.on_connect = connected
+
+    async def start(self, host: Optional[str] = None, port: Optional[int] = None,
+                    keepalive: Optional[int] = None) -> 'AsyncMQTTWorker':
+        """Connect in the background, retrying until the broker answers"""
+        self._connect_task = self.loop.create_task(self._connect(
+            host or settings.MQTT_BROKER, port or settings.MQTT_PORT, keepalive or settings.MQTT_KEEPALIVE))
+        return self
+
+    async def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the first CONNACK"""
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """
+        Shut down in order: stop receiving, finish the messages in flight,
+        then flush rows and stop the background components
+        """
+        self._stopping = True
+        if self._connect_task is not None:
+            self._connect_task.cancel()
+        self.handler.client.disconnect()
+        await self.dispatcher.drain(timeout)
+        # Flushing the write-behind queue and the journal blocks
+        await self.loop.run_in_executor(self.executor, self.handler.stop)
+        if self.handler.access_index is not None:
+            self.handler.access_index.stop()
+        if self._misc_task is not None:
+            self._misc_task.cancel()
+        self.executor.shutdown(wait=True)
+
+    async def _connect(self, host: str, port: int, keepalive: int) -> None:
+        delay = RECONNECT_MIN_SECONDS
+        while not self._stopping:
+            try:
+                # DNS lookup and TCP handshake block, keep them off the loop
+                await self.loop.run_in_executor(self.executor, self.handler.client.connect,
+                                                host, port, keepalive)
+                logger.info("Starting MQTT listener on %s:%s (asyncio)", host, port)
+                return
+            except OSError as e:
+                logger.warning("MQTT connect to %s:%s failed: %s, retrying in %.0fs", host, port, e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+    async def _reconnect(self) -> None:
+        delay = RECONNECT_MIN_SECONDS
+        while not self._stopping:
+            await asyncio.sleep(delay)
+            try:
+                await self.loop.run_in_executor(self.executor, self.handler.client.reconnect)
+                return
+            except OSError as e:
+                logger.warning("MQTT reconnect failed: %s", e)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+
+    async def _misc_loop(self) -> None:
+        # Keepalive pings and QoS retries
+        while self.handler.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def _on_loop(self, func, *args) -> None:
+        if threading.get_ident() == self._loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def _on_socket_open(self, client, userdata, sock) -> None:  # pylint: disable=unused-argument
+        def opened():
+            self.loop.add_reader(sock, self._read)
+            if self._misc_task is None or self._misc_task.done():
+                self._misc_task = self.loop.create_task(self._misc_loop())
+        self._on_loop(opened)
+
+    def _on_socket_close(self, client, userdata, sock) -> None:  # pylint: disable=unused-argument
+        self._on_loop(self.loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock) -> None:  # pylint: disable=unused-argument
+        self._on_loop(self.loop.add_writer, sock, self._write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock) -> None:  # pylint: disable=unused-argument
+        self._on_loop(self.loop.remove_writer, sock)
+
+    def _read(self) -> None:
+        self.handler.client.loop_read()
+
+    def _write(self) -> None:
+        self.handler.client.loop_write()
+
+    def _on_disconnect(self, client, userdata, rc) -> None:  # pylint: disable=unused-argument
+        if rc != mqtt.MQTT_ERR_SUCCESS and not self._stopping:
+            logger.warning("MQTT connection lost (%s), reconnecting", rc)
+            self._on_loop(lambda: self.loop.create_task(self._reconnect()))
+
+
+async def start_async_listener() -> AsyncMQTTWorker:
+    """
+    Start the MQTT listener on the running event loop
+
+    Shares the web app's connection pool (SessionLocal) and reader registry.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max(1, settings.MQTT_WORKER_THREADS), thread_name_prefix='mqtt-db')
+    # Loading the registry, snapshot and index queries the database
+    handler = await loop.run_in_executor(
+        executor, lambda: build_handler(SessionLocal, scoped_session(SessionLocal), get_reader_registry()))
+    worker = AsyncMQTTWorker(handler, loop, executor, max_pending=settings.MQTT_QUEUE_SIZE)
+    return await worker.start()
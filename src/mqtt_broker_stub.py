@@ -0,0 +1,254 @@
+"""
+Minimal in-process MQTT 3.1.1 broker stand-in for tests and benchmarks
+Supports QoS 0/1 publishes, wildcards, retained messages and shared
+subscriptions ($share/<group>/<filter>); not meant for production use
+"""
+import itertools
+import socket
+import socketserver
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def _encode_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out)
+
+
+def _encode_string(value: bytes) -> bytes:
+    return struct.pack('!H', len(value)) + value
+
+
+def _packet(first_byte: int, body: bytes) -> bytes:
+    return bytes([first_byte]) + _encode_length(len(body)) + body
+
+
+def parse_subscription(topic_filter: str) -> Tuple[Optional[str], str]:
+    """Split a subscription into (shared group or None, topic filter)"""
+    if topic_filter.startswith('$share/'):
+        _, group, real_filter = topic_filter.split('/', 2)
+        return group, real_filter
+    return None, topic_filter
+
+
+class _Connection(socketserver.BaseRequestHandler):
+    """One client connection"""
+
+    def setup(self):
+        self.write_lock = threading.Lock()
+        self.subscriptions: List[str] = []
+
+    def send(self, data: bytes) -> None:
+        """Write raw bytes to the client"""
+        with self.write_lock:
+            try:
+                self.request.sendall(data)
+            except OSError:
+                pass
+
+    def deliver(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        """Send a QoS 0 PUBLISH to the client"""
+        self.send(_packet(0x30 | (1 if retain else 0), _encode_string(topic.encode()) + payload))
+
+    def _read_exact(self, size: int) -> bytes:
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError
+            data += chunk
+        return data
+
+    def _read_packet(self) -> Tuple[int, int, bytes]:
+        first = self._read_exact(1)[0]
+        multiplier, length = 1, 0
+        while True:
+            byte = self._read_exact(1)[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        return first >> 4, first & 0x0F, self._read_exact(length) if length else b''
+
+    def handle(self):
+        broker: 'BrokerStub' = self.server.broker
+        broker.register(self)
+        try:
+            while True:
+                packet_type, flags, body = self._read_packet()
+                if packet_type == CONNECT:
+                    self.send(_packet(0x20, b'\x00\x00'))
+                elif packet_type == PUBLISH:
+                    self._on_publish(broker, flags, body)
+                elif packet_type == SUBSCRIBE:
+                    self._on_subscribe(broker, body)
+                elif packet_type == UNSUBSCRIBE:
+                    self._on_unsubscribe(broker, body)
+                elif packet_type == PINGREQ:
+                    self.send(_packet(0xD0, b''))
+                elif packet_type == DISCONNECT:
+                    return
+        except (ConnectionError, OSError):
+            return
+        finally:
+            broker.unregister(self)
+
+    def _on_publish(self, broker: 'BrokerStub', flags: int, body: bytes) -> None:
+        qos = (flags >> 1) & 0x03
+        retain = bool(flags & 0x01)
+        (topic_length,) = struct.unpack('!H', body[:2])
+        topic = body[2:2 + topic_length].decode()
+        offset = 2 + topic_length
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+            self.send(_packet(0x40, packet_id))
+        broker.publish(topic, body[offset:], retain)
+
+    def _on_subscribe(self, broker: 'BrokerStub', body: bytes) -> None:
+        packet_id, offset, filters = body[:2], 2, []
+        while offset < len(body):
+            (length,) = struct.unpack('!H', body[offset:offset + 2])
+            filters.append(body[offset + 2:offset + 2 + length].decode())
+            offset += 2 + length + 1
+        for topic_filter in filters:
+            broker.subscribe(self, topic_filter)
+        self.send(_packet(0x90, packet_id + bytes(len(filters))))
+        for topic_filter in filters:
+            broker.send_retained(self, topic_filter)
+
+    def _on_unsubscribe(self, broker: 'BrokerStub', body: bytes) -> None:
+        packet_id, offset = body[:2], 2
+        while offset < len(body):
+            (length,) = struct.unpack('!H', body[offset:offset + 2])
+            broker.unsubscribe(self, body[offset + 2:offset + 2 + length].decode())
+            offset += 2 + length
+        self.send(_packet(0xB0, packet_id))
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class BrokerStub:
+    """Threaded MQTT broker listening on localhost"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        """
+        Initialize broker stub
+
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+        """
+        self._server = _Server((host, port), _Connection)
+        self._server.broker = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mqtt-broker-stub', daemon=True)
+        self._lock = threading.Lock()
+        self._connections: List[_Connection] = []
+        self._round_robin: Dict[Tuple[str, str], itertools.count] = {}
+        self.retained: Dict[str, bytes] = {}
+        self.published = 0
+
+    @property
+    def host(self) -> str:
+        """Address the broker listens on"""
+        return self._server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        """Port the broker listens on"""
+        return self._server.server_address[1]
+
+    def start(self) -> 'BrokerStub':
+        """Start accepting connections"""
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Close every connection and stop the server"""
+        self._server.shutdown()
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self._server.server_close()
+
+    def register(self, connection: _Connection) -> None:
+        """Track a new client connection"""
+        with self._lock:
+            self._connections.append(connection)
+
+    def unregister(self, connection: _Connection) -> None:
+        """Forget a closed client connection"""
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+
+    def subscribe(self, connection: _Connection, topic_filter: str) -> None:
+        """Add a subscription of `connection`"""
+        with self._lock:
+            if topic_filter not in connection.subscriptions:
+                connection.subscriptions.append(topic_filter)
+
+    def unsubscribe(self, connection: _Connection, topic_filter: str) -> None:
+        """Remove a subscription of `connection`"""
+        with self._lock:
+            if topic_filter in connection.subscriptions:
+                connection.subscriptions.remove(topic_filter)
+
+    def subscription_count(self) -> int:
+        """Total number of subscriptions across all connections"""
+        with self._lock:
+            return sum(len(connection.subscriptions) for connection in self._connections)
+
+    def send_retained(self, connection: _Connection, topic_filter: str) -> None:
+        """Deliver retained messages matching a new subscription"""
+        _, real_filter = parse_subscription(topic_filter)
+        with self._lock:
+            retained = [(t, p) for t, p in self.retained.items() if mqtt.topic_matches_sub(real_filter, t)]
+        for topic, payload in retained:
+            connection.deliver(topic, payload, retain=True)
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        """Route a message to matching subscribers"""
+        targets: List[_Connection] = []
+        with self._lock:
+            self.published += 1
+            if retain:
+                if payload:
+                    self.retained[topic] = payload
+                else:
+                    self.retained.pop(topic, None)
+            shared: Dict[Tuple[str, str], List[_Connection]] = {}
+            for connection in self._connections:
+                for topic_filter in connection.subscriptions:
+                    group, real_filter = parse_subscription(topic_filter)
+                    if not mqtt.topic_matches_sub(real_filter, topic):
+                        continue
+                    if group is None:
+                        targets.append(connection)
+                    else:
+                        shared.setdefault((group, real_filter), []).append(connection)
+                    break
+            for key, members in shared.items():
+                counter = self._round_robin.setdefault(key, itertools.count())
+                targets.append(members[next(counter) % len(members)])
+        for connection in targets:
+            connection.deliver(topic, payload)
@@ -3,15 +3,42 @@ MQTT handler for RFID card reader communication (FastAPI version)
 Handles authentication and access control via MQTT messages
 """
 from datetime import datetime
+from typing import Dict, Optional, Tuple
+import argparse
+import logging
+import multiprocessing
+import signal
+import time
 import paho.mqtt.client as mqtt
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.orm import sessionmaker, scoped_session, Session
 
-from src.data.models.user import User
 from src.data.models.carddata import Card
 from src.data.models.timecard import Timecard
 from src.data.models.logdata import Log
+from src.data.util import normalize_chip, normalize_reader, reader_topic_forms
+from src.access_check import check_access
+from src.access_index import AccessIndex, ChipHolder
+from src.allowlists import (AllowlistPublisher, in_report_window, is_report, parse_report, report_topic,
+                            reader_topic)
+from src.write_behind import WriteBehindQueue
+from src.dispatcher import MessageDispatcher
+from src.partition import worker_name, worker_ring
+from src.subscriptions import TopicSubscriptions
+from src.reader_registry import ReaderInfo, ReaderRegistry
+from src.access_snapshot import AccessSnapshot
+from src.swipe_journal import SwipeJournal
+from src.coalesce import CoalescingWindow
+from src.ratelimit import ReaderRateLimiter
+from src.unknown_cards import UnknownCardSummary
+from src.metrics import DOOR_METRICS, REGISTRY, DoorMetrics, StageTimer, serve_metrics
+from src.database import build_engine
+from src.loggers import SWIPE_LOGGER, chip_hash, configure_logging, stop_logging
 from src.config import settings
+
+logger = logging.getLogger(__name__)
+# Per-message records, disabled with LOG_SWIPES=false
+swipe_logger = logging.getLogger(SWIPE_LOGGER)
+
 ACCESS_DENIED_CODE = "0"
 ACCESS_ALLOWED_CODE = "1"
 
@@ -49,14 +76,59 @@ def find_topic_substring(topic: str, hledat: str) -> bool:
 class MQTTHandler:
     """MQTT handler for card reader communication"""
     
-    def __init__(self, db_session: Session):
+    def __init__(self, db_session: Session, access_index: Optional[AccessIndex] = None,
+                 writer: Optional[WriteBehindQueue] = None,
+                 dispatcher: Optional[MessageDispatcher] = None,
+                 shared_group: Optional[str] = None,
+                 partition: Optional[Tuple[int, int]] = None,
+                 readers: Optional[ReaderRegistry] = None,
+                 journal: Optional[SwipeJournal] = None,
+                 coalescer: Optional[CoalescingWindow] = None,
+                 rate_limiter: Optional[ReaderRateLimiter] = None,
+                 unknown_cards: Optional[UnknownCardSummary] = None,
+                 metrics: DoorMetrics = DOOR_METRICS):
         """
         Initialize MQTT handler
         
         Args:
-            db_session: Database session
+            db_session: Database session (a scoped session when a dispatcher is used)
+            access_index: In-memory access index; each decision is one query (check_access) when omitted
+            writer: Write-behind queue for Card/Log rows; rows are committed inline when omitted
+            dispatcher: Worker pool for door_test; messages are processed inline when omitted
+            shared_group: Join this MQTT shared subscription group instead of subscribing alone
+            partition: (index, count) - only process reader topics this worker owns on
+                the consistent hash ring of `count` workers
+            readers: Reader registry; readers are queried per message when omitted
+            journal: Local journal recording every stored row for replay after outages
+            coalescer: Window in which repeated reads of a chip on a reader reuse the
+                first decision without storing another row
+            rate_limiter: Drops messages of reader topics (or of all readers) above their rate
+            unknown_cards: Aggregates unknown-card reads into periodic summary Log rows;
+                one row per read is stored when omitted
+            metrics: Stage timings and outcome counters of door_test
         """
         self.db = db_session
+        self.access_index = access_index
+        self.writer = writer
+        self.dispatcher = dispatcher
+        self.readers = readers
+        self.journal = journal
+        self.coalescer = coalescer
+        self.rate_limiter = rate_limiter
+        self.unknown_cards = unknown_cards
+        self.metrics = metrics
+        self.shared_group = shared_group
+        self._ring = worker_ring(partition[1]) if partition else None
+        self._node = worker_name(partition[0]) if partition else None
+        self.skipped = 0
+        # Retained per-reader allowlists, see src.allowlists
+        self.allowlists: Optional[AllowlistPublisher] = None
+        # Seconds a swipe report may be late or ahead of the server clock
+        self.report_max_age = settings.ALLOWLIST_REPORT_MAX_AGE_SECONDS
+        self.report_max_skew = settings.ALLOWLIST_REPORT_MAX_SKEW_SECONDS
+        # Registered reader topics; everything ('#') is subscribed when unset
+        self.subscriptions: Optional[TopicSubscriptions] = None
+        self.rejected = 0
         self.client = mqtt.Client()
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
@@ -71,9 +143,41 @@ class MQTTHandler:
             flags: Connection flags
             rc: Return code
         """
-        print(f"Connected to MQTT broker with result code {rc}")
-        # Subscribe to all topics (can be restricted to specific patterns)
-        client.subscribe('#', qos=0)
+        logger.info("Connected to MQTT broker with result code %s", rc)
+        if self.subscriptions is not None:
+            # Only the topics of registered readers
+            self.subscriptions.resubscribe()
+        else:
+            client.subscribe(self.subscription('#'), qos=0)
+        if self.allowlists is not None:
+            # Retained messages may be gone with a restarted broker
+            self.allowlists.republish()
+    
+    def track_reader_topics(self) -> TopicSubscriptions:
+        """Subscribe to registered reader topics only, see TopicSubscriptions.sync"""
+        self.subscriptions = TopicSubscriptions(self.client, self.subscription, self.owns)
+        return self.subscriptions
+    
+    def subscription(self, topic_filter: str) -> str:
+        """Topic filter to subscribe to, inside the shared group if one is configured"""
+        if self.shared_group:
+            return f"$share/{self.shared_group}/{topic_filter}"
+        return topic_filter
+    
+    def owns(self, topic: str) -> bool:
+        """Whether this worker is responsible for messages of `topic` (and its reports)"""
+        return self._ring is None or self._ring.owner(normalize_reader(reader_topic(topic))) == self._node
+    
+    def reader_topics(self, topics) -> frozenset:
+        """
+        Topics to subscribe for the identreader `topics`: each in the forms
+        a reader may publish on (see reader_topic_forms), with report topics
+        when allowlists are published
+        """
+        forms = frozenset(form for topic in topics for form in reader_topic_forms(topic))
+        if self.allowlists is None:
+            return forms
+        return forms | {report_topic(topic) for topic in forms}
     
     def on_message(self, client, userdata, msg):  # pylint: disable=unused-argument
         """
@@ -84,8 +188,36 @@ class MQTTHandler:
             userdata: User data
             msg: MQTT message
         """
-        print(f"{msg.topic}: {str(msg.payload)}")
-        self.door_test(msg)
+        if self.subscriptions is not None and not self.subscriptions.accepts(msg.topic):
+            self.rejected += 1
+            return
+        if not self.owns(msg.topic):
+            self.skipped += 1
+            return
+        # Flood protection before any work is queued for the message
+        if self.rate_limiter is not None and not self.rate_limiter.allow(msg.topic):
+            self.metrics.throttled.inc()
+            return
+        if swipe_logger.isEnabledFor(logging.DEBUG):
+            swipe_logger.debug("Message received", extra={'reader': msg.topic, 'size': len(msg.payload)})
+        if self.dispatcher is not None:
+            self.dispatcher.submit(msg)
+        else:
+            self.door_test(msg)
+    
+    def on_overflow(self, msg):
+        """
+        Called by the dispatcher for a message that did not fit into its queue
+
+        Args:
+            msg: Dropped MQTT message
+        """
+        logger.warning("Worker queue full, dropping message from %s", msg.topic)
+        # Only answer when the reader is known without a query, we run on paho's network thread
+        if settings.MQTT_OVERFLOW_POLICY == 'deny' and self.readers is not None:
+            reader = self.readers.lookup(msg.topic)
+            if reader is not None:
+                self.client.publish(reader.pushopen, payload=ACCESS_DENIED_CODE)
     
     def door_test(self, msg):
         """
@@ -94,68 +226,251 @@ class MQTTHandler:
         Args:
             msg: MQTT message containing card number and reader ID
         """
-        # Find timecard/reader by identifier
-        id_ctecka = self.db.query(Timecard).filter_by(
-            identreader=str(msg.topic).zfill(10)
-        ).first()
+        # Stage timings start when paho received the message
+        timer = self.metrics.timer(getattr(msg, 'timestamp', None))
+        timer.mark('queue')
         
         msgtopic = msg.topic
+        if is_report(msgtopic):
+            self.record_report(msg, timer)
+            return
         
-        if id_ctecka is not None:
-            # Extract chip number from message payload
-            try:
-                testchip = int(msg.payload)
-            except (ValueError, TypeError):
-                print(f"Invalid chip number in payload: {msg.payload}")
+        # Without the access index one statement resolves reader, holder and
+        # decision; the chip is parsed first
+        check = None
+        if self.access_index is None:
+            testchip = normalize_chip(msg.payload)
+            if testchip is None:
+                self.finish(timer, 'invalid_payload', msgtopic)
                 return
+            timer.mark('parse')
+            now = datetime.now()
+            check = check_access(self.db, testchip, msgtopic, now)
+            timer.mark('access_check')
+            if check is None:
+                self.finish(timer, 'unknown_reader', msgtopic)
+                return
+            id_ctecka = ReaderInfo(check.reader_id, check.pushopen, None)
+        else:
+            # Find timecard/reader by identifier
+            if self.readers is not None:
+                id_ctecka = self.readers.lookup(msgtopic)
+            else:
+                id_ctecka = self.db.query(Timecard).filter_by(
+                    identreader=normalize_reader(msgtopic)
+                ).first()
+            timer.mark('reader_lookup')
             
-            # Find user by chip number
-            user_chip = User.find_by_chip(testchip)
+            if id_ctecka is None:
+                self.finish(timer, 'unknown_reader', msgtopic)
+                return
             
-            if not user_chip:
-                # Log unknown card (commit separately to avoid blocking)
-                try:
-                    log = Log(
-                        time=datetime.now(),
-                        text=f"Neznama karta {code_convert(str(msg.payload))} {str(msg.payload).zfill(10)}"
-                    )
-                    self.db.add(log)
-                    self.db.commit()
-                except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"Error logging unknown card: {e}")
-                    self.db.rollback()
+            # Extract chip number from message payload, readers send decimal or hex
+            testchip = normalize_chip(msg.payload)
+            if testchip is None:
+                self.finish(timer, 'invalid_payload', msgtopic)
+                return
+            timer.mark('parse')
+        
+        # Card still held against the reader: answer as before, store nothing
+        if self.coalescer is not None:
+            repeated, decision = self.coalescer.recent((id_ctecka.id, testchip))
+            if repeated:
+                if decision is not None:
+                    self.answer(id_ctecka, decision)
+                self.finish(timer, 'coalesced', msgtopic, testchip)
+                return
+        
+        # Find user by chip number
+        if check is not None:
+            user_chip = ChipHolder(check.user_id, check.card_number) if check.user_id is not None else None
+        else:
+            user_chip = self.access_index.lookup(testchip)
+            timer.mark('user_lookup')
+        
+        if not user_chip:
+            # Log unknown card
+            payload = msg.payload.decode() if isinstance(msg.payload, bytes) else str(msg.payload)
+            text = f"Neznama karta {code_convert(payload)} {payload.zfill(10)}"
+            if self.unknown_cards is not None:
+                self.unknown_cards.add(text)
             else:
-                print("Kontrola vstupu")
-                
-                # Check access permissions
-                pomveta = User.access_by_group(testchip, msgtopic)
-                
-                # Create card access log entry
-                card = Card(
-                    card_number=user_chip.card_number,
-                    time=datetime.now(),
-                    id_card_reader=id_ctecka.id,
-                    id_user=user_chip.id,
-                    access=pomveta
-                )
-                
-                # Publish MQTT response and log in one transaction
-                try:
-                    if pomveta:
-                        # Grant access
-                        self.client.publish(id_ctecka.pushopen, payload=ACCESS_ALLOWED_CODE)
-                        print(f"{id_ctecka.pushopen} - ACCESS ALLOWED")
-                    else:
-                        # Deny access
-                        self.client.publish(id_ctecka.pushopen, payload=ACCESS_DENIED_CODE)
-                        print(f"{id_ctecka.pushopen} - ACCESS DENIED")
-                    
-                    # Log card access
-                    self.db.add(card)
-                    self.db.commit()
-                except Exception as e:  # pylint: disable=broad-exception-caught
-                    print(f"Error processing access: {e}")
-                    self.db.rollback()
+                self.persist(Log, {'time': datetime.now(), 'text': text})
+            if self.coalescer is not None:
+                self.coalescer.remember((id_ctecka.id, testchip), None)
+            timer.mark('persist')
+            self.finish(timer, 'unknown_card', msgtopic, testchip)
+            return
+        
+        # Check access permissions
+        if check is not None:
+            pomveta = check.allowed
+        else:
+            now = datetime.now()
+            pomveta = self.access_index.is_allowed(testchip, msgtopic, now)
+            timer.mark('decision')
+        
+        # Answer the reader first, persistence must not delay the door
+        self.answer(id_ctecka, pomveta)
+        timer.mark('publish')
+        timer.door(str(msgtopic))
+        if self.coalescer is not None:
+            self.coalescer.remember((id_ctecka.id, testchip), pomveta)
+        
+        # Log card access
+        self.persist(Card, {
+            'card_number': user_chip.card_number,
+            'time': now,
+            'id_card_reader': id_ctecka.id,
+            'id_user': user_chip.id,
+            'access': pomveta
+        })
+        timer.mark('persist')
+        self.finish(timer, 'allowed' if pomveta else 'denied', msgtopic, testchip)
+    
+    def record_report(self, msg, timer: StageTimer):
+        """
+        Store a swipe a reader decided from its allowlist
+
+        The reader is not answered. Reports outside the time window
+        (report_max_age / report_max_skew) are rejected; the stored row
+        carries the reader's time and the server's decision for that time,
+        a Log row records a reader that decided differently.
+
+        Args:
+            msg: MQTT message on a report topic (see src.allowlists.parse_report)
+            timer: Stage timer of the message
+        """
+        msgtopic = reader_topic(msg.topic)
+        report = parse_report(msg.payload)
+        if report is None:
+            self.finish(timer, 'invalid_payload', msgtopic)
+            return
+        if not in_report_window(report.when, datetime.now(), self.report_max_age, self.report_max_skew):
+            logger.warning("Rejected report of %s dated %s", msgtopic, report.when)
+            self.finish(timer, 'report_out_of_window', msgtopic, report.chip)
+            return
+        timer.mark('parse')
+        if self.access_index is None:
+            check = check_access(self.db, report.chip, msgtopic, report.when)
+            timer.mark('access_check')
+            reader_id = check.reader_id if check is not None else None
+            user_chip = ChipHolder(check.user_id, check.card_number) \
+                if check is not None and check.user_id is not None else None
+            allowed = check is not None and check.allowed
+        else:
+            reader = self.readers.lookup(msgtopic) if self.readers is not None else \
+                self.db.query(Timecard).filter_by(identreader=normalize_reader(msgtopic)).first()
+            reader_id = reader.id if reader is not None else None
+            user_chip = self.access_index.lookup(report.chip)
+            timer.mark('user_lookup')
+            allowed = user_chip is not None and self.access_index.is_allowed(report.chip, msgtopic, report.when)
+            timer.mark('decision')
+        if reader_id is None:
+            self.finish(timer, 'unknown_reader', msgtopic)
+            return
+        if not user_chip:
+            text = f"Neznama karta {str(report.chip).zfill(10)}"
+            if self.unknown_cards is not None:
+                self.unknown_cards.add(text, report.when)
+            else:
+                self.persist(Log, {'time': report.when, 'text': text})
+            timer.mark('persist')
+            self.finish(timer, 'unknown_card', msgtopic, report.chip)
+            return
+        self.persist(Card, {
+            'card_number': user_chip.card_number,
+            'time': report.when,
+            'id_card_reader': reader_id,
+            'id_user': user_chip.id,
+            'access': allowed
+        })
+        if report.allowed != allowed:
+            # Outdated or tampered allowlist on the reader
+            self.persist(Log, {'time': report.when, 'text': (
+                f"Nesouhlas ctecky {msgtopic}: karta {user_chip.card_number} "
+                f"ctecka {int(report.allowed)} server {int(allowed)}")})
+        timer.mark('persist')
+        self.finish(timer, 'reported' if report.allowed == allowed else 'report_mismatch', msgtopic, report.chip)
+    
+    def answer(self, reader, allowed: bool):
+        """
+        Publish the access decision to the reader's pushopen topic
+
+        Args:
+            reader: Timecard or ReaderInfo of the reader
+            allowed: Whether to open the door
+        """
+        try:
+            if allowed:
+                # Grant access
+                self.client.publish(reader.pushopen, payload=ACCESS_ALLOWED_CODE)
+            else:
+                # Deny access
+                self.client.publish(reader.pushopen, payload=ACCESS_DENIED_CODE)
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Error publishing access response: %s", e)
+    
+    def finish(self, timer: StageTimer, outcome: str, reader: str, chip: Optional[int] = None):
+        """
+        Record the metrics of a finished door_test and log the decision
+
+        Args:
+            timer: Stage timer of the message
+            outcome: allowed, denied, unknown_card, ...
+            reader: Reader topic
+            chip: Chip number, hashed in the log record
+        """
+        timer.finish(outcome)
+        if swipe_logger.isEnabledFor(logging.INFO):
+            swipe_logger.info("Door decision", extra={
+                'reader': reader,
+                'chip': chip_hash(chip) if chip is not None else None,
+                'decision': outcome,
+                'latency_ms': round(timer.elapsed() * 1000, 3),
+            })
+    
+    def persist(self, model: type, values: Dict):
+        """
+        Store a Card or Log row
+
+        Rows are recorded in the journal first when one is configured, then
+        go through the write-behind queue or are committed immediately.
+
+        Args:
+            model: Mapped class of the row
+            values: Column values
+        """
+        if self.journal is not None:
+            self.journal.record(model, values)
+        if self.writer is not None:
+            self.writer.submit(model, values)
+            return
+        try:
+            self.db.add(model(**values))
+            self.db.commit()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Error storing %s: %s", model.__name__, e)
+            self.db.rollback()
+    
+    def stats(self) -> Dict[str, float]:
+        """Runtime counters of the handler"""
+        stats = {'partition_skipped': self.skipped, 'unknown_topic_rejected': self.rejected}
+        if self.dispatcher is not None:
+            stats.update(self.dispatcher.stats())
+        if self.writer is not None:
+            stats.update(self.writer.stats())
+        if self.journal is not None:
+            stats.update(self.journal.stats())
+        if self.coalescer is not None:
+            stats.update(self.coalescer.stats())
+        if self.rate_limiter is not None:
+            stats.update(self.rate_limiter.stats())
+        if self.unknown_cards is not None:
+            stats.update(self.unknown_cards.stats())
+        if self.allowlists is not None:
+            stats.update(self.allowlists.stats())
+        return stats
     
     def connect(self, host: str = None, port: int = None, keepalive: int = 60):
         """
@@ -176,28 +491,218 @@ class MQTTHandler:
         self.client.loop_forever()
     
     def stop(self):
-        """Stop MQTT client"""
+        """Stop MQTT client, finish queued messages and flush pending rows"""
         self.client.disconnect()
+        if self.allowlists is not None:
+            self.allowlists.stop()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        if self.unknown_cards is not None:
+            self.unknown_cards.stop()
+        if self.writer is not None:
+            self.writer.stop()
+        if self.journal is not None:
+            self.journal.stop()
+
 
+def build_handler(session_factory: sessionmaker, db: Session, readers: ReaderRegistry,
+                  partition_index: int = 0, partitions: int = 1,
+                  mode: Optional[str] = None) -> MQTTHandler:
+    """
+    Wire an MQTTHandler with the components enabled in settings
 
-def start_mqtt_listener():
+    Restores the offline snapshot, starts the access index (and `readers`
+    unless already running), the write-behind queue, the journal and the
+    flood protection. The caller adds a dispatcher, connects the client and
+    stops the handler, its access index and `readers` when done.
+
+    Args:
+        session_factory: Factory for the sessions of the background components
+        db: Session of door_test (a scoped session when processed on several threads)
+        readers: Reader registry, shared with the web app when run in its process
+        partition_index: Index of this worker process
+        partitions: Number of worker processes sharing the readers
+        mode: "shared" (MQTT shared subscription) or "hash" (consistent-hash
+            partition of reader topics), used when partitions > 1
+    """
+    # Rules come from the offline snapshot first, so decisions can be
+    # served before (or without) the first successful query
+    access_index = AccessIndex(session_factory) if settings.ACCESS_INDEX_ENABLED else None
+    if access_index is not None and settings.ACCESS_SNAPSHOT_PATH:
+        snapshot = AccessSnapshot(settings.ACCESS_SNAPSHOT_PATH, access_index, readers)
+        if snapshot.restore():
+            logger.info("Access snapshot restored with %d chips and %d readers", len(access_index), len(readers))
+        snapshot.watch()
+    if not readers.running:
+        readers.start(settings.READER_REFRESH_SECONDS)
+    logger.info("Reader registry loaded with %d readers", len(readers))
+    if access_index is not None:
+        access_index.start(settings.ACCESS_INDEX_REFRESH_SECONDS)
+        logger.info("Access index built with %d chips", len(access_index))
+    
+    writer = None
+    if settings.WRITE_BEHIND_ENABLED:
+        writer = WriteBehindQueue(
+            session_factory,
+            batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+            flush_interval=settings.WRITE_BEHIND_FLUSH_SECONDS,
+            retry_interval=settings.WRITE_BEHIND_RETRY_SECONDS,
+            max_retry_interval=settings.WRITE_BEHIND_MAX_RETRY_SECONDS,
+            max_rows=settings.WRITE_BEHIND_MAX_ROWS
+        ).start()
+    
+    # Every decision is journaled; rows missing from the database (outage,
+    # failed batch) are replayed from the journal in the background
+    journal = None
+    if settings.SWIPE_JOURNAL_PATH:
+        journal_path = settings.SWIPE_JOURNAL_PATH
+        if partitions > 1:
+            journal_path = f"{journal_path}.{partition_index}"
+        journal = SwipeJournal(journal_path, sync_interval=settings.SWIPE_JOURNAL_SYNC_SECONDS).start()
+        journal.start_replay(session_factory, settings.SWIPE_JOURNAL_REPLAY_SECONDS,
+                             settle=settings.SWIPE_JOURNAL_SETTLE_SECONDS,
+                             compact_bytes=settings.SWIPE_JOURNAL_COMPACT_BYTES)
+    
+    shared_group, partition = None, None
+    if partitions > 1:
+        if (mode or settings.MQTT_SCALE_MODE) == 'hash':
+            partition = (partition_index, partitions)
+        else:
+            shared_group = settings.MQTT_SHARED_GROUP
+    
+    handler = MQTTHandler(db, access_index, writer, shared_group=shared_group, partition=partition,
+                          readers=readers, journal=journal)
+    if settings.MQTT_COALESCE_SECONDS > 0:
+        handler.coalescer = CoalescingWindow(settings.MQTT_COALESCE_SECONDS,
+                                             settings.MQTT_COALESCE_MAX_ENTRIES)
+    if settings.MQTT_READER_RATE > 0 or settings.MQTT_GLOBAL_RATE > 0:
+        handler.rate_limiter = ReaderRateLimiter(
+            settings.MQTT_READER_RATE, settings.MQTT_READER_BURST,
+            settings.MQTT_GLOBAL_RATE, settings.MQTT_GLOBAL_BURST
+        )
+    if settings.UNKNOWN_CARD_SUMMARY_SECONDS > 0:
+        handler.unknown_cards = UnknownCardSummary(handler.persist,
+                                                   settings.UNKNOWN_CARD_SUMMARY_SECONDS).start()
+    if settings.ALLOWLIST_ENABLED:
+        if access_index is None:
+            logger.warning("ALLOWLIST_ENABLED needs ACCESS_INDEX_ENABLED, no allowlists are published")
+        else:
+            # Every list is published once: by its owner with hash
+            # partitions, otherwise by the first process
+            owns = handler.owns if partition else lambda topic: partition_index == 0
+            handler.allowlists = AllowlistPublisher(
+                handler.client, access_index, readers,
+                interval=settings.ALLOWLIST_PUBLISH_SECONDS, rate=settings.ALLOWLIST_RATE,
+                burst=settings.ALLOWLIST_BURST, delta_ratio=settings.ALLOWLIST_DELTA_RATIO, owns=owns
+            ).start()
+    if not settings.MQTT_SUBSCRIBE_ALL:
+        subscriptions = handler.track_reader_topics()
+        readers.add_listener(lambda registry: subscriptions.sync(handler.reader_topics(registry.topics())))
+        subscriptions.sync(handler.reader_topics(readers.topics()))
+    handler.metrics.start()
+    REGISTRY.add_collector('mqtt', handler.stats)
+    return handler
+
+
+def start_mqtt_listener(partition_index: int = 0, partitions: int = 1,
+                        mode: Optional[str] = None):
     """
     Start MQTT listener for card readers
     This function should be run in a separate thread/process
+
+    Args:
+        partition_index: Index of this worker process
+        partitions: Number of worker processes sharing the readers
+        mode: "shared" (MQTT shared subscription) or "hash" (consistent-hash
+            partition of reader topics), used when partitions > 1
     """
-    # Create database session
-    engine = create_engine(settings.DATABASE_URL)
+    configure_logging()
+    # Create database session, one per worker thread
+    engine = build_engine()
     session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    db = session_factory()
-    
+    db = scoped_session(session_factory)
+    readers = ReaderRegistry(session_factory)
+    handler = build_handler(session_factory, db, readers, partition_index, partitions, mode)
+    if settings.MQTT_METRICS_PORT:
+        # One port per listener process
+        serve_metrics(settings.MQTT_METRICS_PORT + partition_index, settings.MQTT_METRICS_HOST)
+    if settings.MQTT_WORKER_THREADS > 0:
+        handler.dispatcher = MessageDispatcher(
+            handler.door_test,
+            workers=settings.MQTT_WORKER_THREADS,
+            queue_size=settings.MQTT_QUEUE_SIZE,
+            on_overflow=handler.on_overflow
+        ).start()
+    # Graceful shutdown: leave loop_forever and flush queued rows
+    signal.signal(signal.SIGTERM, lambda signum, frame: handler.client.disconnect())
     try:
-        handler = MQTTHandler(db)
         handler.connect()
-        print(f"Starting MQTT listener on {settings.MQTT_BROKER}:{settings.MQTT_PORT}")
+        logger.info("Starting MQTT listener on %s:%s", settings.MQTT_BROKER, settings.MQTT_PORT)
         handler.start()
     finally:
-        db.close()
+        handler.stop()
+        readers.stop()
+        if handler.access_index is not None:
+            handler.access_index.stop()
+        db.remove()
+        stop_logging()
+
+
+def run_mqtt_workers(processes: int, mode: Optional[str] = None):
+    """
+    Run `processes` listener processes and restart any that dies
+
+    Every process builds its own engine, connection pool and access index.
+
+    Args:
+        processes: Number of listener processes
+        mode: "shared" or "hash", see start_mqtt_listener
+    """
+    configure_logging()
+    mode = mode or settings.MQTT_SCALE_MODE
+    context = multiprocessing.get_context('spawn')
+    workers = {}
+    stopping = []
+
+    def spawn(index):
+        process = context.Process(target=start_mqtt_listener, args=(index, processes, mode),
+                                  name=worker_name(index), daemon=False)
+        process.start()
+        workers[index] = process
+
+    def shutdown(signum, frame):  # pylint: disable=unused-argument
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    logger.info("Starting %d MQTT listener processes (%s mode)", processes, mode)
+    for index in range(processes):
+        spawn(index)
+    while not stopping:
+        time.sleep(1)
+        for index, process in list(workers.items()):
+            if not process.is_alive() and not stopping:
+                logger.warning("%s exited with code %s, restarting", process.name, process.exitcode)
+                spawn(index)
+    for process in workers.values():
+        process.terminate()
+    for process in workers.values():
+        process.join()
+
+
+def main(argv=None):
+    """Command line entry point of the MQTT worker"""
+    parser = argparse.ArgumentParser(description="MQTT listener for card readers")
+    parser.add_argument('--processes', type=int, default=settings.MQTT_WORKER_PROCESSES,
+                        help="number of listener processes")
+    parser.add_argument('--mode', choices=('shared', 'hash'), default=settings.MQTT_SCALE_MODE,
+                        help="how processes split the readers")
+    args = parser.parse_args(argv)
+    if args.processes > 1:
+        run_mqtt_workers(args.processes, args.mode)
+    else:
+        start_mqtt_listener()
 
 
 if __name__ == "__main__":
-    start_mqtt_listener()
+    main()
@@ -0,0 +1,53 @@
+"""
+Consistent-hash partitioning of reader topics between MQTT worker processes
+Used when the broker does not support shared subscriptions
+"""
+import bisect
+import hashlib
+from typing import Iterable, List, Tuple
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes
+
+    Adding or removing a worker only moves the topics of that worker,
+    every other topic keeps its owner.
+    """
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 64):
+        """
+        Initialize hash ring
+
+        Args:
+            nodes: Names of the workers sharing the topics
+            replicas: Virtual nodes per worker, more gives a smoother spread
+        """
+        self.replicas = replicas
+        points: List[Tuple[int, str]] = []
+        for node in nodes:
+            points.extend((_hash(f"{node}#{replica}"), node) for replica in range(replicas))
+        if not points:
+            raise ValueError("HashRing needs at least one node")
+        points.sort()
+        self._keys = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> str:
+        """Return the node responsible for `key`"""
+        slot = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._nodes[slot]
+
+
+def worker_name(index: int) -> str:
+    """Node name of the worker process with the given index"""
+    return f"worker-{index}"
+
+
+def worker_ring(count: int) -> HashRing:
+    """Hash ring shared by `count` worker processes"""
+    return HashRing(worker_name(index) for index in range(count))
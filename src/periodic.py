@@ -0,0 +1,54 @@
+"""
+Background helper for periodic maintenance work (cache refreshes, flushes)
+"""
+import logging
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Runs a callable on a daemon thread every `interval` seconds or when triggered"""
+
+    def __init__(self, interval: float, func: Callable[[], None], name: Optional[str] = None):
+        """
+        Initialize periodic task
+
+        Args:
+            interval: Seconds between two runs
+            func: Callable executed on every run
+            name: Thread name
+        """
+        self.interval = interval
+        self.func = func
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self) -> 'PeriodicTask':
+        """Start the background thread"""
+        self._thread.start()
+        return self
+
+    def trigger(self) -> None:
+        """Run the task as soon as possible instead of waiting for the interval"""
+        self._wake.set()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the background thread and wait for it to finish"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.func()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.exception("Periodic task %s failed: %s", self._thread.name, e)
@@ -0,0 +1,128 @@
+"""
+Flood protection for the MQTT ingest path
+Token buckets per reader topic and for the whole worker, so that one
+faulty or spoofed reader cannot saturate door_test and the database
+"""
+import threading
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """Allows `rate` events per second with bursts of up to `burst` events"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: Optional[float] = None):
+        """
+        Initialize a full bucket
+
+        Args:
+            rate: Tokens added per second
+            burst: Capacity of the bucket
+            now: Current monotonic time
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic() if now is None else now
+
+    def allow(self, now: Optional[float] = None) -> bool:
+        """Take one token if there is one"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+    def idle(self, now: float) -> bool:
+        """Whether the bucket has refilled completely"""
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class ReaderRateLimiter:
+    """
+    Per-topic token buckets in front of a global one
+
+    A message must pass its reader's bucket first, so a flooding reader
+    only uses up its own tokens and never the global ones the other doors
+    depend on.
+    """
+
+    def __init__(self, rate: float, burst: float, global_rate: float = 0.0,
+                 global_burst: float = 0.0, max_readers: int = 10000):
+        """
+        Initialize rate limiter
+
+        Args:
+            rate: Messages per second allowed for one reader topic (0 = unlimited)
+            burst: Messages one reader may send at once
+            global_rate: Messages per second allowed for all readers (0 = unlimited)
+            global_burst: Messages all readers may send at once
+            max_readers: Buckets kept before idle ones are dropped
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_readers = max_readers
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._global = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self._lock = threading.Lock()
+
+        # Counters
+        self.allowed = 0
+        self.throttled: Dict[str, int] = {}
+        self._last_throttled: Dict[str, float] = {}
+        self.global_throttled = 0
+
+    def allow(self, topic: str, now: Optional[float] = None) -> bool:
+        """
+        Whether a message on `topic` may be processed
+
+        Args:
+            topic: Reader topic of the message
+            now: Current monotonic time
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.rate > 0:
+                bucket = self._buckets.get(topic)
+                if bucket is None:
+                    if len(self._buckets) >= self.max_readers:
+                        self._drop_idle(now)
+                    bucket = self._buckets[topic] = TokenBucket(self.rate, self.burst, now)
+                if not bucket.allow(now):
+                    self.throttled[topic] = self.throttled.get(topic, 0) + 1
+                    self._last_throttled[topic] = now
+                    return False
+            if self._global is not None and not self._global.allow(now):
+                self.global_throttled += 1
+                return False
+            self.allowed += 1
+            return True
+
+    def throttled_readers(self, within: float = 60.0, now: Optional[float] = None) -> Dict[str, int]:
+        """
+        Readers throttled in the last `within` seconds
+
+        Returns:
+            topic -> messages dropped for it since start
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return {topic: self.throttled[topic] for topic, last in self._last_throttled.items()
+                    if now - last <= within}
+
+    def stats(self) -> Dict[str, float]:
+        """Counters for monitoring"""
+        return {
+            'rate_limit_allowed': self.allowed,
+            'rate_limit_throttled': sum(self.throttled.values()),
+            'rate_limit_global_throttled': self.global_throttled,
+            'rate_limit_throttled_readers': len(self.throttled_readers()),
+        }
+
+    def _drop_idle(self, now: float) -> None:
+        for topic in [topic for topic, bucket in self._buckets.items() if bucket.idle(now)]:
+            del self._buckets[topic]
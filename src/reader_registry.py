@@ -0,0 +1,152 @@
+"""
+Registry of card readers keyed by their identreader MQTT topic
+Shared by the MQTT worker and the web app so that resolving a reader
+never costs a query
+"""
+import threading
+from collections import namedtuple
+from datetime import datetime
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+from sqlalchemy.orm import Session
+
+from src.config import settings
+from src.data.events import on_models_changed
+from src.data.models.timecard import Timecard
+from src.data.util import normalize_reader
+from src.database import SessionLocal
+from src.periodic import PeriodicTask
+
+ReaderInfo = namedtuple('ReaderInfo', ['id', 'pushopen', 'name'])
+
+
+def load_readers(session: Session) -> Dict[str, ReaderInfo]:
+    """Return identreader -> ReaderInfo for every registered reader"""
+    rows = session.query(Timecard.id, Timecard.identreader, Timecard.pushopen, Timecard.timecard_name)\
+        .filter(Timecard.identreader.isnot(None)).order_by(Timecard.id).all()
+    readers: Dict[str, ReaderInfo] = {}
+    for reader_id, identreader, pushopen, name in rows:
+        # The first reader wins, as with query(...).first()
+        readers.setdefault(normalize_reader(identreader), ReaderInfo(reader_id, pushopen, name))
+    return readers
+
+
+class ReaderRegistry:
+    """
+    In-memory topic -> (timecard id, pushopen topic, name) map
+
+    The registry is reloaded every `interval` seconds and right after commits
+    in this process that touch the timecard table. `version` only changes
+    when the readers actually changed; listeners are notified then.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        """
+        Initialize reader registry
+
+        Args:
+            session_factory: Factory for the short-lived sessions used by reloads
+        """
+        self._session_factory = session_factory
+        self._readers: Dict[str, ReaderInfo] = {}
+        self._listeners: List[Callable[['ReaderRegistry'], None]] = []
+        self._refresh_lock = threading.Lock()
+        self._refresher: Optional[PeriodicTask] = None
+        self._unwatch: Optional[Callable[[], None]] = None
+        self.version = 0
+        self.changed_at: Optional[datetime] = None
+
+    def __len__(self) -> int:
+        return len(self._readers)
+
+    def lookup(self, topic: str) -> Optional[ReaderInfo]:
+        """Resolve the reader publishing on `topic`, like the identreader query in door_test"""
+        return self._readers.get(normalize_reader(topic))
+
+    def topics(self) -> FrozenSet[str]:
+        """identreader topics of all registered readers"""
+        return frozenset(self._readers)
+
+    def items(self):
+        """(identreader, ReaderInfo) pairs"""
+        return self._readers.items()
+
+    @property
+    def running(self) -> bool:
+        """Whether the registry is kept current in the background"""
+        return self._refresher is not None
+
+    def add_listener(self, callback: Callable[['ReaderRegistry'], None]) -> None:
+        """Call `callback(registry)` whenever the set of readers changes"""
+        self._listeners.append(callback)
+
+    def load(self, readers: Dict[str, ReaderInfo]) -> bool:
+        """
+        Replace the registered readers
+
+        Returns:
+            True if anything changed
+        """
+        if readers == self._readers:
+            return False
+        self._readers = readers
+        self.version += 1
+        self.changed_at = datetime.now()
+        for callback in self._listeners:
+            callback(self)
+        return True
+
+    def refresh(self) -> bool:
+        """Reload readers from the database"""
+        with self._refresh_lock:
+            session = self._session_factory()
+            try:
+                readers = load_readers(session)
+            finally:
+                session.close()
+            return self.load(readers)
+
+    def invalidate(self) -> None:
+        """Schedule a reload on the background thread (or reload now if none runs)"""
+        if self._refresher is not None:
+            self._refresher.trigger()
+        else:
+            self.refresh()
+
+    def start(self, interval: float) -> 'ReaderRegistry':
+        """
+        Load readers and keep them current
+
+        When readers were already loaded (from a snapshot) the first reload
+        runs in the background instead.
+        """
+        preloaded = bool(self.version)
+        if not preloaded:
+            self.refresh()
+        self._unwatch = on_models_changed((Timecard,), self.invalidate)
+        self._refresher = PeriodicTask(interval, self.refresh, name='reader-registry').start()
+        if preloaded:
+            self._refresher.trigger()
+        return self
+
+    def stop(self) -> None:
+        """Stop background reloading"""
+        if self._unwatch is not None:
+            self._unwatch()
+            self._unwatch = None
+        if self._refresher is not None:
+            self._refresher.stop()
+            self._refresher = None
+
+
+_registry: Optional[ReaderRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_reader_registry() -> ReaderRegistry:
+    """Process-wide registry backed by the web app's session factory"""
+    global _registry  # pylint: disable=global-statement
+    with _registry_lock:
+        if _registry is None:
+            _registry = ReaderRegistry(SessionLocal).start(settings.READER_REFRESH_SECONDS)
+        return _registry
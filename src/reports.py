@@ -0,0 +1,198 @@
+"""
+Attendance reports read from the daily_attendance rollup of carddata
+One query per report instead of one query per user and day
+"""
+import calendar
+from collections import namedtuple
+from datetime import date
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from src.data.dates import month_range
+from src.data.models.carddata import MEAL_VOUCHER_HOURS
+from src.data.models.dailyattendance import DailyAttendance
+from src.data.models.user import User
+from src.data.models.vazby import User_has_group
+
+# One day of a user: first and last swipe (None without swipes), hours between them
+ReportDay = namedtuple('ReportDay', ['day', 'dow', 'first_in', 'last_out', 'hours', 'swipes'])
+
+# Month of one user, a ReportDay for every day of the month
+MonthlyReport = namedtuple('MonthlyReport', ['user_id', 'user_name', 'card_number', 'year', 'month',
+                                             'total_hours', 'days'])
+
+# Meal vouchers of one user for a month
+MealVouchers = namedtuple('MealVouchers', ['user_id', 'user_name', 'card_number', 'year', 'month', 'vouchers'])
+
+
+def _full_name(name, second_name, username) -> str:
+    return ' '.join(part for part in (name, second_name) if part) or username or ''
+
+
+def monthly_report(session: Session, year: int, month: int,
+                   user_id: Optional[int] = None) -> List[MonthlyReport]:
+    """
+    First-in, last-out and hours of every day of a month
+
+    The days come from the daily_attendance rollup (one row per user and
+    day), so the report does not scan carddata.
+
+    Args:
+        session: Database session
+        year: Year of the report
+        month: Month of the report (1-12)
+        user_id: Only this user; every user with swipes in the month when omitted
+
+    Returns:
+        One MonthlyReport per user, ordered by second name and name; empty
+        when `user_id` does not exist
+    """
+    start, end = month_range(year, month)
+    of_month = and_(DailyAttendance.day >= start.date(), DailyAttendance.day < end.date())
+    query = select(User.id, User.name, User.second_name, User.username, User.card_number,
+                   DailyAttendance.day, DailyAttendance.first_in, DailyAttendance.last_out,
+                   DailyAttendance.swipes, DailyAttendance.worked_minutes)
+    if user_id is not None:
+        # The user's month, also without any swipes
+        query = query.outerjoin(DailyAttendance, and_(DailyAttendance.user_id == User.id, of_month))\
+            .where(User.id == user_id)
+    else:
+        query = query.join(DailyAttendance, DailyAttendance.user_id == User.id).where(of_month)
+    rows = session.execute(query.order_by(User.second_name, User.name, User.id))
+
+    users: Dict[int, tuple] = {}
+    swipes_by_user: Dict[int, Dict[int, tuple]] = {}
+    for user, name, second_name, username, card_number, swipe_day, first_in, last_out, swipes, minutes in rows:
+        if user not in users:
+            users[user] = (_full_name(name, second_name, username), card_number)
+            swipes_by_user[user] = {}
+        if swipe_day is not None:
+            swipes_by_user[user][swipe_day.day] = (first_in, last_out, swipes, minutes)
+
+    last_day = calendar.monthrange(year, month)[1]
+    reports = []
+    for user, (full_name, card_number) in users.items():
+        days = []
+        by_day = swipes_by_user[user]
+        for number in range(1, last_day + 1):
+            dow = date(year, month, number).weekday()
+            if number in by_day:
+                first_in, last_out, swipes, minutes = by_day[number]
+                hours = round(minutes / 60, 2)
+                days.append(ReportDay(number, dow, first_in.time(), last_out.time(), hours, swipes))
+            else:
+                days.append(ReportDay(number, dow, None, None, 0.0, 0))
+        total = round(sum(report_day.hours for report_day in days), 2)
+        reports.append(MonthlyReport(user, full_name, card_number, year, month, total, days))
+    return reports
+
+
+def meal_vouchers(session: Session, year: int, month: int, group_id: Optional[int] = None,
+                  min_hours: float = MEAL_VOUCHER_HOURS, working_days_only: bool = False) -> List[MealVouchers]:
+    """
+    Meal vouchers of every user for a month, counted in one statement
+
+    A day earns a voucher when its first and last swipe are at least
+    `min_hours` apart, like Card.stravenky; the days come from the
+    daily_attendance rollup.
+
+    Args:
+        session: Database session
+        year: Year of the month
+        month: Month (1-12)
+        group_id: Only members of this group; every user when omitted
+        min_hours: Hours between the first and the last swipe of a day
+        working_days_only: Count Monday to Friday only
+
+    Returns:
+        One MealVouchers per user, also without vouchers, ordered by second
+        name and name
+    """
+    start, end = month_range(year, month)
+    earning = [DailyAttendance.user_id == User.id,
+               DailyAttendance.day >= start.date(), DailyAttendance.day < end.date(),
+               DailyAttendance.worked_minutes >= round(min_hours * 60)]
+    if working_days_only:
+        # The month's weekdays as a list keeps the filter portable and the day index usable
+        last_day = calendar.monthrange(year, month)[1]
+        earning.append(DailyAttendance.day.in_([
+            date(year, month, number) for number in range(1, last_day + 1)
+            if date(year, month, number).weekday() < 5]))
+    columns = (User.id, User.name, User.second_name, User.username, User.card_number)
+    query = select(*columns, func.count(DailyAttendance.id))\
+        .outerjoin(DailyAttendance, and_(*earning))
+    if group_id is not None:
+        query = query.where(User.id.in_(select(User_has_group.user_id).where(User_has_group.group_id == group_id)))
+    rows = session.execute(query.group_by(*columns).order_by(User.second_name, User.name, User.id))
+    return [MealVouchers(user, _full_name(name, second_name, username), card_number, year, month, vouchers)
+            for user, name, second_name, username, card_number, vouchers in rows]
+
+
+# Header cell of the hours matrix
+MatrixDay = namedtuple('MatrixDay', ['day', 'dow'])
+
+# One user of the hours matrix; every list has a cell per day of the month,
+# times as 'HH:MM' ('' without swipes), hours None without swipes
+HoursRow = namedtuple('HoursRow', ['user_id', 'user_name', 'card_number', 'arrivals', 'departures', 'hours',
+                                   'vouchers', 'total_hours'])
+
+# Users x days matrix of a month, rows ordered like the other reports
+HoursMatrix = namedtuple('HoursMatrix', ['year', 'month', 'days', 'rows'])
+
+
+def hours_matrix(session: Session, year: int, month: int, group_id: Optional[int] = None) -> HoursMatrix:
+    """
+    Arrival, departure and hours of every user and day of a month
+
+    The month is read from the daily_attendance rollup with one statement
+    as columns and scattered into the matrix by day number, so building it
+    is linear in the number of user days and the template only iterates.
+
+    Args:
+        session: Database session
+        year: Year of the report
+        month: Month of the report (1-12)
+        group_id: Only members of this group; every user when omitted
+
+    Returns:
+        HoursMatrix with a row per user, also without swipes
+    """
+    start, end = month_range(year, month)
+    of_month = and_(DailyAttendance.user_id == User.id,
+                    DailyAttendance.day >= start.date(), DailyAttendance.day < end.date())
+    query = select(User.id, User.name, User.second_name, User.username, User.card_number,
+                   DailyAttendance.day, DailyAttendance.first_in, DailyAttendance.last_out,
+                   DailyAttendance.worked_minutes, DailyAttendance.meal_voucher)\
+        .outerjoin(DailyAttendance, of_month)
+    if group_id is not None:
+        query = query.where(User.id.in_(select(User_has_group.user_id).where(User_has_group.group_id == group_id)))
+    rows = session.execute(query.order_by(User.second_name, User.name, User.id)).all()
+
+    last_day = calendar.monthrange(year, month)[1]
+    days = [MatrixDay(number, date(year, month, number).weekday()) for number in range(1, last_day + 1)]
+    if not rows:
+        return HoursMatrix(year, month, days, [])
+    (user_ids, names, second_names, usernames, card_numbers,
+     swipe_days, firsts, lasts, minutes, vouchers) = zip(*rows)
+
+    matrix: List[HoursRow] = []
+    row = None
+    for position, user in enumerate(user_ids):
+        if row is None or row.user_id != user:
+            row = HoursRow(user, _full_name(names[position], second_names[position], usernames[position]),
+                           card_numbers[position], [''] * last_day, [''] * last_day, [None] * last_day,
+                           [False] * last_day, 0.0)
+            matrix.append(row)
+        swipe_day = swipe_days[position]
+        if swipe_day is None:
+            continue
+        index = swipe_day.day - 1
+        row.arrivals[index] = firsts[position].strftime('%H:%M')
+        row.departures[index] = lasts[position].strftime('%H:%M')
+        row.hours[index] = round(minutes[position] / 60, 2)
+        row.vouchers[index] = bool(vouchers[position])
+    matrix = [row._replace(total_hours=round(sum(hours for hours in row.hours if hours is not None), 2))
+              for row in matrix]
+    return HoursMatrix(year, month, days, matrix)
@@ -0,0 +1,100 @@
+"""
+Access router for FastAPI
+Decides batches of swipes for reader gateways that speak HTTP instead of MQTT
+and takes the swipes readers buffered while offline
+"""
+from datetime import datetime
+
+from fastapi import APIRouter, Depends
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from src.access_check import AccessRequest, check_access_batch
+from src.attendance import refresh_days
+from src.auth_utils import get_current_active_user
+from src.data.models.carddata import Card
+from src.data.util import normalize_chip
+from src.database import get_db
+from src.schemas import (
+    AccessCheckRequest,
+    AccessCheckResponse,
+    AccessDecision,
+    BulkSwipesRequest,
+    BulkSwipesResponse
+)
+from src.swipe_import import BufferedSwipe, import_swipes
+
+router = APIRouter()
+
+
+@router.post("/check", response_model=AccessCheckResponse)
+def check(batch: AccessCheckRequest, db: Session = Depends(get_db),
+          current_user=Depends(get_current_active_user)):  # pylint: disable=unused-argument
+    """
+    Decide a batch of swipes with the rules of the MQTT door path
+
+    The whole batch costs a fixed number of queries (see
+    check_access_batch). With `record` the swipes of known chips on known
+    readers are stored in carddata with one bulk insert.
+
+    Args:
+        batch: Swipes and whether to record them
+        db: Database session
+        current_user: Authenticated gateway account
+
+    Returns:
+        One decision per swipe, in request order
+    """
+    now = datetime.now()
+    requests = [AccessRequest(normalize_chip(item.chip), item.reader, item.time or now) for item in batch.items]
+    checks = check_access_batch(db, requests)
+
+    decisions, rows = [], []
+    for item, request, result in zip(batch.items, requests, checks):
+        known_chip = result is not None and result.user_id is not None
+        decisions.append(AccessDecision(chip=item.chip, reader=item.reader,
+                                        allowed=result is not None and result.allowed,
+                                        known_reader=result is not None, known_chip=known_chip))
+        if batch.record and known_chip:
+            rows.append({
+                'card_number': result.card_number,
+                'time': request.when,
+                'id_card_reader': result.reader_id,
+                'id_user': result.user_id,
+                'access': result.allowed,
+            })
+    if rows:
+        db.execute(insert(Card), rows)
+        db.commit()
+        refresh_days(db, [row['time'] for row in rows])
+    return AccessCheckResponse(decisions=decisions, recorded=len(rows))
+
+
+@router.post("/swipes/bulk", response_model=BulkSwipesResponse)
+def bulk_swipes(batch: BulkSwipesRequest, db: Session = Depends(get_db),
+                current_user=Depends(get_current_active_user)):  # pylint: disable=unused-argument
+    """
+    Store swipes that readers buffered while offline
+
+    Swipes are not answered; they are checked against the registered
+    readers and chips, deduplicated against carddata and inserted in
+    chunks (see src.swipe_import).
+
+    Args:
+        batch: Buffered swipes
+        db: Database session
+        current_user: Authenticated gateway account
+
+    Returns:
+        Counts of inserted, duplicate and rejected swipes
+    """
+    swipes, invalid = [], 0
+    for item in batch.items:
+        chip = normalize_chip(item.chip)
+        if chip is None:
+            invalid += 1
+            continue
+        swipes.append(BufferedSwipe(chip, item.reader, item.time, item.allowed))
+    summary = import_swipes(db, swipes)
+    summary['received'] += invalid
+    return BulkSwipesResponse(invalid_chip=invalid, **summary)
@@ -17,11 +17,35 @@ from src.auth_utils import (
     get_current_active_user
 )
 from src.data.models.user import User as UserModel
+from src.data.util import normalize_chip
 from src.config import settings
 
 router = APIRouter()
 
 
+def check_chip_number(db: Session, chip_number: str, user_id: int = None) -> None:
+    """
+    Raise 400 unless `chip_number` is a chip number not held by another user
+
+    Args:
+        db: Database session
+        chip_number: Chip number, decimal or hex
+        user_id: User the chip is for, when updating
+    """
+    chip_id = normalize_chip(chip_number)
+    if chip_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid chip number"
+        )
+    holder = db.query(UserModel.id).filter(UserModel.chip_id == chip_id).scalar()
+    if holder is not None and holder != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Chip already registered"
+        )
+
+
 @router.post("/register", response_model=User, status_code=status.HTTP_201_CREATED)
 async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     """
@@ -51,6 +75,10 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
             detail="Email already registered"
         )
     
+    # Check if chip is free
+    if user_data.chip_number:
+        check_chip_number(db, user_data.chip_number)
+    
     # Create new user
     hashed_password = get_password_hash(user_data.password)
     db_user = UserModel(
@@ -148,6 +176,7 @@ async def update_user_me(
     if user_update.card_number:
         current_user.card_number = user_update.card_number
     if user_update.chip_number:
+        check_chip_number(db, user_update.chip_number, current_user.id)
         current_user.chip_number = user_update.chip_number
     if user_update.password:
         current_user.password_hash = get_password_hash(user_update.password)
@@ -0,0 +1,22 @@
+"""
+Metrics router for FastAPI
+Exposes in-process metrics in Prometheus text format
+"""
+from fastapi import APIRouter, Depends, Response
+
+from src.auth_utils import get_current_active_user
+from src.metrics import CONTENT_TYPE, DOOR_METRICS, REGISTRY
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@router.get("/metrics/doors")
+async def door_latency(_current_user=Depends(get_current_active_user)):
+    """p50/p95/p99 door latency in seconds and swipe count per reader, for authenticated users"""
+    return DOOR_METRICS.reader_quantiles()
@@ -0,0 +1,121 @@
+"""
+Reports router for FastAPI
+Attendance reports read from the daily attendance rollup
+"""
+import csv
+import io
+from typing import List
+
+from fastapi import APIRouter, Depends, Request, Response
+from fastapi.responses import HTMLResponse
+from fastapi.templating import Jinja2Templates
+from sqlalchemy.orm import Session
+
+from src.auth_utils import get_current_active_user
+from src.data.models.carddata import MEAL_VOUCHER_HOURS
+from src.database import get_db
+from src.reports import MealVouchers, hours_matrix, meal_vouchers, monthly_report
+from src.schemas import (
+    HoursMatrixRequest,
+    HoursMatrixResponse,
+    MealVouchersRequest,
+    MealVouchersResponse,
+    MonthlyReportRequest,
+    MonthlyReportResponse
+)
+
+router = APIRouter()
+templates = Jinja2Templates(directory="src/templates")
+
+
+@router.post("/monthly", response_model=List[MonthlyReportResponse])
+def monthly(request: MonthlyReportRequest, db: Session = Depends(get_db),
+            _current_user=Depends(get_current_active_user)):
+    """
+    First-in, last-out and hours of every day of a month
+
+    Args:
+        request: Year, month and optionally the user
+        db: Database session
+        current_user: Current authenticated user
+
+    Returns:
+        One report per user with swipes in the month (or the requested user)
+    """
+    # Plain dicts, response_model validates them once
+    return [
+        dict(report._asdict(), entries=[day._asdict() for day in report.days])
+        for report in monthly_report(db, request.year, request.month, request.user_id)
+    ]
+
+
+def _meal_vouchers(request: MealVouchersRequest, db: Session) -> List[MealVouchers]:
+    min_hours = MEAL_VOUCHER_HOURS if request.min_hours is None else request.min_hours
+    return meal_vouchers(db, request.year, request.month, request.group_id, min_hours, request.working_days_only)
+
+
+@router.post("/meal-vouchers", response_model=List[MealVouchersResponse])
+def meal_vouchers_json(request: MealVouchersRequest, db: Session = Depends(get_db),
+                       _current_user=Depends(get_current_active_user)):
+    """
+    Meal vouchers of every user, or of a group's members, for a month
+
+    Args:
+        request: Month, optional group and thresholds
+        db: Database session
+        current_user: Current authenticated user
+
+    Returns:
+        Voucher count per user, users without vouchers included
+    """
+    return [entitlement._asdict() for entitlement in _meal_vouchers(request, db)]
+
+
+@router.post("/meal-vouchers/csv")
+def meal_vouchers_csv(request: MealVouchersRequest, db: Session = Depends(get_db),
+                      _current_user=Depends(get_current_active_user)):
+    """
+    Meal vouchers like /meal-vouchers as a CSV download for payroll
+
+    Returns:
+        text/csv with a header row and one row per user
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(MealVouchers._fields)
+    writer.writerows(_meal_vouchers(request, db))
+    filename = f"meal-vouchers-{request.year}-{request.month:02d}.csv"
+    return Response(output.getvalue(), media_type="text/csv",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@router.post("/hours-matrix", response_model=HoursMatrixResponse)
+def hours_matrix_json(request: HoursMatrixRequest, db: Session = Depends(get_db),
+                      _current_user=Depends(get_current_active_user)):
+    """
+    Arrival, departure and hours of every user and day of a month
+
+    Args:
+        request: Month and optionally a group
+        db: Database session
+        current_user: Current authenticated user
+
+    Returns:
+        Days of the month and a row per user with a cell per day
+    """
+    matrix = hours_matrix(db, request.year, request.month, request.group_id)
+    return dict(matrix._asdict(), days=[day._asdict() for day in matrix.days],
+                rows=[row._asdict() for row in matrix.rows])
+
+
+@router.post("/hours-matrix/html", response_class=HTMLResponse)
+def hours_matrix_html(request: Request, matrix_request: HoursMatrixRequest, db: Session = Depends(get_db),
+                      _current_user=Depends(get_current_active_user)):
+    """
+    The hours matrix as a printable table
+
+    Returns:
+        HTML page with three lines per user: arrivals, departures, hours
+    """
+    matrix = hours_matrix(db, matrix_request.year, matrix_request.month, matrix_request.group_id)
+    return templates.TemplateResponse(request, "reports/hours_matrix.html", {"matrix": matrix})
@@ -0,0 +1,153 @@
+"""
+Weekly access schedules as sorted second-of-week intervals
+A schedule is a union of windows (weekdays plus a time range); a window whose
+end is before its start runs past midnight into the next day. Schedules are
+compiled to merged half-open [start, end) intervals counted in seconds from
+Monday 00:00, so a check is a binary search over a handful of numbers.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import datetime, time
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+DAY_SECONDS = 24 * 60 * 60
+WEEK_SECONDS = 7 * DAY_SECONDS
+
+# One window as edited by users: weekdays (0 = Monday) and an inclusive
+# time range, crossing midnight when time_to < time_from
+ScheduleWindow = namedtuple('ScheduleWindow', ['days', 'time_from', 'time_to'])
+
+
+def day_second(value: time) -> int:
+    """Whole seconds since midnight"""
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def week_second(when: datetime) -> int:
+    """Whole seconds since Monday 00:00 of the week of `when`"""
+    return when.weekday() * DAY_SECONDS + day_second(when.time())
+
+
+def window_intervals(days: Iterable[int], time_from: time, time_to: time) -> List[Tuple[int, int]]:
+    """
+    Half-open second-of-week intervals covered by one window
+
+    Args:
+        days: Weekdays the window starts on (0 = Monday)
+        time_from: First second of the window
+        time_to: Last second of the window; before `time_from` for windows
+            crossing midnight (Sunday night continues into Monday)
+    """
+    start, end = day_second(time_from), day_second(time_to) + 1
+    intervals = []
+    for day in days:
+        offset = day * DAY_SECONDS
+        if start < end:
+            intervals.append((offset + start, offset + end))
+        else:
+            intervals.append((offset + start, offset + DAY_SECONDS))
+            following = (day + 1) % 7 * DAY_SECONDS
+            intervals.append((following, following + end))
+    return intervals
+
+
+def merge_intervals(intervals: Iterable[Tuple[int, int]]) -> Tuple[Tuple[int, int], ...]:
+    """Sort half-open intervals and join overlapping or touching ones"""
+    merged: List[List[int]] = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return tuple((start, end) for start, end in merged)
+
+
+class Schedule:
+    """Immutable union of weekly windows"""
+
+    __slots__ = ('intervals', '_starts')
+
+    def __init__(self, intervals: Iterable[Tuple[int, int]] = ()):
+        """
+        Initialize schedule
+
+        Args:
+            intervals: Half-open [start, end) second-of-week intervals, in any order
+        """
+        self.intervals = merge_intervals(intervals)
+        self._starts = tuple(start for start, _ in self.intervals)
+
+    @classmethod
+    def from_windows(cls, windows: Iterable[ScheduleWindow]) -> 'Schedule':
+        """Schedule covering all `windows`"""
+        intervals = []
+        for window in windows:
+            intervals.extend(window_intervals(window.days, window.time_from, window.time_to))
+        return cls(intervals)
+
+    @classmethod
+    def from_legacy(cls, day_flags: Sequence, time_from: Optional[time],
+                    time_to: Optional[time]) -> 'Schedule':
+        """
+        Schedule of a group's Monday..Sunday flags and its single time window
+
+        Args:
+            day_flags: Seven flags, Monday first; a day is on when its flag is 1
+            time_from: Start of the window, no access when missing
+            time_to: End of the window, no access when missing
+        """
+        if time_from is None or time_to is None:
+            return cls()
+        days = [day for day, flag in enumerate(day_flags) if flag == 1]
+        return cls.from_windows([ScheduleWindow(days, time_from, time_to)])
+
+    def __bool__(self) -> bool:
+        return bool(self.intervals)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Schedule) and self.intervals == other.intervals
+
+    def __hash__(self) -> int:
+        return hash(self.intervals)
+
+    def __repr__(self) -> str:
+        return f"Schedule({list(self.intervals)!r})"
+
+    def __or__(self, other: 'Schedule') -> 'Schedule':
+        return Schedule(self.intervals + other.intervals)
+
+    def allows(self, when: datetime) -> bool:
+        """Whether `when` falls into the schedule"""
+        return self.allows_second(week_second(when))
+
+    def allows_second(self, second: int) -> bool:
+        """Whether second-of-week `second` falls into the schedule"""
+        position = bisect_right(self._starts, second) - 1
+        return position >= 0 and second < self.intervals[position][1]
+
+    def windows(self) -> List[ScheduleWindow]:
+        """
+        The schedule as windows, days with the same times grouped together
+
+        An interval crossing one midnight becomes an overnight window, longer
+        ones are split at midnight; from_windows(windows()) is the schedule again.
+        """
+        days_by_range = {}
+        for start, end in self.intervals:
+            while start < end:
+                day, offset = start // DAY_SECONDS, start % DAY_SECONDS
+                length = end - start
+                if offset + length > DAY_SECONDS and offset + length - DAY_SECONDS > offset:
+                    # Too long for one overnight window, cut at midnight
+                    length = DAY_SECONDS - offset
+                time_range = (offset, (offset + length - 1) % DAY_SECONDS)
+                days_by_range.setdefault(time_range, []).append(day)
+                start += length
+        return [ScheduleWindow(days, _clock(first), _clock(last))
+                for (first, last), days in sorted(days_by_range.items(), key=lambda item: (item[1][0], item[0]))]
+
+
+def _clock(second: int) -> time:
+    return time(second // 3600, second % 3600 // 60, second % 60)
@@ -3,7 +3,7 @@ Pydantic schemas for data validation and serialization
 """
 from typing import Optional, List
 from datetime import datetime, time
-from pydantic import BaseModel, EmailStr, Field, ConfigDict
+from pydantic import BaseModel, EmailStr, Field, ConfigDict, field_validator
 
 
 # User schemas
@@ -61,8 +61,31 @@ class LoginRequest(BaseModel):
 
 
 # Group schemas
+class ScheduleWindow(BaseModel):
+    """One weekly access window, crossing midnight when time_to < time_from"""
+    model_config = ConfigDict(from_attributes=True)
+
+    days: List[int] = Field(..., description="Weekdays the window starts on, 0 = Monday")
+    time_from: time
+    time_to: time
+
+    @field_validator('days')
+    @classmethod
+    def check_days(cls, days: List[int]) -> List[int]:
+        """Weekdays are 0..6"""
+        if any(day < 0 or day > 6 for day in days):
+            raise ValueError("days must be between 0 (Monday) and 6 (Sunday)")
+        return sorted(set(days))
+
+
 class GroupBase(BaseModel):
-    """Base group schema"""
+    """
+    Base group schema
+
+    The day flags and access_time_from/access_time_to describe a single
+    window per day. schedule_windows is the full schedule, which may have
+    several windows a day and windows across midnight.
+    """
     group_name: str
     access_time_from: Optional[time] = None
     access_time_to: Optional[time] = None
@@ -73,6 +96,7 @@ class GroupBase(BaseModel):
     Friday: bool = False
     Saturday: bool = False
     Sunday: bool = False
+    schedule_windows: Optional[List[ScheduleWindow]] = None
 
 
 class GroupCreate(GroupBase):
@@ -132,6 +156,77 @@ class CardAccess(CardAccessBase):
     id: int
 
 
+# Access check schemas
+def naive_local_time(value: Optional[datetime]) -> Optional[datetime]:
+    """Convert an aware datetime to the naive local time used by carddata"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone().replace(tzinfo=None)
+    return value
+
+
+class AccessCheckItem(BaseModel):
+    """One swipe to decide"""
+    chip: str = Field(..., description="Chip number as sent by the reader, decimal or hex")
+    reader: str = Field(..., description="identreader topic of the reader")
+    time: Optional[datetime] = Field(default=None, description="Time of the swipe, defaults to now")
+
+    @field_validator('time')
+    @classmethod
+    def local_time(cls, value: Optional[datetime]) -> Optional[datetime]:
+        """Decisions and carddata use naive local time"""
+        return naive_local_time(value)
+
+
+class AccessCheckRequest(BaseModel):
+    """Batch of swipes, optionally stored in carddata"""
+    items: List[AccessCheckItem] = Field(..., max_length=5000)
+    record: bool = False
+
+
+class AccessDecision(BaseModel):
+    """Decision of one swipe, in the order of the request"""
+    chip: str
+    reader: str
+    allowed: bool
+    known_reader: bool
+    known_chip: bool
+
+
+class AccessCheckResponse(BaseModel):
+    """Decisions of a batch"""
+    decisions: List[AccessDecision]
+    recorded: int = 0
+
+
+class BufferedSwipeItem(BaseModel):
+    """One swipe a reader buffered while offline"""
+    chip: str = Field(..., description="Chip number as sent by the reader, decimal or hex")
+    reader: str = Field(..., description="identreader topic of the reader")
+    time: datetime
+    allowed: Optional[bool] = Field(default=None, description="Reader's decision, decided by the rules when omitted")
+
+    @field_validator('time')
+    @classmethod
+    def local_time(cls, value: datetime) -> datetime:
+        """Stored in naive local time like live swipes"""
+        return naive_local_time(value)
+
+
+class BulkSwipesRequest(BaseModel):
+    """Buffered swipes of one or more readers"""
+    items: List[BufferedSwipeItem] = Field(..., max_length=20000)
+
+
+class BulkSwipesResponse(BaseModel):
+    """What happened to the uploaded swipes"""
+    received: int
+    inserted: int
+    duplicates: int
+    unknown_reader: int
+    unknown_chip: int
+    invalid_chip: int
+
+
 # Monthly report schemas
 class MonthlyReportRequest(BaseModel):
     """Schema for monthly report request"""
@@ -140,6 +235,16 @@ class MonthlyReportRequest(BaseModel):
     user_id: Optional[int] = None
 
 
+class MonthlyReportEntry(BaseModel):
+    """One day of a monthly report, times are empty on days without swipes"""
+    day: int
+    dow: int = Field(description="Day of the week, 0 = Monday")
+    first_in: Optional[time] = None
+    last_out: Optional[time] = None
+    hours: float
+    swipes: int
+
+
 class MonthlyReportResponse(BaseModel):
     """Schema for monthly report response"""
     user_id: int
@@ -147,4 +252,59 @@ class MonthlyReportResponse(BaseModel):
     year: int
     month: int
     total_hours: float
-    entries: List[dict]
+    entries: List[MonthlyReportEntry]
+
+
+# Meal voucher schemas
+class MealVouchersRequest(BaseModel):
+    """Schema for meal voucher request"""
+    year: int = Field(ge=2000, le=2100)
+    month: int = Field(ge=1, le=12)
+    group_id: Optional[int] = None
+    min_hours: Optional[float] = Field(default=None, gt=0, le=24,
+                                       description="Hours between first and last swipe, default as Card.stravenky")
+    working_days_only: bool = False
+
+
+class MealVouchersResponse(BaseModel):
+    """Meal vouchers of one user"""
+    user_id: int
+    user_name: str
+    card_number: Optional[str] = None
+    year: int
+    month: int
+    vouchers: int
+
+
+# Hours matrix schemas
+class HoursMatrixRequest(BaseModel):
+    """Schema for hours matrix request"""
+    year: int = Field(ge=2000, le=2100)
+    month: int = Field(ge=1, le=12)
+    group_id: Optional[int] = None
+
+
+class HoursMatrixDay(BaseModel):
+    """Column of the hours matrix"""
+    day: int
+    dow: int = Field(description="Day of the week, 0 = Monday")
+
+
+class HoursMatrixRow(BaseModel):
+    """One user of the hours matrix, a cell per day of the month in every list"""
+    user_id: int
+    user_name: str
+    card_number: Optional[str] = None
+    arrivals: List[str] = Field(description="First swipe as HH:MM, empty without swipes")
+    departures: List[str] = Field(description="Last swipe as HH:MM, empty without swipes")
+    hours: List[Optional[float]]
+    vouchers: List[bool]
+    total_hours: float
+
+
+class HoursMatrixResponse(BaseModel):
+    """Schema for hours matrix response"""
+    year: int
+    month: int
+    days: List[HoursMatrixDay]
+    rows: List[HoursMatrixRow]
@@ -0,0 +1,86 @@
+"""
+Targeted MQTT subscriptions for the registered card reader topics
+"""
+import logging
+import threading
+from typing import Callable, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# Topics per SUBSCRIBE/UNSUBSCRIBE packet
+CHUNK_SIZE = 100
+
+
+class TopicSubscriptions:
+    """
+    Keeps the client subscribed to exactly the registered reader topics
+
+    Changes are applied incrementally: only added topics are subscribed and
+    only removed topics are unsubscribed. Messages on any other topic can be
+    rejected in memory with `accepts`.
+    """
+
+    def __init__(self, client, topic_filter: Callable[[str], str] = lambda topic: topic,
+                 owns: Callable[[str], bool] = lambda topic: True):
+        """
+        Initialize subscriptions
+
+        Args:
+            client: paho MQTT client
+            topic_filter: Maps a reader topic to the filter to subscribe (e.g. shared group)
+            owns: Whether this worker is responsible for a reader topic
+        """
+        self.client = client
+        self.topic_filter = topic_filter
+        self.owns = owns
+        self._topics: frozenset = frozenset()
+        self._lock = threading.Lock()
+
+    @property
+    def topics(self) -> frozenset:
+        """Reader topics currently subscribed"""
+        return self._topics
+
+    def accepts(self, topic: str) -> bool:
+        """
+        Whether `topic` belongs to a registered reader
+
+        Exact match: every form a reader may publish on is subscribed
+        (MQTTHandler.reader_topics), other forms never arrive.
+        """
+        return topic in self._topics
+
+    def sync(self, topics: Iterable[str]) -> None:
+        """
+        Subscribe to new reader topics and unsubscribe removed ones
+
+        Args:
+            topics: All registered reader topics
+        """
+        with self._lock:
+            wanted = frozenset(topic for topic in topics if self.owns(topic))
+            added = sorted(wanted - self._topics)
+            removed = sorted(self._topics - wanted)
+            self._topics = wanted
+            if added:
+                self._subscribe(added)
+            if removed:
+                for chunk in _chunks(removed):
+                    self.client.unsubscribe([self.topic_filter(topic) for topic in chunk])
+        if added or removed:
+            logger.info("Reader subscriptions: +%d -%d, %d total", len(added), len(removed), len(wanted))
+
+    def resubscribe(self) -> None:
+        """Subscribe to every known topic again, e.g. after a reconnect"""
+        with self._lock:
+            if self._topics:
+                self._subscribe(sorted(self._topics))
+
+    def _subscribe(self, topics: List[str]) -> None:
+        for chunk in _chunks(topics):
+            self.client.subscribe([(self.topic_filter(topic), 0) for topic in chunk])
+
+
+def _chunks(items: List[str]):
+    for start in range(0, len(items), CHUNK_SIZE):
+        yield items[start:start + CHUNK_SIZE]
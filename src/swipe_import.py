@@ -0,0 +1,100 @@
+"""
+Bulk import of swipes that readers buffered while they were offline
+Buffered swipes are stored like live ones but never answered, deduplicated
+against carddata and written with multi-row inserts instead of being
+replayed over MQTT one door request at a time
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from src.access_check import AccessRequest, check_access_batch
+from src.attendance import refresh_days
+from src.data.models.carddata import Card
+from src.swipe_journal import row_key
+
+# Rows per INSERT and per duplicate lookup; the lookup binds one parameter per
+# card plus the time range, below SQLite's limit of 999 on older builds
+IMPORT_CHUNK_SIZE = 900
+
+# One buffered swipe: normalized chip (None if unparsable), identreader topic,
+# time, the reader's own decision (None = decide with the current rules)
+BufferedSwipe = namedtuple('BufferedSwipe', ['chip', 'reader', 'when', 'allowed'])
+
+
+def _stored_keys(session: Session, rows: List[Dict]) -> set:
+    """Keys (see row_key) of the carddata rows matching the cards and time span of `rows`"""
+    start = min(values['time'] for values in rows).replace(microsecond=0)
+    end = max(values['time'] for values in rows).replace(microsecond=0) + timedelta(seconds=1)
+    cards = sorted({values['card_number'] for values in rows})
+    stored = session.execute(
+        select(Card.card_number, Card.id_card_reader, Card.time)
+        .where(Card.card_number.in_(cards), Card.time >= start, Card.time < end))
+    return {row_key(Card, {'card_number': card_number, 'id_card_reader': reader_id, 'time': moment})
+            for card_number, reader_id, moment in stored}
+
+
+def import_swipes(session: Session, swipes: Sequence[BufferedSwipe]) -> Dict[str, int]:
+    """
+    Store buffered swipes in carddata, skipping the ones already stored
+
+    Readers and chip holders are resolved for the whole batch at once
+    (check_access_batch). A swipe is a duplicate when a row of the same
+    card on the same reader exists in the same second, in the database or
+    earlier in `swipes`, like in the journal replay. Everything is
+    committed in one transaction, then the daily attendance of the
+    affected days is refreshed.
+
+    Args:
+        session: Database session
+        swipes: Buffered swipes in any order
+
+    Returns:
+        Counts: received, inserted, duplicates, unknown_reader, unknown_chip
+    """
+    summary = {'received': len(swipes), 'inserted': 0, 'duplicates': 0, 'unknown_reader': 0, 'unknown_chip': 0}
+    checks = check_access_batch(session, [AccessRequest(swipe.chip, swipe.reader, swipe.when) for swipe in swipes])
+
+    rows: List[Dict] = []
+    seen = set()
+    for swipe, check in zip(swipes, checks):
+        if check is None:
+            summary['unknown_reader'] += 1
+            continue
+        if check.user_id is None:
+            summary['unknown_chip'] += 1
+            continue
+        values = {
+            'card_number': check.card_number,
+            'time': swipe.when,
+            'id_card_reader': check.reader_id,
+            'id_user': check.user_id,
+            'access': check.allowed if swipe.allowed is None else swipe.allowed,
+        }
+        key = row_key(Card, values)
+        if key in seen:
+            summary['duplicates'] += 1
+            continue
+        seen.add(key)
+        rows.append(values)
+
+    rows.sort(key=lambda values: values['time'])
+    inserted: List[datetime] = []
+    for start in range(0, len(rows), IMPORT_CHUNK_SIZE):
+        chunk = rows[start:start + IMPORT_CHUNK_SIZE]
+        stored = _stored_keys(session, chunk)
+        new_rows = [values for values in chunk if row_key(Card, values) not in stored]
+        summary['duplicates'] += len(chunk) - len(new_rows)
+        if new_rows:
+            # executemany of one cached statement; SQLAlchemy sends it as
+            # multi-row INSERT ... VALUES pages where the driver supports it
+            session.execute(insert(Card.__table__), new_rows)
+            summary['inserted'] += len(new_rows)
+            inserted.extend(values['time'] for values in new_rows)
+    session.commit()
+    # Buffered swipes are older than the days the periodic rollup refreshes
+    refresh_days(session, inserted)
+    return summary
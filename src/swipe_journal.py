@@ -0,0 +1,411 @@
+"""
+Local append-only journal of every swipe decision of the MQTT worker
+Entries are replayed into carddata/log once the database is reachable, so
+swipes decided during an outage are not lost
+
+Usage:
+    python -m src.swipe_journal replay [--path var/swipes.journal]
+    python -m src.swipe_journal compact [--path var/swipes.journal]
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from src.attendance import refresh_days
+from src.data.models.carddata import Card
+from src.data.models.logdata import Log
+from src.periodic import PeriodicTask
+
+logger = logging.getLogger(__name__)
+
+# Journal record type -> model
+MODELS = {'card': Card, 'log': Log}
+RECORD_TYPES = {model: name for name, model in MODELS.items()}
+
+# One journal line: byte offset just past it, model, column values, unix time it was recorded
+JournalEntry = namedtuple('JournalEntry', ['end', 'model', 'values', 'recorded'])
+
+
+def _encode(values: Dict) -> Dict:
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in values.items()}
+
+
+def _decode(values: Dict) -> Dict:
+    decoded = dict(values)
+    if decoded.get('time'):
+        decoded['time'] = datetime.fromisoformat(decoded['time'])
+    return decoded
+
+
+def row_key(model: type, values: Dict) -> Tuple:
+    """
+    Identity of a journaled row, used to skip rows already in the database
+
+    Times are compared to the second, the way carddata and log store them
+    (see src.data.dates.WholeSeconds); two swipes of one card on one reader
+    within the same second count as one.
+    """
+    moment = values['time'].replace(microsecond=0)
+    if model is Card:
+        return model, values['card_number'], values['id_card_reader'], moment
+    return model, values['text'], moment
+
+
+def _stored_keys(session: Session, model: type, rows: List[Dict]) -> Set[Tuple]:
+    """Keys of the rows of `model` stored in the time span covered by `rows`"""
+    names = ('card_number', 'id_card_reader', 'time') if model is Card else ('text', 'time')
+    start = min(values['time'] for values in rows).replace(microsecond=0)
+    end = max(values['time'] for values in rows).replace(microsecond=0) + timedelta(seconds=1)
+    stored = session.query(*(getattr(model, name) for name in names))\
+        .filter(model.time >= start, model.time < end)
+    return {row_key(model, dict(zip(names, row))) for row in stored}
+
+
+class SwipeJournal:
+    """
+    JSON-lines file of Card/Log rows with a replay checkpoint
+
+    `record` only queues the line in memory; a background thread writes and
+    fsyncs everything queued since its previous sync in one go (group
+    commit), so the door response never waits for the disk. `append` is
+    the synchronous variant.
+
+    The checkpoint (`<path>.checkpoint`) holds the offset up to which the
+    journal has been replayed; `compact` drops that prefix.
+    """
+
+    def __init__(self, path: str, sync_interval: float = 0.05):
+        """
+        Initialize journal
+
+        Args:
+            path: Journal file, created on first write
+            sync_interval: Minimum seconds between two background fsyncs
+        """
+        self.path = path
+        self.checkpoint_path = f"{path}.checkpoint"
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._pending: List[str] = []
+        self._recorded = 0
+        self._synced = 0
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._replayer: Optional[PeriodicTask] = None
+
+        # Counters
+        self.appended = 0
+        self.syncs = 0
+        self.replayed = 0
+        self.compactions = 0
+        self.errors = 0
+
+    def start(self) -> 'SwipeJournal':
+        """Start the background group-commit thread"""
+        self._thread = threading.Thread(target=self._run, name='swipe-journal', daemon=True)
+        self._thread.start()
+        return self
+
+    def start_replay(self, session_factory: Callable[[], Session], interval: float,
+                     settle: float, compact_bytes: int) -> 'SwipeJournal':
+        """
+        Replay (and compact) the journal every `interval` seconds in the background
+
+        Args:
+            session_factory: Factory for the replay sessions
+            interval: Seconds between two replays
+            settle: See `replay`
+            compact_bytes: See `compact`
+        """
+        def replay():
+            if self.replay(session_factory, settle=settle):
+                logger.info("Replayed %d journaled rows so far", self.replayed)
+            self.compact(min_bytes=compact_bytes)
+
+        self._replayer = PeriodicTask(interval, replay, name='journal-replay').start()
+        return self
+
+    def record(self, model: type, values: Dict) -> None:
+        """
+        Queue one row for the next group commit
+
+        Written synchronously when the background thread is not running.
+
+        Args:
+            model: Mapped class of the row (Card, Log)
+            values: Column values
+        """
+        line = self._line(model, values, time.time())
+        if self._thread is None:
+            self._write([line])
+            return
+        with self._cond:
+            self._pending.append(line)
+            self._recorded += 1
+            if len(self._pending) == 1:
+                self._cond.notify_all()
+
+    def append(self, rows: List[Tuple[type, Dict]]) -> None:
+        """
+        Append rows and fsync them before returning
+
+        Args:
+            rows: (model, column values) pairs
+        """
+        recorded = time.time()
+        self._write([self._line(model, values, recorded) for model, values in rows])
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every recorded row is on disk
+
+        Returns:
+            False if the timeout expired first
+        """
+        with self._cond:
+            target = self._recorded
+            return self._cond.wait_for(lambda: self._synced >= target or self._thread is None, timeout)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop replaying, write the queued rows and stop the background thread"""
+        if self._replayer is not None:
+            self._replayer.stop()
+            self._replayer = None
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def entries(self) -> Iterator[Tuple[type, Dict]]:
+        """Yield journaled (model, column values) pairs in append order"""
+        for entry in self.read():
+            yield entry.model, entry.values
+
+    def read(self, offset: int = 0) -> Iterator[JournalEntry]:
+        """
+        Yield the complete entries from byte `offset` on
+
+        A torn last line (crash during a write) is left for later, lines
+        that cannot be decoded are skipped.
+        """
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    return
+                offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    entry = JournalEntry(offset, MODELS[record['t']], _decode(record['v']), record.get('at', 0.0))
+                except (ValueError, KeyError, TypeError) as e:
+                    self.errors += 1
+                    logger.warning("Skipping unreadable journal entry at offset %d: %s", offset - len(line), e)
+                    continue
+                yield entry
+
+    @property
+    def checkpoint(self) -> int:
+        """Offset up to which the journal has been replayed"""
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                return int(json.load(f)['offset'])
+        except FileNotFoundError:
+            return 0
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring unreadable journal checkpoint %s: %s", self.checkpoint_path, e)
+            return 0
+
+    def replay(self, session_factory: Callable[[], Session], settle: float = 0.0,
+               batch_size: int = 500) -> int:
+        """
+        Insert journaled rows that are missing from the database
+
+        Safe to repeat: rows already stored (by the write-behind queue or an
+        earlier replay) are skipped. The checkpoint advances after every
+        committed batch.
+
+        Args:
+            session_factory: Factory for the replay sessions
+            settle: Leave entries younger than this many seconds alone, they
+                may still be on their way through the write-behind queue
+            batch_size: Entries checked and inserted per transaction
+
+        Returns:
+            Number of rows inserted
+        """
+        with self._replay_lock:
+            horizon = time.time() - settle
+            inserted = 0
+            batch: List[JournalEntry] = []
+            for entry in self.read(self.checkpoint):
+                if entry.recorded > horizon:
+                    break
+                batch.append(entry)
+                if len(batch) >= batch_size:
+                    inserted += self._replay_batch(session_factory, batch)
+                    batch = []
+            if batch:
+                inserted += self._replay_batch(session_factory, batch)
+            self.replayed += inserted
+            return inserted
+
+    def compact(self, min_bytes: int = 0) -> int:
+        """
+        Drop the replayed prefix of the journal
+
+        Args:
+            min_bytes: Only compact once at least this much has been replayed
+
+        Returns:
+            Number of bytes dropped
+        """
+        with self._replay_lock, self._lock:
+            offset = self.checkpoint
+            if not offset or offset < min_bytes:
+                return 0
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(self.path, 'rb') as source, open(tmp_path, 'wb') as target:
+                source.seek(offset)
+                while True:
+                    chunk = source.read(1 << 20)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                target.flush()
+                os.fsync(target.fileno())
+            os.replace(tmp_path, self.path)
+            self._save_checkpoint(0)
+            self.compactions += 1
+            return offset
+
+    def stats(self) -> Dict[str, float]:
+        """Counters for monitoring"""
+        return {
+            'journal_pending': len(self._pending),
+            'journal_appended': self.appended,
+            'journal_syncs': self.syncs,
+            'journal_replayed': self.replayed,
+            'journal_compactions': self.compactions,
+            'journal_errors': self.errors,
+        }
+
+    def _line(self, model: type, values: Dict, recorded: float) -> str:
+        record = {'t': RECORD_TYPES[model], 'at': round(recorded, 3), 'v': _encode(values)}
+        return json.dumps(record, separators=(',', ':')) + '\n'
+
+    def _write(self, lines: List[str]) -> None:
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            self.appended += len(lines)
+            self.syncs += 1
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stopping)
+                lines, self._pending = self._pending, []
+                stopping = self._stopping
+            if lines:
+                try:
+                    self._write(lines)
+                except OSError as e:
+                    self.errors += len(lines)
+                    logger.error("Error writing %d journal entries: %s", len(lines), e)
+            with self._cond:
+                self._synced += len(lines)
+                self._cond.notify_all()
+            if stopping and not self._pending:
+                return
+            # Let the next group collect while the disk rests
+            time.sleep(self.sync_interval)
+
+    def _replay_batch(self, session_factory: Callable[[], Session], batch: List[JournalEntry]) -> int:
+        by_model: Dict[type, List[Dict]] = {}
+        for entry in batch:
+            by_model.setdefault(entry.model, []).append(entry.values)
+
+        session = session_factory()
+        try:
+            inserted = 0
+            swipe_times = []
+            for model, rows in by_model.items():
+                seen = _stored_keys(session, model, rows)
+                missing = []
+                for values in rows:
+                    key = row_key(model, values)
+                    if key not in seen:
+                        seen.add(key)
+                        missing.append(values)
+                if missing:
+                    session.execute(insert(model), missing)
+                    inserted += len(missing)
+                    if model is Card:
+                        swipe_times.extend(values['time'] for values in missing)
+            session.commit()
+            # Rows of an outage may be older than the days the periodic rollup refreshes
+            refresh_days(session, swipe_times)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        self._save_checkpoint(batch[-1].end)
+        return inserted
+
+    def _save_checkpoint(self, offset: int) -> None:
+        tmp_path = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'offset': offset, 'saved': datetime.now().isoformat()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+
+
+def main(argv=None):
+    """Replay or compact a journal, e.g. after a database outage"""
+    # Imported here so that importing the journal does not create an engine
+    from src.config import settings  # pylint: disable=import-outside-toplevel
+    from src.database import SessionLocal  # pylint: disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description="Swipe journal maintenance")
+    parser.add_argument('command', choices=['replay', 'compact'])
+    parser.add_argument('--path', default=settings.SWIPE_JOURNAL_PATH, help="journal file")
+    args = parser.parse_args(argv)
+
+    journal = SwipeJournal(args.path)
+    if args.command == 'replay':
+        inserted = journal.replay(SessionLocal)
+        print(f"Replayed {args.path}: {inserted} rows inserted, checkpoint at {journal.checkpoint}")
+    else:
+        # Only run while no worker writes to the journal
+        dropped = journal.compact()
+        print(f"Compacted {args.path}: {dropped} bytes dropped")
+
+
+if __name__ == "__main__":
+    main()
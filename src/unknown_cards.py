@@ -0,0 +1,103 @@
+"""
+Aggregation of unknown-card reads into periodic summary Log rows
+"""
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.data.models.logdata import Log
+from src.periodic import PeriodicTask
+
+
+class UnknownCardSummary:
+    """
+    Counts reads of unregistered chips and stores one Log row per chip and interval
+
+    The row keeps the text of the per-read rows ("Neznama karta ..."), carries
+    the time of the first read and gets a "<n>x" suffix when the chip was
+    read more than once. At most `max_chips` chips are tracked per
+    interval; reads of further chips are summed up in a single extra row.
+    """
+
+    def __init__(self, persist: Callable[[type, Dict], None], interval: float = 60.0,
+                 max_chips: int = 1000):
+        """
+        Initialize summary
+
+        Args:
+            persist: Stores a (model, values) row, e.g. MQTTHandler.persist
+            interval: Seconds between two summaries
+            max_chips: Distinct chips tracked per interval
+        """
+        self._persist = persist
+        self.interval = interval
+        self.max_chips = max_chips
+        # text -> [first read, reads]
+        self._reads: Dict[str, List] = {}
+        self._overflow: Optional[Tuple[datetime, int]] = None
+        self._lock = threading.Lock()
+        self._flusher: Optional[PeriodicTask] = None
+
+        # Counters
+        self.reads = 0
+        self.rows = 0
+
+    def add(self, text: str, when: Optional[datetime] = None) -> None:
+        """
+        Count one read of an unknown chip
+
+        Args:
+            text: Log text of a single read of the chip
+            when: Time of the read
+        """
+        when = when or datetime.now()
+        with self._lock:
+            self.reads += 1
+            entry = self._reads.get(text)
+            if entry is not None:
+                entry[1] += 1
+            elif len(self._reads) < self.max_chips:
+                self._reads[text] = [when, 1]
+            elif self._overflow is None:
+                self._overflow = (when, 1)
+            else:
+                self._overflow = (self._overflow[0], self._overflow[1] + 1)
+
+    def flush(self) -> int:
+        """
+        Store the summary rows of the reads counted so far
+
+        Returns:
+            Number of rows stored
+        """
+        with self._lock:
+            reads, self._reads = self._reads, {}
+            overflow, self._overflow = self._overflow, None
+        rows = [{'time': first, 'text': f"{text} {count}x" if count > 1 else text}
+                for text, (first, count) in sorted(reads.items(), key=lambda item: item[1][0])]
+        if overflow is not None:
+            rows.append({'time': overflow[0], 'text': f"Neznama karta: dalsich {overflow[1]} cteni"})
+        for values in rows:
+            self._persist(Log, values)
+        self.rows += len(rows)
+        return len(rows)
+
+    def start(self) -> 'UnknownCardSummary':
+        """Store summaries every `interval` seconds"""
+        self._flusher = PeriodicTask(self.interval, self.flush, name='unknown-cards').start()
+        return self
+
+    def stop(self) -> None:
+        """Stop the background task and store the pending summary"""
+        if self._flusher is not None:
+            self._flusher.stop()
+            self._flusher = None
+        self.flush()
+
+    def stats(self) -> Dict[str, float]:
+        """Counters for monitoring"""
+        return {
+            'unknown_card_reads': self.reads,
+            'unknown_card_rows': self.rows,
+            'unknown_card_pending': len(self._reads),
+        }
@@ -0,0 +1,221 @@
+"""
+Write-behind persistence for rows produced on the MQTT hot path
+Rows are queued in memory and inserted in batches on a background thread
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """
+    Buffers model rows and inserts them in batches
+
+    A batch is flushed as soon as `batch_size` rows are waiting or when the
+    oldest waiting row is `flush_interval` seconds old, whichever comes first.
+
+    While the database is unreachable a failed batch goes back to the head
+    of the queue and is retried after `retry_interval` seconds, doubling up
+    to `max_retry_interval`. Rows are only given up (and counted as failed)
+    when the database rejects them, when more than `max_rows` are waiting,
+    or when the queue is stopped during an outage.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session],
+                 batch_size: int = 200, flush_interval: float = 0.5,
+                 retry_interval: float = 1.0, max_retry_interval: float = 30.0,
+                 max_rows: int = 100_000):
+        """
+        Initialize write-behind queue
+
+        Args:
+            session_factory: Factory for the sessions used by flushes
+            batch_size: Rows that trigger an immediate flush
+            flush_interval: Maximum seconds a row waits before it is flushed
+            retry_interval: Seconds before the first retry of a batch that
+                failed because the database was unreachable
+            max_retry_interval: Longest wait between two retries
+            max_rows: Waiting rows beyond which the oldest ones are dropped
+        """
+        self._session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.max_rows = max_rows
+        self._rows: deque = deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._overflowing = False
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+
+        # Counters
+        self.submitted = 0
+        self.flushed = 0
+        self.failed = 0
+        self.retries = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+
+    @property
+    def depth(self) -> int:
+        """Rows waiting to be flushed"""
+        return len(self._rows)
+
+    def start(self) -> 'WriteBehindQueue':
+        """Start the background flusher"""
+        self._thread.start()
+        return self
+
+    def submit(self, model: type, values: Dict) -> None:
+        """
+        Queue one row for insertion
+
+        Args:
+            model: Mapped class of the row (Card, Log)
+            values: Column values
+        """
+        with self._cond:
+            if len(self._rows) >= self.max_rows:
+                self._rows.popleft()
+                self.failed += 1
+                if not self._overflowing:
+                    self._overflowing = True
+                    logger.error("Write-behind queue full (%d rows), dropping the oldest rows", self.max_rows)
+            self._rows.append((model, values, time.monotonic()))
+            self.submitted += 1
+            # Wake the flusher to arm its timer or to flush a full batch
+            if len(self._rows) == 1 or len(self._rows) >= self.batch_size:
+                self._cond.notify()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Flush every queued row and stop the background thread"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        else:
+            self.flush()
+            self._give_up()
+
+    def flush(self) -> int:
+        """
+        Insert every queued row now
+
+        Stops at the first batch that has to wait for the database to come
+        back; that batch stays queued.
+
+        Returns:
+            Number of rows written
+        """
+        written = 0
+        while True:
+            with self._cond:
+                batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+            if not batch:
+                return written
+            count = self._write(batch)
+            if count is None:
+                return written
+            written += count
+
+    def stats(self) -> Dict[str, float]:
+        """Counters for monitoring"""
+        return {
+            'write_behind_depth': self.depth,
+            'write_behind_submitted': self.submitted,
+            'write_behind_flushed': self.flushed,
+            'write_behind_failed': self.failed,
+            'write_behind_retries': self.retries,
+            'write_behind_flushes': self.flushes,
+            'write_behind_last_flush_seconds': self.last_flush_seconds,
+            'write_behind_max_flush_seconds': self.max_flush_seconds,
+        }
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopping and not self._due():
+                    self._cond.wait(self._wait_time())
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                self._give_up()
+                return
+
+    def _due(self) -> bool:
+        if not self._rows:
+            return False
+        if time.monotonic() < self._retry_at:
+            return False
+        if len(self._rows) >= self.batch_size:
+            return True
+        return time.monotonic() - self._rows[0][2] >= self.flush_interval
+
+    def _wait_time(self) -> Optional[float]:
+        if not self._rows:
+            return None
+        now = time.monotonic()
+        if now < self._retry_at:
+            return self._retry_at - now
+        return max(0.0, self.flush_interval - (now - self._rows[0][2]))
+
+    def _give_up(self) -> None:
+        """Drop the rows still queued when stopping during an outage"""
+        with self._cond:
+            left = len(self._rows)
+            self._rows.clear()
+        if left:
+            self.failed += left
+            logger.error("Database unreachable, %d rows not written", left)
+
+    def _write(self, batch) -> Optional[int]:
+        by_model: Dict[type, list] = {}
+        for model, values, _ in batch:
+            by_model.setdefault(model, []).append(values)
+
+        started = time.perf_counter()
+        session = self._session_factory()
+        try:
+            for model, rows in by_model.items():
+                session.execute(insert(model), rows)
+            session.commit()
+        except (OperationalError, InterfaceError) as e:
+            # The database is unreachable: keep the batch and retry later
+            session.rollback()
+            with self._cond:
+                self._rows.extendleft(reversed(batch))
+                self._backoff = min(self._backoff * 2 or self.retry_interval, self.max_retry_interval)
+                self._retry_at = time.monotonic() + self._backoff
+            self.retries += 1
+            logger.warning("Error flushing %d rows, retrying in %.1f s: %s", len(batch), self._backoff, e)
+            return None
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            session.rollback()
+            self.failed += len(batch)
+            logger.error("Error flushing %d rows: %s", len(batch), e)
+            return 0
+        finally:
+            session.close()
+
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._overflowing = False
+        elapsed = time.perf_counter() - started
+        self.flushes += 1
+        self.flushed += len(batch)
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        return len(batch)
@@ -14,9 +14,60 @@ os.environ['APP_KEY'] = 'test-secret-key-for-testing-only'
 os.environ['DATABASE_URL'] = 'sqlite:///test.db'
 
 from main import app
+from src.attendance import rebuild_daily_attendance
+from src.auth_utils import create_access_token
+from datetime import date, datetime, time
+
+from src.data.database import db
+from src.data.models import Card, Group, Group_has_timecard, Timecard, User, User_has_group
+from src.metrics import DOOR_METRICS
 
 client = TestClient(app)
 
+READER = "0000000101"
+
+
+@pytest.fixture
+def auth_headers():
+    """Create tables with a verified user and return that user's bearer token header"""
+    db.create_all()
+    db.session.add(User(id=1, username="admin", email="admin@example.com", chip_number="0000000001",
+                        card_number="A1", verified=True))
+    db.session.commit()
+    yield {"Authorization": f"Bearer {create_access_token(data={'sub': 'admin'})}"}
+    db.session.remove()
+    db.drop_all()
+
+
+@pytest.fixture
+def seeded(auth_headers):
+    """One reader open to the morning group (Mon-Fri 6-14) and its member Jan Novak, chip 12345"""
+    session = db.session
+    membership = User_has_group(2, 1)
+    membership.id = 1
+    session.add_all([
+        Timecard(id=1, timecard_name="Vchod", timecard_head="A", identreader=READER, pushopen="door/1/open"),
+        Group(id=1, group_name="Ranni", Monday=1, Tuesday=1, Wednesday=1, Thursday=1, Friday=1,
+              Saturday=0, Sunday=0, access_time_from=time(6, 0), access_time_to=time(14, 0)),
+        User(id=2, username="jan", email="jan@example.com", name="Jan", second_name="Novak",
+             chip_number="0000012345", card_number="K2", verified=True),
+    ])
+    session.flush()
+    session.add_all([membership, Group_has_timecard(id=1, group_id=1, timecard_id=1)])
+    session.commit()
+    return auth_headers
+
+
+@pytest.fixture
+def swipes(seeded):
+    """Jan's swipes in February 2024: 5.5 hours on Thursday the 1st, 1.5 hours on Friday the 2nd"""
+    db.session.add_all([Card("K2", moment, 1, 2, "1") for moment in (
+        datetime(2024, 2, 1, 6, 30), datetime(2024, 2, 1, 12, 0),
+        datetime(2024, 2, 2, 7, 0), datetime(2024, 2, 2, 8, 30))])
+    db.session.commit()
+    rebuild_daily_attendance(db.session_factory, date(2024, 2, 1), date(2024, 3, 1))
+    return seeded
+
 
 def test_read_root():
     """Test root endpoint renders the landing page"""
@@ -32,6 +83,189 @@ def test_health_check():
     assert response.json() == {"status": "healthy"}
 
 
+def test_metrics_endpoint():
+    """Test Prometheus metrics endpoint"""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE karty_door_latency_seconds histogram" in response.text
+
+
+def test_door_latency_requires_login():
+    """Per-reader latencies name the reader topics and are only served to authenticated users"""
+    response = client.get("/metrics/doors")
+    assert response.status_code == 401
+
+
+def test_door_latency(auth_headers):
+    """Authenticated users get latency quantiles and swipe counts by reader topic"""
+    DOOR_METRICS.record('allowed', 100.0, [('decision', 100.001), ('publish', 100.002)], "0000000199")
+    response = client.get("/metrics/doors", headers=auth_headers)
+    assert response.status_code == 200
+    latency = response.json()["0000000199"]
+    assert latency["count"] == 1
+    assert 0 < latency["p50"] <= latency["p95"] <= latency["p99"]
+
+
+def test_access_check_requires_login():
+    """Batch access checks are only answered for authenticated gateways"""
+    response = client.post("/access/check", json={"items": [{"chip": "12345", "reader": "0000000101"}]})
+    assert response.status_code == 401
+
+
+def test_access_check(seeded):
+    """Swipes are decided by the group schedule, in request order, and recorded on request"""
+    items = [
+        {"chip": "12345", "reader": READER, "time": "2024-02-01T08:00:00"},
+        {"chip": "0x3039", "reader": "101", "time": "2024-02-01T15:00:00"},
+        {"chip": "99999", "reader": READER, "time": "2024-02-01T08:00:00"},
+        {"chip": "12345", "reader": "0000000999", "time": "2024-02-01T08:00:00"},
+    ]
+    response = client.post("/access/check", json={"items": items}, headers=seeded)
+    assert response.status_code == 200
+    assert response.json() == {"recorded": 0, "decisions": [
+        {"chip": "12345", "reader": READER, "allowed": True, "known_reader": True, "known_chip": True},
+        {"chip": "0x3039", "reader": "101", "allowed": False, "known_reader": True, "known_chip": True},
+        {"chip": "99999", "reader": READER, "allowed": False, "known_reader": True, "known_chip": False},
+        {"chip": "12345", "reader": "0000000999", "allowed": False, "known_reader": False, "known_chip": False},
+    ]}
+    assert db.session.query(Card).count() == 0
+
+    response = client.post("/access/check", json={"items": items, "record": True}, headers=seeded)
+    assert response.status_code == 200
+    assert response.json()["recorded"] == 2
+    stored = db.session.query(Card.card_number, Card.time, Card.id_card_reader, Card.access).order_by(Card.time).all()
+    assert [tuple(row) for row in stored] == [("K2", datetime(2024, 2, 1, 8, 0), 1, "1"),
+                                              ("K2", datetime(2024, 2, 1, 15, 0), 1, "0")]
+
+
+def test_bulk_swipes_require_login():
+    """Buffered swipes are only taken from authenticated gateways"""
+    response = client.post("/access/swipes/bulk",
+                           json={"items": [{"chip": "12345", "reader": READER, "time": "2024-02-01T08:00:00"}]})
+    assert response.status_code == 401
+
+
+def test_bulk_swipes(seeded):
+    """Buffered swipes are stored once; duplicates, unknown and invalid rows are counted"""
+    items = [
+        {"chip": "12345", "reader": READER, "time": "2024-02-01T08:00:00"},
+        {"chip": "0000012345", "reader": READER, "time": "2024-02-01T08:00:00.400000"},
+        {"chip": "12345", "reader": READER, "time": "2024-02-01T15:00:00", "allowed": True},
+        {"chip": "not-a-chip", "reader": READER, "time": "2024-02-01T08:00:00"},
+        {"chip": "99999", "reader": READER, "time": "2024-02-01T08:00:00"},
+        {"chip": "12345", "reader": "0000000999", "time": "2024-02-01T08:00:00"},
+    ]
+    response = client.post("/access/swipes/bulk", json={"items": items}, headers=seeded)
+    assert response.status_code == 200
+    assert response.json() == {"received": 6, "inserted": 2, "duplicates": 1, "unknown_reader": 1,
+                               "unknown_chip": 1, "invalid_chip": 1}
+    stored = db.session.query(Card.time, Card.access).order_by(Card.time).all()
+    assert [tuple(row) for row in stored] == [(datetime(2024, 2, 1, 8, 0), "1"), (datetime(2024, 2, 1, 15, 0), "1")]
+
+    # Uploading the same swipes again stores nothing
+    response = client.post("/access/swipes/bulk", json={"items": items[:3]}, headers=seeded)
+    assert response.json() == {"received": 3, "inserted": 0, "duplicates": 3, "unknown_reader": 0,
+                               "unknown_chip": 0, "invalid_chip": 0}
+    assert db.session.query(Card).count() == 2
+
+    # A row without a time rejects the whole upload
+    response = client.post("/access/swipes/bulk", json={"items": [{"chip": "12345", "reader": READER}]},
+                           headers=seeded)
+    assert response.status_code == 422
+    assert db.session.query(Card).count() == 2
+
+
+def test_monthly_report_requires_login():
+    """Monthly reports are only served to authenticated users"""
+    response = client.post("/reports/monthly", json={"year": 2024, "month": 2})
+    assert response.status_code == 401
+
+
+def test_monthly_report(swipes):
+    """Users with swipes get a line per day of the month with first in, last out and hours"""
+    response = client.post("/reports/monthly", json={"year": 2024, "month": 2}, headers=swipes)
+    assert response.status_code == 200
+    [report] = response.json()
+    assert (report["user_id"], report["user_name"], report["total_hours"]) == (2, "Jan Novak", 7.0)
+    assert len(report["entries"]) == 29
+    assert report["entries"][:3] == [
+        {"day": 1, "dow": 3, "first_in": "06:30:00", "last_out": "12:00:00", "hours": 5.5, "swipes": 2},
+        {"day": 2, "dow": 4, "first_in": "07:00:00", "last_out": "08:30:00", "hours": 1.5, "swipes": 2},
+        {"day": 3, "dow": 5, "first_in": None, "last_out": None, "hours": 0.0, "swipes": 0},
+    ]
+
+    # A requested user gets the month also without swipes
+    response = client.post("/reports/monthly", json={"year": 2024, "month": 2, "user_id": 1}, headers=swipes)
+    [report] = response.json()
+    assert (report["user_id"], report["user_name"], report["total_hours"]) == (1, "admin", 0.0)
+    assert [entry["swipes"] for entry in report["entries"]] == [0] * 29
+
+    response = client.post("/reports/monthly", json={"year": 2024, "month": 2, "user_id": 99}, headers=swipes)
+    assert response.json() == []
+
+
+def test_meal_vouchers_require_login():
+    """Meal voucher lists and their CSV export are only served to authenticated users"""
+    for path in ("/reports/meal-vouchers", "/reports/meal-vouchers/csv"):
+        response = client.post(path, json={"year": 2024, "month": 2})
+        assert response.status_code == 401
+
+
+def test_meal_vouchers(swipes):
+    """Every user gets a voucher count, as JSON or as a CSV download"""
+    month = {"year": 2024, "month": 2}
+    response = client.post("/reports/meal-vouchers", json=month, headers=swipes)
+    assert response.status_code == 200
+    assert response.json() == [
+        {"user_id": 1, "user_name": "admin", "card_number": "A1", "year": 2024, "month": 2, "vouchers": 0},
+        {"user_id": 2, "user_name": "Jan Novak", "card_number": "K2", "year": 2024, "month": 2, "vouchers": 1},
+    ]
+
+    # A lower threshold counts the short day too; a group limits the users
+    response = client.post("/reports/meal-vouchers", json=dict(month, min_hours=1, group_id=1), headers=swipes)
+    assert [(row["user_id"], row["vouchers"]) for row in response.json()] == [(2, 2)]
+
+    response = client.post("/reports/meal-vouchers/csv", json=month, headers=swipes)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == 'attachment; filename="meal-vouchers-2024-02.csv"'
+    assert response.text.splitlines() == ["user_id,user_name,card_number,year,month,vouchers",
+                                          "1,admin,A1,2024,2,0", "2,Jan Novak,K2,2024,2,1"]
+
+
+def test_hours_matrix_requires_login():
+    """The all-employee hours matrix is only served to authenticated users, as JSON or HTML"""
+    for path in ("/reports/hours-matrix", "/reports/hours-matrix/html"):
+        response = client.post(path, json={"year": 2024, "month": 2})
+        assert response.status_code == 401
+
+
+def test_hours_matrix(swipes):
+    """Every user gets arrivals, departures and hours per day, as JSON or as a printable table"""
+    month = {"year": 2024, "month": 2}
+    response = client.post("/reports/hours-matrix", json=month, headers=swipes)
+    assert response.status_code == 200
+    matrix = response.json()
+    assert (matrix["year"], matrix["month"], len(matrix["days"])) == (2024, 2, 29)
+    assert matrix["days"][:3] == [{"day": 1, "dow": 3}, {"day": 2, "dow": 4}, {"day": 3, "dow": 5}]
+    admin, jan = matrix["rows"]
+    assert (admin["user_name"], admin["hours"], admin["total_hours"]) == ("admin", [None] * 29, 0.0)
+    assert jan["user_name"] == "Jan Novak"
+    assert (jan["arrivals"][:3], jan["departures"][:3]) == (["06:30", "07:00", ""], ["12:00", "08:30", ""])
+    assert (jan["hours"][:3], jan["vouchers"][:3], jan["total_hours"]) == ([5.5, 1.5, None], [True, False, False], 7.0)
+
+    response = client.post("/reports/hours-matrix", json=dict(month, group_id=1), headers=swipes)
+    assert [row["user_id"] for row in response.json()["rows"]] == [2]
+
+    response = client.post("/reports/hours-matrix/html", json=month, headers=swipes)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    assert "<title>Hodiny 2/2024</title>" in response.text
+    assert '<td class="name" rowspan="3">Jan Novak</td><td>06:30</td><td>07:00</td>' in response.text
+    assert '<tr><td class="voucher">5.5</td><td>1.5</td>' in response.text
+
+
 def test_services_health():
     """Test services health endpoint"""
     response = client.get("/services/health")
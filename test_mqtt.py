@@ -0,0 +1,1225 @@
+"""
+Tests for the MQTT door decision pipeline
+"""
+import pytest
+import paho.mqtt.client as mqtt
+from sqlalchemy import create_engine, event, func, insert, text, update
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
+from sqlalchemy.orm import sessionmaker
+from fastapi.templating import Jinja2Templates
+import sys
+import os
+import asyncio
+import json
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time as time_module
+from datetime import date, datetime, time, timedelta
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Set environment variables before importing app modules
+os.environ['APP_KEY'] = 'test-secret-key-for-testing-only'
+os.environ['DATABASE_URL'] = 'sqlite:///test.db'
+
+from src.data.database import db
+from src.data.models import User, Group, User_has_group, Group_has_timecard, Timecard
+from src.data.models import user as user_module
+from src.data.models import Card, DailyAttendance, Log
+from src.data.util import normalize_chip
+from src.access_check import AccessRequest, check_access, check_access_batch
+from src.access_index import AccessIndex
+from src.allowlists import AllowlistPublisher, allowlist_topic, decode_allowlist, delta_topic, report_topic
+from src.schedule import Schedule, ScheduleWindow
+from src.write_behind import WriteBehindQueue
+from src.dispatcher import MessageDispatcher
+from src.mqtt_broker_stub import BrokerStub
+from src.reader_registry import ReaderRegistry
+from src.access_snapshot import AccessSnapshot
+from src.swipe_journal import SwipeJournal
+from src.swipe_import import BufferedSwipe, import_swipes
+from src.reports import hours_matrix, meal_vouchers, monthly_report
+from src.attendance import AttendanceRollup, rebuild_daily_attendance, refresh_days
+from src.data.dates import day_of, in_month, month_of
+from src.coalesce import CoalescingWindow
+from src.ratelimit import ReaderRateLimiter, TokenBucket
+from src.unknown_cards import UnknownCardSummary
+from src.loggers import SWIPE_LOGGER, JsonFormatter, chip_hash
+from src.metrics import DoorMetrics, Histogram, MetricsRegistry
+from src.mqtt_handler import MQTTHandler
+from src.mqtt_async import AsyncDispatcher, AsyncMQTTWorker
+
+READER = "0000000101"
+OTHER_READER = "0000000102"
+
+
+def membership(row_id, user_id, group_id):
+    """User_has_group row with an explicit id (part of its composite primary key)"""
+    row = User_has_group(user_id, group_id)
+    row.id = row_id
+    return row
+
+
+@pytest.fixture
+def seeded_db():
+    """Create tables with two readers, two groups and three users"""
+    db.create_all()
+    session = db.session
+    session.add_all([
+        Timecard(id=1, timecard_name="Vchod", timecard_head="A", identreader=READER, pushopen="door/1/open"),
+        Timecard(id=2, timecard_name="Sklad", timecard_head="B", identreader=OTHER_READER, pushopen="door/2/open"),
+        Group(id=1, group_name="Ranni", Monday=1, Tuesday=1, Wednesday=1, Thursday=1, Friday=1,
+              Saturday=0, Sunday=0, access_time_from=time(6, 0), access_time_to=time(14, 0)),
+        Group(id=2, group_name="Vikend", Monday=0, Tuesday=0, Wednesday=0, Thursday=0, Friday=0,
+              Saturday=1, Sunday=1, access_time_from=time(8, 0), access_time_to=time(20, 0)),
+        User(id=1, chip_number="0000012345", card_number="K1", email="a@example.com", username="a"),
+        User(id=2, chip_number="0000067890", card_number="K2", email="b@example.com", username="b"),
+        User(id=3, chip_number="0000011111", card_number="K3", email="c@example.com", username="c"),
+    ])
+    session.flush()
+    session.add_all([
+        membership(1, 1, 1),
+        membership(2, 2, 1),
+        membership(3, 2, 2),
+        Group_has_timecard(id=1, group_id=1, timecard_id=1),
+        Group_has_timecard(id=2, group_id=2, timecard_id=2),
+    ])
+    session.commit()
+    yield session
+    db.session.remove()
+    db.drop_all()
+
+
+class FakeClient:
+    """Records publishes instead of talking to a broker"""
+
+    def __init__(self):
+        self.published = []
+        self.retained = {}
+        self.subscribed = set()
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload))
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+
+    def subscribe(self, topics, qos=0):  # pylint: disable=unused-argument
+        self.subscribed.update(topic for topic, _ in topics)
+
+    def unsubscribe(self, topics):
+        self.subscribed.difference_update(topics)
+
+    def disconnect(self):
+        pass
+
+
+class FakeMessage:
+    """Minimal stand-in for paho's MQTTMessage"""
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload if isinstance(payload, bytes) else str(payload).encode()
+
+
+def make_handler(**kwargs):
+    """MQTTHandler wired to a FakeClient"""
+    handler = MQTTHandler(db.session, **kwargs)
+    handler.client = FakeClient()
+    return handler
+
+
+def wait_until(predicate, timeout=1.0):
+    """Poll `predicate` until it is true or `timeout` expires"""
+    deadline = time_module.monotonic() + timeout
+    while not predicate() and time_module.monotonic() < deadline:
+        time_module.sleep(0.01)
+    return predicate()
+
+
+def access_by_group_at(monkeypatch, when, chip, reader):
+    """Run User.access_by_group as if it were `when`"""
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return when
+    monkeypatch.setattr(user_module, "datetime", FrozenDatetime)
+    return User.access_by_group(chip, reader)
+
+
+def test_access_index_matches_access_by_group(seeded_db, monkeypatch):
+    """Index decisions equal the database query for every chip, reader and time"""
+    index = AccessIndex(db.session_factory)
+    index.refresh()
+    moments = [
+        datetime(2024, 1, 1, 5, 59), datetime(2024, 1, 1, 6, 0), datetime(2024, 1, 3, 13, 59, 59),
+        datetime(2024, 1, 5, 14, 0, 1), datetime(2024, 1, 6, 8, 0), datetime(2024, 1, 7, 21, 0),
+    ]
+    for when in moments:
+        for chip in (12345, 67890, 11111, 99999):
+            for reader in (READER, OTHER_READER, "unknown"):
+                expected = access_by_group_at(monkeypatch, when, chip, reader)
+                assert index.is_allowed(chip, reader, when) == expected, (when, chip, reader)
+
+
+def test_short_reader_topic_is_decided_alike(seeded_db, monkeypatch):
+    """A topic without the zero padding resolves to the same reader on every path"""
+    index = AccessIndex(db.session_factory)
+    index.refresh()
+    registry = ReaderRegistry(db.session_factory)
+    registry.refresh()
+    when = datetime(2024, 1, 1, 8, 0)
+    short = READER.lstrip("0")
+    assert short == "101"
+    assert registry.lookup(short) == registry.lookup(READER)
+    assert registry.lookup(short).id == 1
+    assert index.is_allowed(12345, short, when)
+    assert access_by_group_at(monkeypatch, when, 12345, short)
+    assert check_access(db.session, 12345, short, when).allowed
+    assert check_access_batch(db.session, [AccessRequest(12345, short, when)])[0].allowed
+
+    # A reader registered with a short topic is stored padded
+    seeded_db.add(Timecard(id=3, timecard_name="Dvur", timecard_head="C", identreader="103"))
+    seeded_db.commit()
+    assert seeded_db.get(Timecard, 3).identreader == "0000000103"
+
+
+def test_access_index_lookup_matches_find_by_chip(seeded_db):
+    """Chip lookup returns the same user as User.find_by_chip"""
+    index = AccessIndex(db.session_factory)
+    index.refresh()
+    for chip in (12345, 67890, 11111, 99999):
+        user = User.find_by_chip(chip)
+        holder = index.lookup(chip)
+        if user is None:
+            assert holder is None
+        else:
+            assert (holder.id, holder.card_number) == (user.id, user.card_number)
+
+
+def test_access_index_invalidated_on_commit(seeded_db):
+    """Committing a membership change rebuilds the index in this process"""
+    index = AccessIndex(db.session_factory).start(interval=3600)
+    try:
+        monday_morning = datetime(2024, 1, 1, 9, 0)
+        assert not index.is_allowed(11111, READER, monday_morning)
+        version = index.version
+        seeded_db.add(membership(4, 3, 1))
+        seeded_db.commit()
+        assert wait_until(lambda: index.version > version)
+        assert index.is_allowed(11111, READER, monday_morning)
+    finally:
+        index.stop()
+
+
+
+def test_chip_lookups_are_exact_for_decimal_and_hex(seeded_db):
+    """Reader formats normalize to one integer chip id used by every lookup"""
+    assert normalize_chip("0000012345") == normalize_chip(b" 12345\n") == normalize_chip("0x3039") == 12345
+    assert normalize_chip("30ab") == 0x30ab
+    assert normalize_chip("zz") is None and normalize_chip(-1) is None and normalize_chip("") is None
+    # chip_number holds 10 decimal digits
+    assert normalize_chip("0xFFFFFFFF") == 4294967295 and normalize_chip("9999999999") == 9999999999
+    assert normalize_chip("2540BE400") is None and normalize_chip(10 ** 10) is None
+    assert seeded_db.get(User, 1).chip_id == 12345
+    user = seeded_db.get(User, 3)
+    user.chip_number = "0xFFFFFFFF"
+    seeded_db.commit()
+    assert (user.chip_number, user.chip_id) == ("4294967295", 0xFFFFFFFF)
+
+    # A chip held by another user is refused
+    seeded_db.add(User(id=4, chip_number="0x3039", card_number="K4", email="d@example.com", username="d"))
+    with pytest.raises(IntegrityError):
+        seeded_db.commit()
+    seeded_db.rollback()
+
+    index = AccessIndex(db.session_factory)
+    index.refresh()
+    assert User.find_by_chip("0x3039").id == index.lookup(b"0x3039").id == 1
+    assert User.find_by_chip("0000099999") is None and index.lookup(99999) is None
+
+    handler = make_handler(access_index=index)
+    handler.door_test(FakeMessage(READER, "0x3039"))
+    handler.door_test(FakeMessage(READER, "12345"))
+    assert len(handler.client.published) == 2
+    assert len({payload for _, payload in handler.client.published}) == 1
+
+
+def test_door_response_published_before_rows_are_flushed(seeded_db):
+    """The reader gets its answer while the Card row is still queued"""
+    index = AccessIndex(db.session_factory)
+    index.refresh()
+    writer = WriteBehindQueue(db.session_factory, batch_size=100, flush_interval=60)
+    handler = make_handler(access_index=index, writer=writer)
+
+    handler.door_test(FakeMessage(READER, 12345))
+    handler.door_test(FakeMessage(READER, 99999))
+
+    assert len(handler.client.published) == 1
+    assert writer.depth == 2
+    assert seeded_db.query(Card).count() == 0
+
+    handler.stop()
+    assert writer.depth == 0
+    assert seeded_db.query(Card).count() == 1
+    assert seeded_db.query(Log).count() == 1
+    assert handler.stats()['write_behind_flushed'] == 2
+
+
+def test_write_behind_flushes_full_batches(seeded_db):
+    """Reaching the batch size flushes without waiting for the interval"""
+    writer = WriteBehindQueue(db.session_factory, batch_size=3, flush_interval=60).start()
+    try:
+        for minute in range(3):
+            writer.submit(Log, {'time': datetime(2024, 1, 1, 8, minute), 'text': 'test'})
+        assert wait_until(lambda: writer.flushed == 3)
+        assert writer.flushes == 1
+        assert seeded_db.query(Log).count() == 3
+    finally:
+        writer.stop()
+
+
+def test_write_behind_retries_batches_while_the_database_is_down(seeded_db, tmp_path):
+    """A batch that fails on an unreachable database is kept and retried with backoff"""
+    outage = [unreachable_session_factory(tmp_path)] * 2
+
+    def session_factory():
+        return (outage.pop() if outage else db.session_factory)()
+
+    writer = WriteBehindQueue(session_factory, batch_size=2, flush_interval=60, retry_interval=0.05).start()
+    try:
+        writer.submit(Log, {'time': datetime(2024, 1, 1, 8, 0), 'text': 'first'})
+        writer.submit(Log, {'time': datetime(2024, 1, 1, 8, 1), 'text': 'second'})
+        assert wait_until(lambda: writer.flushed == 2)
+        assert (writer.retries, writer.failed) == (2, 0)
+        assert [row.text for row in seeded_db.query(Log).order_by(Log.time)] == ['first', 'second']
+    finally:
+        writer.stop()
+
+    # Rows still queued when stopping during an outage are given up
+    writer = WriteBehindQueue(unreachable_session_factory(tmp_path), max_rows=2)
+    for minute in range(3):
+        writer.submit(Log, {'time': datetime(2024, 1, 1, 9, minute), 'text': 'lost'})
+    writer.stop()
+    assert writer.stats()['write_behind_failed'] == 3
+    assert writer.depth == 0
+
+
+
+def test_dispatcher_keeps_order_per_reader():
+    """Messages of one topic are processed in arrival order across a worker pool"""
+    seen = {}
+    lock = threading.Lock()
+
+    def process(msg):
+        time_module.sleep(random.random() / 1000)
+        with lock:
+            seen.setdefault(msg.topic, []).append(int(msg.payload))
+
+    dispatcher = MessageDispatcher(process, workers=4, queue_size=1000).start()
+    topics = [f"{n:010d}" for n in range(8)]
+    for number in range(50):
+        for topic in topics:
+            assert dispatcher.submit(FakeMessage(topic, number))
+    dispatcher.stop()
+
+    assert all(seen[topic] == list(range(50)) for topic in topics)
+    assert dispatcher.stats()['dispatcher_processed'] == 400
+
+
+def test_dispatcher_counts_and_reports_overflow():
+    """A full queue drops the message, counts it and calls on_overflow"""
+    release = threading.Event()
+    overflowed = []
+    dispatcher = MessageDispatcher(lambda msg: release.wait(), workers=1, queue_size=2,
+                                   on_overflow=overflowed.append).start()
+    messages = [FakeMessage(READER, n) for n in range(5)]
+    results = [dispatcher.submit(msg) for msg in messages]
+    release.set()
+    dispatcher.stop()
+
+    # One message is being processed, two wait in the queue
+    assert results.count(False) == dispatcher.dropped == len(overflowed)
+    assert dispatcher.dropped >= 2
+
+
+
+@pytest.fixture
+def broker():
+    """Local MQTT broker stand-in"""
+    stub = BrokerStub().start()
+    yield stub
+    stub.stop()
+
+
+def test_shared_subscription_splits_messages(broker):
+    """Listeners in one shared group each receive a share of the reader messages"""
+    received = {0: [], 1: []}
+    handlers = []
+    for number in received:
+        handler = MQTTHandler(None, shared_group="workers")
+        handler.door_test = received[number].append
+        handler.connect(broker.host, broker.port)
+        handler.client.loop_start()
+        handlers.append(handler)
+    publisher = mqtt.Client()
+    publisher.connect(broker.host, broker.port)
+    publisher.loop_start()
+    try:
+        assert wait_until(lambda: broker.subscription_count() == 2)
+        for number in range(10):
+            publisher.publish(READER, payload=str(number))
+        assert wait_until(lambda: len(received[0]) + len(received[1]) == 10)
+        assert len(received[0]) == len(received[1]) == 5
+    finally:
+        publisher.loop_stop()
+        for handler in handlers:
+            handler.stop()
+            handler.client.loop_stop()
+
+
+def test_hash_partition_assigns_every_reader_once():
+    """With consistent hashing exactly one worker owns each reader topic"""
+    handlers = [MQTTHandler(None, partition=(index, 3)) for index in range(3)]
+    topics = [f"{n:010d}" for n in range(300)]
+    owners = [[h.owns(topic) for h in handlers].count(True) for topic in topics]
+    assert owners == [1] * len(topics)
+    assert all(sum(h.owns(topic) for topic in topics) > 50 for h in handlers)
+
+
+
+def test_reader_subscriptions_follow_timecard_table(broker, seeded_db):
+    """Only registered reader topics are subscribed, changes are applied incrementally"""
+    received = []
+    handler = MQTTHandler(None)
+    handler.door_test = received.append
+    subscriptions = handler.track_reader_topics()
+    registry = ReaderRegistry(db.session_factory)
+    registry.refresh()
+    subscriptions.sync(handler.reader_topics(registry.topics()))
+    assert subscriptions.topics == {READER, "101", OTHER_READER, "102"}
+    handler.connect(broker.host, broker.port)
+    handler.client.loop_start()
+    publisher = mqtt.Client()
+    publisher.connect(broker.host, broker.port)
+    publisher.loop_start()
+    try:
+        assert wait_until(lambda: broker.subscription_count() == 4)
+        publisher.publish("door/1/open", payload="1")
+        publisher.publish("telemetry/temperature", payload="21")
+        publisher.publish(READER, payload="12345")
+        # A reader publishing without the zero padding is subscribed as well
+        publisher.publish("101", payload="12345")
+        assert wait_until(lambda: len(received) == 2)
+        assert sorted(message.topic for message in received) == ["0000000101", "101"]
+
+        subscriptions.sync(handler.reader_topics({READER}))
+        assert wait_until(lambda: broker.subscription_count() == 2)
+
+        handler.on_message(handler.client, None, FakeMessage(OTHER_READER, 12345))
+        handler.on_message(handler.client, None, FakeMessage("102", 12345))
+        assert handler.stats()['unknown_topic_rejected'] == 2
+        handler.on_message(handler.client, None, FakeMessage("101", 12345))
+        assert len(received) == 3
+    finally:
+        publisher.loop_stop()
+        handler.stop()
+        handler.client.loop_stop()
+
+
+
+def test_unpadded_topic_is_subscribed_and_decided(seeded_db):
+    """In targeted mode a swipe on "101" reaches door_test and is decided for reader 0000000101"""
+    metrics = DoorMetrics(MetricsRegistry())
+    index, readers = AccessIndex(db.session_factory), ReaderRegistry(db.session_factory)
+    index.refresh()
+    readers.refresh()
+    handler = make_handler(access_index=index, readers=readers, metrics=metrics)
+    handler.track_reader_topics().sync(handler.reader_topics(readers.topics()))
+    assert {"101", READER} <= handler.client.subscribed
+    handler.on_message(handler.client, None, FakeMessage("101", "12345"))
+
+    metrics.fold()
+    assert handler.stats()['unknown_topic_rejected'] == 0
+    assert metrics.outcomes.value('allowed') + metrics.outcomes.value('denied') == 1
+    assert metrics.outcomes.value('unknown_reader') == 0
+    assert set(metrics.reader_quantiles()) == {"101"}
+
+
+def test_reader_registry_matches_timecard_query(seeded_db):
+    """Registry lookups resolve topics like the identreader query and track changes"""
+    registry = ReaderRegistry(db.session_factory).start(interval=3600)
+    try:
+        for topic in (READER, OTHER_READER, "101", "unknown"):
+            timecard = seeded_db.query(Timecard).filter_by(identreader=topic.zfill(10)).first()
+            reader = registry.lookup(topic)
+            if timecard is None:
+                assert reader is None
+            else:
+                assert reader == (timecard.id, timecard.pushopen, timecard.timecard_name)
+
+        version = registry.version
+        assert not registry.refresh()
+        assert registry.version == version
+
+        seeded_db.add(Timecard(id=3, timecard_name="Dvur", timecard_head="C",
+                               identreader="0000000103", pushopen="door/3/open"))
+        seeded_db.commit()
+        assert wait_until(lambda: registry.version > version)
+        assert registry.lookup("0000000103").pushopen == "door/3/open"
+    finally:
+        registry.stop()
+
+
+def test_door_test_uses_registry_without_queries(seeded_db):
+    """With registry and index a swipe is decided without any SQL statement"""
+    index = AccessIndex(db.session_factory)
+    index.refresh()
+    registry = ReaderRegistry(db.session_factory)
+    registry.refresh()
+    writer = WriteBehindQueue(db.session_factory, flush_interval=60)
+    handler = make_handler(access_index=index, writer=writer, readers=registry)
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        handler.door_test(FakeMessage(READER, 12345))
+        handler.door_test(FakeMessage(READER, 99999))
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    assert statements == []
+    assert handler.client.published[0][0] == "door/1/open"
+    writer.stop()
+
+
+
+def unreachable_session_factory(tmp_path):
+    """Session factory whose database cannot be opened"""
+    engine = create_engine(f"sqlite:///{tmp_path}/missing/karty.db")
+    return sessionmaker(bind=engine)
+
+
+def test_check_access_decides_in_one_statement(seeded_db, monkeypatch):
+    """Without caches a swipe costs one query that agrees with access_by_group"""
+    moments = [datetime(2024, 1, 1, 6, 0), datetime(2024, 1, 5, 14, 0, 1), datetime(2024, 1, 6, 8, 0)]
+    for when in moments:
+        for chip in (12345, 67890, 99999):
+            for reader in (READER, OTHER_READER):
+                check = check_access(db.session, chip, reader, when)
+                assert check.reader_id == (1 if reader == READER else 2)
+                assert (check.user_id is not None) == (User.find_by_chip(chip) is not None)
+                assert check.allowed == access_by_group_at(monkeypatch, when, chip, reader), (when, chip, reader)
+    assert check_access(db.session, 12345, "0000000999") is None
+
+    writer = WriteBehindQueue(db.session_factory, flush_interval=60)
+    handler = make_handler(writer=writer)
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        handler.door_test(FakeMessage(READER, 12345))
+        handler.door_test(FakeMessage(READER, 99999))
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    assert len(statements) == 2
+    assert handler.client.published[0][0] == "door/1/open"
+    writer.stop()
+
+
+def test_check_access_batch_matches_single_checks(seeded_db):
+    """A batch is decided with three queries, each item as check_access decides it"""
+    moments = [datetime(2024, 1, 1, 6, 0), datetime(2024, 1, 5, 14, 0, 1), datetime(2024, 1, 6, 8, 0)]
+    requests = [AccessRequest(chip, reader, when) for when in moments for chip in (12345, 67890, 99999, None)
+                for reader in (READER, OTHER_READER, "0000000999")]
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        checks = check_access_batch(db.session, requests)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    assert len(statements) == 3
+    for request, check in zip(requests, checks):
+        if request.chip is None:
+            assert check is None or (check.user_id, check.allowed) == (None, False)
+        else:
+            assert check == check_access(db.session, request.chip, request.reader, request.when), request
+
+
+def test_buffered_swipes_are_imported_once(seeded_db):
+    """Uploads skip rows already in carddata or earlier in the upload and count rejects"""
+    seeded_db.add(Card("K1", datetime(2024, 1, 1, 8, 0, 0), 1, 1, "1"))
+    seeded_db.commit()
+    swipes = [
+        BufferedSwipe(12345, READER, datetime(2024, 1, 1, 8, 0, 0, 400000), None),
+        BufferedSwipe(12345, READER, datetime(2024, 1, 1, 9, 0), None),
+        BufferedSwipe(12345, READER, datetime(2024, 1, 1, 9, 0), True),
+        BufferedSwipe(67890, OTHER_READER, datetime(2024, 1, 6, 9, 0), False),
+        BufferedSwipe(67890, READER, datetime(2024, 1, 6, 9, 0), None),
+        BufferedSwipe(99999, READER, datetime(2024, 1, 1, 9, 0), None),
+        BufferedSwipe(12345, "0000000999", datetime(2024, 1, 1, 9, 0), None),
+    ]
+    summary = import_swipes(seeded_db, swipes)
+    assert summary == {'received': 7, 'inserted': 3, 'duplicates': 2, 'unknown_reader': 1, 'unknown_chip': 1}
+    rows = seeded_db.query(Card.card_number, Card.id_card_reader, Card.time, Card.access)\
+        .filter(Card.time > datetime(2024, 1, 1, 8, 30)).order_by(Card.time, Card.id_card_reader).all()
+    # The reader's own decision wins over the rules
+    assert rows == [("K1", 1, datetime(2024, 1, 1, 9, 0), "1"),
+                    ("K2", 1, datetime(2024, 1, 6, 9, 0), "0"),
+                    ("K2", 2, datetime(2024, 1, 6, 9, 0), "0")]
+    assert import_swipes(seeded_db, swipes)['inserted'] == 0
+
+
+def test_large_upload_stays_below_the_sqlite_parameter_limit(seeded_db):
+    """Duplicate lookups of an upload of many cards bind fewer than 999 parameters per statement"""
+    seeded_db.add_all(User(id=100 + index, chip_number=str(100000 + index).zfill(10), card_number=f"C{index}",
+                           email=f"u{index}@example.com", username=f"u{index}") for index in range(1000))
+    seeded_db.commit()
+    swipes = [BufferedSwipe(100000 + index, READER, datetime(2024, 1, 1, 8, 0), True) for index in range(1000)]
+    parameters = []
+
+    def count(conn, cursor, statement, params, context, executemany):  # pylint: disable=unused-argument
+        if not executemany:
+            parameters.append(len(params))
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        assert import_swipes(seeded_db, swipes)['inserted'] == 1000
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    assert max(parameters) < 999
+
+
+def test_monthly_report_in_one_query(seeded_db):
+    """Every day of the month per user from a single grouped statement"""
+    seeded_db.add_all([
+        Card("K1", datetime(2024, 2, 1, 7, 30), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 1, 12, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 1, 15, 45), 2, 1, "0"),
+        Card("K1", datetime(2024, 2, 29, 8, 0), 1, 1, "1"),
+        Card("K2", datetime(2024, 2, 3, 9, 0), 2, 2, "1"),
+        Card("K1", datetime(2024, 3, 1, 0, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 1, 31, 23, 59), 1, 1, "1"),
+    ])
+    seeded_db.commit()
+    rebuild_daily_attendance(db.session_factory, date(2024, 1, 1), date(2024, 4, 1))
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        reports = monthly_report(seeded_db, 2024, 2)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    assert len(statements) == 1
+    assert [report.user_id for report in reports] == [1, 2]
+    first = reports[0]
+    assert len(first.days) == 29
+    assert first.days[0] == (1, 3, time(7, 30), time(15, 45), 8.25, 3)
+    assert first.days[28] == (29, 3, time(8, 0), time(8, 0), 0.0, 1)
+    assert first.days[1] == (2, 4, None, None, 0.0, 0)
+    assert first.total_hours == 8.25
+    assert reports[1].days[2].swipes == 1
+
+    assert monthly_report(seeded_db, 2024, 2, user_id=3)[0].total_hours == 0.0
+    assert monthly_report(seeded_db, 2024, 2, user_id=99) == []
+
+
+def test_month_buckets_are_ranges_on_the_time_index(seeded_db):
+    """Month filters compare the bare column, truncation only groups; meal vouchers use them"""
+    seeded_db.add_all([
+        Card("K1", datetime(2024, 1, 31, 23, 59, 59), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 1, 7, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 1, 10, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 2, 7, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 2, 9, 59), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 29, 12, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 29, 18, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 3, 1, 0, 0), 1, 1, "1"),
+    ])
+    seeded_db.commit()
+    rows = seeded_db.query(month_of(Card.time), day_of(Card.time), func.count())\
+        .filter(in_month(Card.time, 2024, 2)).group_by(month_of(Card.time), day_of(Card.time)).all()
+    assert rows == [(date(2024, 2, 1), date(2024, 2, 1), 2), (date(2024, 2, 1), date(2024, 2, 2), 2),
+                    (date(2024, 2, 1), date(2024, 2, 29), 2)]
+    assert Card.stravenky("2024-02", "K1") == 2
+    assert Card.stravenky("2024-01", "K1") == 0
+
+    plan = seeded_db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT count(*) FROM carddata WHERE time >= '2024-02-01' AND time < '2024-03-01'"
+    )).all()
+    assert "ix_carddata_time" in str(plan)
+
+
+def test_meal_vouchers_of_everyone_in_one_query(seeded_db):
+    """Bulk voucher counts match Card.stravenky per user and honour group and thresholds"""
+    seeded_db.add_all([
+        # Thursday and Friday over three hours, Saturday over three hours
+        Card("K1", datetime(2024, 2, 1, 7, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 1, 10, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 2, 7, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 2, 15, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 3, 8, 0), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 3, 11, 30), 1, 1, "1"),
+        Card("K2", datetime(2024, 2, 5, 8, 0), 2, 2, "1"),
+        Card("K2", datetime(2024, 2, 5, 10, 59), 2, 2, "1"),
+        Card("K3", datetime(2024, 2, 10, 6, 0), 2, 3, "1"),
+        Card("K3", datetime(2024, 2, 10, 18, 0), 2, 3, "1"),
+        Card("K3", datetime(2024, 3, 1, 6, 0), 2, 3, "1"),
+        Card("K3", datetime(2024, 3, 1, 18, 0), 2, 3, "1"),
+    ])
+    seeded_db.commit()
+    rebuild_daily_attendance(db.session_factory, date(2024, 1, 1), date(2024, 4, 1))
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        everyone = meal_vouchers(seeded_db, 2024, 2)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    assert len(statements) == 1
+    assert {entry.card_number: entry.vouchers for entry in everyone} == {"K1": 3, "K2": 0, "K3": 1}
+    for entry in everyone:
+        assert entry.vouchers == Card.stravenky("2024-02", entry.card_number)
+
+    assert [(entry.user_id, entry.vouchers) for entry in meal_vouchers(seeded_db, 2024, 2, group_id=1)] == \
+        [(1, 3), (2, 0)]
+    assert {entry.user_id: entry.vouchers
+            for entry in meal_vouchers(seeded_db, 2024, 2, working_days_only=True)} == {1: 2, 2: 0, 3: 0}
+    assert {entry.user_id: entry.vouchers
+            for entry in meal_vouchers(seeded_db, 2024, 2, min_hours=2.95)} == {1: 3, 2: 1, 3: 1}
+    assert {entry.user_id: entry.vouchers
+            for entry in meal_vouchers(seeded_db, 2024, 2, min_hours=8)} == {1: 1, 2: 0, 3: 1}
+
+
+def test_hours_matrix_is_one_query_and_renders(seeded_db):
+    """Users x days matrix from one statement, consistent with the monthly report"""
+    seeded_db.add_all([
+        Card("K1", datetime(2024, 2, 1, 7, 30), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 1, 15, 45), 1, 1, "1"),
+        Card("K1", datetime(2024, 2, 29, 8, 0), 1, 1, "1"),
+        Card("K2", datetime(2024, 2, 3, 9, 0), 2, 2, "1"),
+        Card("K2", datetime(2024, 2, 3, 11, 0), 2, 2, "1"),
+    ])
+    seeded_db.commit()
+    rebuild_daily_attendance(db.session_factory, date(2024, 1, 1), date(2024, 4, 1))
+    statements = []
+
+    def count(*args):
+        statements.append(args)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        matrix = hours_matrix(seeded_db, 2024, 2)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    assert len(statements) == 1
+    assert len(matrix.days) == 29 and matrix.days[2] == (3, 5)
+    assert [row.user_id for row in matrix.rows] == [1, 2, 3]
+    first = matrix.rows[0]
+    assert (first.arrivals[0], first.departures[0], first.hours[0], first.vouchers[0]) == ("07:30", "15:45", 8.25, True)
+    assert (first.arrivals[28], first.hours[28], first.vouchers[28]) == ("08:00", 0.0, False)
+    assert (first.arrivals[1], first.hours[1]) == ("", None)
+    assert all(len(cells) == 29 for row in matrix.rows for cells in (row.arrivals, row.departures, row.hours))
+    reports = {report.user_id: report.total_hours for report in monthly_report(seeded_db, 2024, 2)}
+    assert {row.user_id: row.total_hours for row in matrix.rows} == {**reports, 3: 0.0}
+    assert [row.user_id for row in hours_matrix(seeded_db, 2024, 2, group_id=2).rows] == [2]
+
+    page = Jinja2Templates(directory="src/templates").get_template("reports/hours_matrix.html")\
+        .render(matrix=matrix)
+    assert page.count('<tr>') == 1 + 3 * 3
+    assert page.count('class="voucher"') == 1
+
+
+def test_daily_attendance_is_refreshed_off_the_swipe_path(seeded_db):
+    """Inserting swipes touches only carddata; refreshes write just the changed user days"""
+    def rollup():
+        seeded_db.expire_all()
+        return {(row.user_id, row.day): (row.first_in.time(), row.last_out.time(), row.swipes,
+                                         row.worked_minutes, row.meal_voucher)
+                for row in seeded_db.query(DailyAttendance)}
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        seeded_db.add(Card("K1", datetime(2024, 2, 1, 9, 0), 1, 1, "1"))
+        seeded_db.add(Card("K9", datetime(2024, 2, 1, 9, 5), 1, None, "0"))
+        seeded_db.commit()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    assert statements and all('daily_attendance' not in statement for statement in statements)
+    assert rollup() == {}
+
+    seeded_db.execute(insert(Card), [
+        {'card_number': "K1", 'time': datetime(2024, 2, 1, 7, 30), 'id_card_reader': 1, 'id_user': 1, 'access': "1"},
+        {'card_number': "K1", 'time': datetime(2024, 2, 1, 10, 29, 59), 'id_card_reader': 2, 'id_user': 1,
+         'access': "1"},
+        {'card_number': "K2", 'time': datetime(2024, 2, 2, 8, 0), 'id_card_reader': 2, 'id_user': 2, 'access': "1"},
+        {'card_number': "K3", 'time': datetime(2024, 1, 20, 8, 0), 'id_card_reader': 2, 'id_user': 3, 'access': "1"},
+    ])
+    seeded_db.commit()
+
+    # The periodic job covers today and yesterday
+    rollup_job = AttendanceRollup(db.session_factory, days=2)
+    assert rollup_job.refresh(today=date(2024, 2, 2)) == 2
+    assert rollup() == {(1, date(2024, 2, 1)): (time(7, 30), time(10, 29, 59), 3, 179, False),
+                        (2, date(2024, 2, 2)): (time(8, 0), time(8, 0), 1, 0, False)}
+    assert rollup_job.refresh(today=date(2024, 2, 2)) == 0
+
+    # A later swipe updates the day, older batches refresh their own days
+    seeded_db.add(Card("K1", datetime(2024, 2, 1, 10, 30), 1, 1, "1"))
+    seeded_db.commit()
+    assert refresh_days(seeded_db, [datetime(2024, 1, 20, 8, 0), datetime(2024, 2, 1, 10, 30)]) == 2
+    assert rollup()[(1, date(2024, 2, 1))] == (time(7, 30), time(10, 30), 4, 180, True)
+    assert rollup()[(3, date(2024, 1, 20))] == (time(8, 0), time(8, 0), 1, 0, False)
+
+    # Recent days are refreshed too, the periodic job may run in no process
+    now = datetime.combine(date.today(), time(8, 0))
+    seeded_db.add(Card("K3", now, 1, 3, "1"))
+    seeded_db.commit()
+    assert refresh_days(seeded_db, [now]) == 1
+    assert rollup()[(3, date.today())] == (time(8, 0), time(8, 0), 1, 0, False)
+    seeded_db.query(Card).filter(Card.time == now).delete()
+    seeded_db.commit()
+    assert refresh_days(seeded_db, [now]) == 1
+
+    # Rows changed or deleted by hand are repaired by a rebuild of their range
+    seeded_db.query(Card).filter(Card.time >= datetime(2024, 2, 1, 10), Card.time < datetime(2024, 2, 2)).delete()
+    seeded_db.query(Card).filter(Card.card_number == "K2").delete()
+    seeded_db.commit()
+    assert rebuild_daily_attendance(db.session_factory, date(2024, 1, 15), date(2024, 3, 1)) == 2
+    assert rollup() == {(1, date(2024, 2, 1)): (time(7, 30), time(9, 0), 2, 90, False),
+                        (3, date(2024, 1, 20)): (time(8, 0), time(8, 0), 1, 0, False)}
+    assert rebuild_daily_attendance(db.session_factory, date(2024, 1, 15), date(2024, 3, 1)) == 0
+
+
+def test_split_and_overnight_schedules(seeded_db, monkeypatch):
+    """Several windows a day and windows past midnight agree in the index and both queries"""
+    group = seeded_db.get(Group, 1)
+    group.set_schedule([
+        ScheduleWindow([0, 1, 2, 3, 4], time(6, 0), time(9, 59, 59)),
+        ScheduleWindow([0, 1, 2, 3, 4], time(14, 0), time(17, 59, 59)),
+        ScheduleWindow([6], time(22, 0), time(5, 59, 59)),
+    ])
+    seeded_db.commit()
+    assert Schedule.from_windows(group.schedule_windows) == group.schedule
+    assert (group.Monday, group.Saturday, group.access_time_from) == (1, 0, time(6, 0))
+
+    index = AccessIndex(db.session_factory)
+    index.refresh()
+    expected = {
+        datetime(2024, 1, 1, 8, 0): True, datetime(2024, 1, 1, 12, 0): False,
+        datetime(2024, 1, 1, 15, 0): True, datetime(2024, 1, 1, 18, 0): False,
+        datetime(2024, 1, 7, 23, 30): True, datetime(2024, 1, 1, 5, 59, 59): True,
+        datetime(2024, 1, 6, 23, 30): False,
+    }
+    for when, allowed in expected.items():
+        assert index.is_allowed(12345, READER, when) == allowed, when
+        assert access_by_group_at(monkeypatch, when, 12345, READER) == allowed, when
+        assert check_access(db.session, 12345, READER, when).allowed == allowed, when
+
+    # Setting a legacy column goes back to a single window
+    group.Sunday = 0
+    group.access_time_to = time(12, 0)
+    seeded_db.commit()
+    assert group.schedule == Schedule.from_legacy([1, 1, 1, 1, 1, 0, 0], time(6, 0), time(12, 0))
+
+    # Bulk UPDATEs skip that sync and are rejected for the legacy columns
+    with pytest.raises(InvalidRequestError):
+        seeded_db.query(Group).filter(Group.id == 1).update({Group.Saturday: 1})
+    with pytest.raises(InvalidRequestError):
+        seeded_db.execute(update(Group).where(Group.id == 1).values(access_time_from=time(5, 0)))
+    with pytest.raises(InvalidRequestError):
+        seeded_db.execute(update(Group), [{'id': 1, 'Sunday': 1}])
+    seeded_db.rollback()
+    seeded_db.query(Group).filter(Group.id == 1).update({Group.group_name: "Ranni smena"})
+    seeded_db.commit()
+    assert group.schedule == Schedule.from_legacy([1, 1, 1, 1, 1, 0, 0], time(6, 0), time(12, 0))
+
+
+def test_allowlists_follow_memberships_as_retained_deltas(seeded_db):
+    """Readers get their chips and schedules retained; changes arrive as deltas, rate-limited"""
+    index = AccessIndex(db.session_factory)
+    index.refresh()
+    registry = ReaderRegistry(db.session_factory)
+    registry.refresh()
+    client = FakeClient()
+    publisher = AllowlistPublisher(client, index, registry, rate=1, burst=1, delta_ratio=2.0)
+    index.add_listener(publisher.mark_dirty)
+
+    def held(pushopen):
+        return decode_allowlist(client.retained[allowlist_topic(pushopen)],
+                                client.retained.get(delta_topic(pushopen)))[1]
+
+    # One reader per batch
+    start = time_module.monotonic()
+    assert publisher.publish(now=start) == 1
+    assert publisher.publish(now=start) == 0
+    assert publisher.publish(now=start + 1) == 1
+    assert publisher.publish(now=start + 2) == 0
+    assert held("door/1/open") == {12345: index.state.schedules[12345][READER],
+                                   67890: index.state.schedules[67890][READER]}
+    assert set(held("door/2/open")) == {67890}
+
+    seeded_db.add(membership(4, 3, 1))
+    seeded_db.commit()
+    index.refresh()
+    assert publisher.publish(now=start + 3) == 1
+    assert delta_topic("door/1/open") in client.retained
+    assert held("door/1/open")[11111] == index.state.schedules[11111][READER]
+    for chip, schedule in held("door/1/open").items():
+        assert schedule.allows(datetime(2024, 1, 1, 8, 0)) == index.is_allowed(chip, READER, datetime(2024, 1, 1, 8, 0))
+    assert publisher.stats()['allowlist_deltas'] == 1
+
+    # Once the delta outgrows the full list a new full list replaces both
+    publisher.delta_ratio = 0.5
+    seeded_db.query(User_has_group).filter_by(group_id=1).delete()
+    seeded_db.commit()
+    index.refresh()
+    publisher.publish(now=start + 4)
+    assert held("door/1/open") == {}
+    assert delta_topic("door/1/open") not in client.retained
+
+
+def test_reported_swipes_are_stored_without_answer(seeded_db):
+    """A swipe decided by the reader is stored with its time and the server's decision"""
+    index = AccessIndex(db.session_factory)
+    index.refresh()
+    handler = make_handler(access_index=index)
+    when = datetime.now().replace(microsecond=0) - timedelta(minutes=5)
+    allowed = index.is_allowed(12345, READER, when)
+    agreeing = json.dumps({"chip": "0x3039", "allowed": int(allowed), "time": when.timestamp()})
+    # A reader with an outdated (or forged) list claims the opposite
+    disagreeing = json.dumps({"chip": "12345", "allowed": int(not allowed),
+                              "time": (when + timedelta(seconds=1)).timestamp()})
+    handler.door_test(FakeMessage(report_topic(READER), agreeing))
+    handler.door_test(FakeMessage(report_topic(READER), disagreeing))
+    handler.door_test(FakeMessage(report_topic(READER), "not json"))
+    for moment in (when - timedelta(days=2), when + timedelta(hours=1)):
+        handler.door_test(FakeMessage(report_topic(READER), json.dumps(
+            {"chip": "12345", "allowed": 1, "time": moment.timestamp()})))
+
+    assert handler.client.published == []
+    cards = seeded_db.query(Card).order_by(Card.time).all()
+    expected = "1" if allowed else "0"
+    assert [(card.card_number, card.id_card_reader, card.time, card.access) for card in cards] == [
+        ("K1", 1, when, expected), ("K1", 1, when + timedelta(seconds=1), expected)]
+    assert [log.text for log in seeded_db.query(Log)] == [
+        f"Nesouhlas ctecky {READER}: karta K1 ctecka {int(not allowed)} server {int(allowed)}"]
+
+
+def test_snapshot_serves_decisions_without_database(seeded_db, tmp_path):
+    """A cold worker restores rules from the snapshot while the database is down"""
+    path = str(tmp_path / "access_snapshot.json")
+    index = AccessIndex(db.session_factory)
+    registry = ReaderRegistry(db.session_factory)
+    AccessSnapshot(path, index, registry).watch()
+    registry.refresh()
+    index.refresh()
+
+    offline = unreachable_session_factory(tmp_path)
+    cold_index, cold_registry = AccessIndex(offline), ReaderRegistry(offline)
+    assert AccessSnapshot(path, cold_index, cold_registry).restore()
+    cold_index.start(interval=3600)
+    cold_registry.start(interval=3600)
+    try:
+        assert cold_registry.lookup(READER) == registry.lookup(READER)
+        for when in (datetime(2024, 1, 1, 9, 0), datetime(2024, 1, 6, 9, 0)):
+            for chip in (12345, 67890, 99999):
+                for reader in (READER, OTHER_READER):
+                    assert cold_index.is_allowed(chip, reader, when) == index.is_allowed(chip, reader, when)
+        assert cold_index.lookup(12345) == index.lookup(12345)
+    finally:
+        cold_index.stop()
+        cold_registry.stop()
+
+
+def test_journal_replays_rows_lost_in_an_outage(seeded_db, tmp_path):
+    """Swipes decided while the database is down reach carddata exactly once"""
+    journal = SwipeJournal(str(tmp_path / "swipes.journal")).start()
+    writer = WriteBehindQueue(unreachable_session_factory(tmp_path))
+    handler = make_handler(writer=writer, journal=journal)
+    handler.door_test(FakeMessage(READER, "12345"))
+    handler.door_test(FakeMessage(READER, "99999"))
+    handler.stop()
+
+    assert writer.stats()['write_behind_failed'] == 2
+    assert [model for model, _ in journal.entries()] == [Card, Log]
+    assert journal.replay(db.session_factory) == 2
+    assert journal.replay(db.session_factory) == 0
+    assert db.session.query(Card).filter_by(card_number="K1").count() == 1
+    assert db.session.query(Log).count() == 1
+
+    size = os.path.getsize(journal.path)
+    assert journal.compact() == size
+    assert os.path.getsize(journal.path) == 0
+    assert journal.checkpoint == 0
+
+
+def test_journal_replay_skips_stored_rows_and_recent_entries(seeded_db, tmp_path):
+    """Rows the write-behind queue stored are not duplicated, young entries wait"""
+    journal = SwipeJournal(str(tmp_path / "swipes.journal"))
+    writer = WriteBehindQueue(db.session_factory)
+    handler = make_handler(writer=writer, journal=journal)
+    handler.door_test(FakeMessage(READER, "12345"))
+    writer.flush()
+
+    assert journal.replay(db.session_factory, settle=60) == 0
+    assert journal.checkpoint == 0
+    assert journal.replay(db.session_factory) == 0
+    assert journal.checkpoint == os.path.getsize(journal.path)
+    assert db.session.query(Card).count() == 1
+
+
+def test_journal_replay_of_fractional_seconds(seeded_db, tmp_path):
+    """Times are stored to the second like row_key compares them, a replay adds no duplicate"""
+    journal = SwipeJournal(str(tmp_path / "swipes.journal"))
+    moment = datetime(2024, 2, 1, 12, 0, 0, 600000)
+    values = {'card_number': "K1", 'time': moment, 'id_card_reader': 1, 'id_user': 1, 'access': "1"}
+    journal.append([(Card, values), (Log, {'time': moment, 'text': "Karta 99999 nema pristup"})])
+    seeded_db.execute(insert(Card), [values])
+    seeded_db.add(Log(time=moment, text="Karta 99999 nema pristup"))
+    seeded_db.commit()
+    seeded_db.expire_all()
+
+    assert seeded_db.query(Card.time).scalar() == datetime(2024, 2, 1, 12, 0, 0)
+    assert seeded_db.query(Log.time).scalar() == datetime(2024, 2, 1, 12, 0, 0)
+    assert journal.replay(db.session_factory) == 0
+    assert seeded_db.query(Card).count() == 1
+    assert seeded_db.query(Log).count() == 1
+
+
+def test_journal_group_commit(tmp_path):
+    """Recorded rows are fsynced together in the background"""
+    journal = SwipeJournal(str(tmp_path / "swipes.journal"), sync_interval=0.05).start()
+    swipe = {'card_number': 'K1', 'id_card_reader': 1, 'id_user': 1, 'access': True}
+    for second in range(100):
+        journal.record(Card, dict(swipe, time=datetime(2024, 1, 1, 8, 0, second % 60)))
+    assert journal.flush(timeout=5)
+    journal.stop()
+
+    assert len(list(journal.entries())) == 100
+    assert journal.syncs < 100
+
+
+
+def test_repeated_reads_reuse_the_first_decision(seeded_db):
+    """A card held against the reader is answered every time but stored once"""
+    coalescer = CoalescingWindow(window=60)
+    handler = make_handler(coalescer=coalescer)
+    for _ in range(3):
+        handler.door_test(FakeMessage(READER, "12345"))
+        handler.door_test(FakeMessage(READER, "99999"))
+    handler.door_test(FakeMessage(OTHER_READER, "12345"))
+
+    assert [topic for topic, _ in handler.client.published] == ["door/1/open"] * 3 + ["door/2/open"]
+    assert len(set(payload for topic, payload in handler.client.published if topic == "door/1/open")) == 1
+    assert db.session.query(Card).count() == 2
+    assert db.session.query(Log).count() == 1
+    assert handler.stats()['coalesce_suppressed'] == 4
+
+
+def test_coalescing_window_expires_and_stays_bounded():
+    """Entries expire after the window and the oldest are evicted first"""
+    window = CoalescingWindow(window=1.0, max_entries=2)
+    window.remember('a', True, now=0.0)
+    assert window.recent('a', now=0.5) == (True, True)
+    assert window.recent('a', now=1.0) == (False, None)
+
+    for second, key in enumerate('bcd'):
+        window.remember(key, False, now=10.0 + second / 10)
+    assert len(window) == 2
+    assert window.recent('b', now=10.3) == (False, None)
+    assert window.recent('d', now=10.3) == (True, False)
+    assert window.stats() == {'coalesce_entries': 2, 'coalesce_suppressed': 2, 'coalesce_evicted': 1}
+
+
+
+def test_flooding_reader_is_throttled_alone(seeded_db):
+    """A noisy reader loses its own messages, other doors are still answered"""
+    handler = make_handler(rate_limiter=ReaderRateLimiter(rate=0.001, burst=5, global_rate=0.001, global_burst=20))
+    handler.unknown_cards = UnknownCardSummary(handler.persist)
+    for _ in range(100):
+        handler.on_message(None, None, FakeMessage(OTHER_READER, "99999"))
+    for _ in range(3):
+        handler.on_message(None, None, FakeMessage(READER, "12345"))
+
+    assert [topic for topic, _ in handler.client.published] == ["door/1/open"] * 3
+    assert handler.rate_limiter.throttled_readers() == {OTHER_READER: 95}
+    stats = handler.stats()
+    assert stats['rate_limit_throttled'] == 95 and stats['rate_limit_global_throttled'] == 0
+
+    # The five reads that got through end up in one summary row
+    assert db.session.query(Log).count() == 0
+    handler.unknown_cards.flush()
+    assert [log.text for log in db.session.query(Log)] == ["Neznama karta 0000629145 0000099999 5x"]
+
+
+def test_token_bucket_refills_at_its_rate():
+    """Bursts are capped and tokens come back at `rate` per second"""
+    bucket = TokenBucket(rate=2, burst=3, now=0.0)
+    assert [bucket.allow(now=0.0) for _ in range(4)] == [True, True, True, False]
+    assert bucket.allow(now=0.5)
+    assert not bucket.allow(now=0.6)
+    assert bucket.idle(now=10.0)
+
+
+
+def test_async_worker_decides_swipes_on_the_event_loop(broker, seeded_db):
+    """paho runs on the event loop: swipes are answered and stored, shutdown flushes rows"""
+    index, registry = AccessIndex(db.session_factory), ReaderRegistry(db.session_factory)
+    index.refresh()
+    registry.refresh()
+    writer = WriteBehindQueue(db.session_factory, flush_interval=60).start()
+    answers = []
+
+    async def scenario():
+        handler = MQTTHandler(db.session, index, writer, readers=registry)
+        handler.unknown_cards = UnknownCardSummary(handler.persist)
+        handler.track_reader_topics().sync(registry.topics())
+        worker = await AsyncMQTTWorker(handler).start(broker.host, broker.port)
+        assert worker.dispatcher.in_memory
+        assert await worker.wait_connected(timeout=5)
+        assert wait_until(lambda: broker.subscription_count() == 2)
+
+        door = mqtt.Client()
+        door.on_message = lambda client, userdata, msg: answers.append((msg.topic, msg.payload))
+        door.connect(broker.host, broker.port)
+        door.subscribe("door/+/open")
+        door.loop_start()
+        try:
+            await asyncio.sleep(0.1)
+            for _ in range(5):
+                door.publish(READER, payload="12345")
+                door.publish(OTHER_READER, payload="99999")
+            for _ in range(100):
+                if len(answers) == 5:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            door.loop_stop()
+            await worker.stop()
+        assert worker.dispatcher.stats()['dispatcher_processed'] == 10
+        assert handler.client.on_socket_open is not None
+
+    asyncio.run(scenario())
+    assert len(answers) == 5 and {topic for topic, _ in answers} == {"door/1/open"}
+    # Rows waiting in the write-behind queue and the unknown-card summary were flushed by stop()
+    assert db.session.query(Card).count() == 5
+    assert [log.text for log in db.session.query(Log)] == ["Neznama karta 0000629145 0000099999 5x"]
+
+
+
+def test_async_dispatcher_keeps_inline_commits_off_the_loop(seeded_db):
+    """door_test runs on the loop only when every row it stores goes through a queue"""
+    index, registry = AccessIndex(db.session_factory), ReaderRegistry(db.session_factory)
+    index.refresh()
+    registry.refresh()
+    writer = WriteBehindQueue(db.session_factory, flush_interval=60)
+
+    def decided_on_loop(**kwargs):
+        handler = make_handler(access_index=index, readers=registry, **kwargs)
+        threads = []
+
+        async def scenario():
+            with ThreadPoolExecutor(1) as executor:
+                dispatcher = AsyncDispatcher(handler, asyncio.get_running_loop(), executor)
+                handler.door_test = lambda msg: threads.append(threading.current_thread())
+                dispatcher.submit(FakeMessage(READER, "12345"))
+                await dispatcher.drain()
+            return dispatcher.in_memory
+
+        in_memory = asyncio.run(scenario())
+        assert in_memory == (threads == [threading.main_thread()])
+        return in_memory
+
+    # Inline commits of Card rows or of unknown-card Log rows go to the executor
+    assert not decided_on_loop()
+    assert not decided_on_loop(writer=writer)
+    assert not decided_on_loop(unknown_cards=UnknownCardSummary(lambda model, values: None))
+    assert decided_on_loop(writer=writer, unknown_cards=UnknownCardSummary(writer.submit))
+    writer.stop()
+
+
+def test_door_test_records_stages_and_outcomes(seeded_db):
+    """Every stage is timed, outcomes are counted and rendered for Prometheus"""
+    registry = MetricsRegistry()
+    metrics = DoorMetrics(registry)
+    index, readers = AccessIndex(db.session_factory), ReaderRegistry(db.session_factory)
+    index.refresh()
+    readers.refresh()
+    handler = make_handler(access_index=index, readers=readers, metrics=metrics)
+    handler.door_test(FakeMessage(READER, "12345"))
+    handler.door_test(FakeMessage(READER, "99999"))
+    handler.door_test(FakeMessage(READER, "zz"))
+    handler.door_test(FakeMessage("0000000999", "12345"))
+
+    metrics.fold()
+    for stage in ('queue', 'reader_lookup', 'parse', 'user_lookup', 'decision', 'publish', 'persist'):
+        assert metrics.stages.count(stage) >= 1, stage
+    decided = metrics.outcomes.value('allowed') + metrics.outcomes.value('denied')
+    assert (decided, metrics.outcomes.value('unknown_card')) == (1, 1)
+    assert metrics.outcomes.value('invalid_payload') == metrics.outcomes.value('unknown_reader') == 1
+    assert set(metrics.reader_quantiles()) == {READER}
+
+    text = registry.render()
+    assert 'karty_door_latency_seconds_count 1' in text
+    assert 'karty_door_latency_quantile_seconds{quantile="0.99"}' in text
+    # Reader topics are only served behind the API login
+    assert READER not in text
+    assert 'karty_door_stage_seconds_bucket{stage="decision",le="+Inf"} 1' in text
+
+
+def test_histogram_quantiles_follow_the_buckets():
+    """Quantiles are interpolated inside the bucket holding the rank"""
+    histogram = Histogram('latency', 'test', buckets=(0.001, 0.01, 0.1))
+    for _ in range(90):
+        histogram.observe(0.0005)
+    for _ in range(10):
+        histogram.observe(0.05)
+    assert histogram.quantile(0.5) == pytest.approx(0.5 / 0.9 * 0.001)
+    assert 0.01 < histogram.quantile(0.95) < 0.1
+    assert histogram.quantile(0.5, 'unknown') is None
+
+
+def test_door_decisions_are_logged_as_json(seeded_db, caplog):
+    """One structured swipe record per decision, without the raw chip number"""
+    index = AccessIndex(db.session_factory)
+    index.refresh()
+    handler = make_handler(access_index=index)
+    with caplog.at_level(logging.INFO, logger=SWIPE_LOGGER):
+        handler.door_test(FakeMessage(READER, "12345"))
+
+    record, = [r for r in caplog.records if r.name == SWIPE_LOGGER]
+    data = json.loads(JsonFormatter().format(record))
+    assert (data['reader'], data['chip']) == (READER, chip_hash(12345))
+    assert data['decision'] in ('allowed', 'denied')
+    assert data['latency_ms'] >= 0
+    assert '12345' not in json.dumps(data)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])